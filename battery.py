@@ -2,26 +2,68 @@
 # Written by Paul Wayper
 # Licensed under the GPL V3
 
+from bisect import bisect_right
+import math
+
+import numpy as np
+
+from chemistry import OCVCurve, default_curve
+
+
 class Battery(object):
     """
     A simulated battery that can be charged and discharged in amp-hours,
     and outputs its voltage according to the state of charge.
+
+    The voltage comes from the battery's open-circuit voltage `curve`, and
+    is cached until the charge state, or anything else it depends on,
+    changes.  If the battery has an
+    internal `resistance`, the current it takes tapers off as its voltage
+    nears the charging voltage, as a real battery's does.
     """
     capacity = 10  # amp-hours
-    charge_state = 5
+    _charge_state = 5
+    _voltage = None  # cached until the charge state or the below change
+    _voltage_key = None  # the below, as they were when it was cached
     cells = 1  # number of cells
     minimum_voltage = 3.0  # volts
     maximum_voltage = 4.2  # volts
+    curve = default_curve
+    resistance = 0.0  # ohms, for the whole pack
 
-    def __init__(self, capacity: float, cells: int):
+    def __init__(self, capacity: float, cells: int, curve: OCVCurve = None):
         """
         Set up a new battery, with capacity given in amp-hours.
 
-        The battery starts at 50% capacity, and the storage voltage.
+        The battery starts at 50% capacity, and the storage voltage.  If a
+        `curve` is given, the battery's voltage follows it, and the minimum
+        and maximum voltages per cell are taken from it.
         """
         self.capacity = capacity
         self.charge_state = capacity / 2  # Start at half capacity
         self.cells = cells
+        if curve is not None:
+            self.curve = curve
+            self.minimum_voltage = curve.minimum_voltage
+            self.maximum_voltage = curve.maximum_voltage
+
+    @property
+    def charge_state(self) -> float:
+        return self._charge_state
+
+    @charge_state.setter
+    def charge_state(self, value: float):
+        self._charge_state = value
+        self._voltage = None
+
+    def charge_at_voltage(self, volts: float) -> float:
+        """
+        The charge state, in amp-hours, at which the battery reaches the
+        given voltage.  This is clamped to between zero and the capacity.
+        """
+        vrange = self.maximum_voltage - self.minimum_voltage
+        level = (volts / self.cells - self.minimum_voltage) / vrange
+        return self.curve.soc_at(level) * self.capacity
 
     def charge(self, volts: float, amps: float, seconds: float):
         """
@@ -29,47 +71,274 @@ class Battery(object):
         number of seconds.  Will not over-charge the battery.
 
         Will not charge if the given voltage is less than the battery's
-        voltage.  However, this is only checked at the start of the charge
-        period - it does not attempt to predict when the battery might
-        'float' at that charge.  Calls with large numbers of seconds may push
-        the battery over the input volts, but will not go over the battery's
-        capacity.
+        voltage.  If the battery reaches the given voltage (or its capacity)
+        part way through the period, charging stops at that point, so large
+        numbers of seconds give the same result as many small steps.
 
-        No real attention to 'power' in watts or yet.
+        With an internal `resistance`, the current is limited to what the
+        difference between the given voltage and the battery's voltage drives
+        through it, so it tapers off as the battery nears the given voltage.
+
+        Returns a tuple of the amp-hours actually taken and the seconds
+        spent charging.  No real attention to 'power' in watts or yet.
         """
         if self.voltage > volts:
-            return
-        self.charge_state += (amps * seconds) / 3600
-        if self.charge_state > self.capacity:
-            self.charge_state = self.capacity
+            return (0.0, 0.0)
+        if self.resistance:
+            return self._charge_through_resistance(volts, amps, seconds)
+        return self._charge_until(volts, amps, seconds)
+
+    def _charge_until(self, volts: float, amps: float, seconds: float):
+        offered = (amps * seconds) / 3600
+        limit = min(self.charge_at_voltage(volts), self.capacity)
+        if self.charge_state + offered <= limit:
+            self.charge_state += offered
+            return (offered, seconds)
+        # Stop where the battery reaches the voltage
+        taken = max(limit - self.charge_state, 0)
+        self.charge_state += taken
+        return (taken, taken * 3600 / amps if amps else 0.0)
+
+    def _charge_through_resistance(self, volts: float, amps: float, seconds: float):
+        # The full current flows until the battery is that current's drop
+        # across the resistance short of the voltage
+        taken, spent = (0.0, 0.0)
+        full_current = volts - amps * self.resistance
+        if self.voltage <= full_current:
+            taken, spent = self._charge_until(full_current, amps, seconds)
+        # From there the current is the voltage left over the resistance.
+        # Along each straight piece of the voltage curve, that gap shrinks
+        # exponentially, so each piece is crossed (or stopped part way
+        # along) in one go, however long the period.
+        curve = self.curve
+        vrange = self.maximum_voltage - self.minimum_voltage
+        piece = bisect_right(curve.soc, self.charge_state / self.capacity) - 1
+        while spent < seconds and piece < len(curve.soc) - 1:
+            gap = volts - self.voltage
+            if gap <= 0:
+                break
+            left = seconds - spent
+            end = curve.soc[piece + 1] * self.capacity
+            end_gap = volts - (
+                curve.level[piece + 1] * vrange + self.minimum_voltage
+            ) * self.cells
+            # Volts per amp-hour along this piece
+            slope = (
+                (curve.level[piece + 1] - curve.level[piece]) * vrange * self.cells
+                / ((curve.soc[piece + 1] - curve.soc[piece]) * self.capacity)
+            )
+            # The gap falls by a factor of e every `tau` seconds
+            tau = 3600 * self.resistance / slope
+            needed = tau * math.log(gap / end_gap) if end_gap > 0 else math.inf
+            if needed >= left:
+                added = gap * -math.expm1(-left / tau) / slope
+                self.charge_state += added
+                taken += added
+                spent = seconds
+                break
+            taken += end - self.charge_state
+            self.charge_state = end
+            spent += needed
+            piece += 1
+        return (taken, spent)
 
-    def discharge(self, amps: float, seconds: float):
+    def terminal_voltage(self, amps: float) -> float:
+        """
+        The voltage across the battery while it takes the given current,
+        allowing for its internal resistance.
+        """
+        return self.voltage + amps * self.resistance
+
+    def discharge(self, amps: float, seconds: float, volts: float = 0):
         """
         Subtract amp-hours from the battery, by producing the given amps over
         the given number of seconds.  Will not discharge the battery below
-        zero charge.
+        zero charge, or below the given cut-off voltage if there is one.
+
+        Returns a tuple of the amp-hours actually produced and the seconds
+        spent discharging.
         """
-        self.charge_state -= (amps * seconds) / 3600
-        if self.charge_state < 0:
-            self.charge_state = 0
+        if self.voltage < volts:
+            return (0.0, 0.0)
+        offered = (amps * seconds) / 3600
+        limit = self.charge_at_voltage(volts) if volts else 0
+        if self.charge_state - offered >= limit:
+            self.charge_state -= offered
+            return (offered, seconds)
+        given = max(self.charge_state - limit, 0)
+        self.charge_state -= given
+        return (given, given * 3600 / amps if amps else 0.0)
 
     @property
     def voltage(self) -> float:
         """
         Output the current voltage of the battery, based on its state of
-        charge.
+        charge, from the battery's voltage curve.
+        """
+        # Checking these here, rather than when they're set, keeps setting
+        # and reading them as quick as any other attribute
+        key = (
+            self.capacity, self.cells, self.minimum_voltage, self.maximum_voltage,
+            self.curve
+        )
+        if self._voltage is None or key != self._voltage_key:
+            vrange = self.maximum_voltage - self.minimum_voltage
+            level = self.curve.level_at(self.charge_state / self.capacity)
+            self._voltage = (level * vrange + self.minimum_voltage) * self.cells
+            self._voltage_key = key
+        return self._voltage
+
+    def __repr__(self):
+        return f"{self.capacity}Ah {self.cells}S battery with {self.charge_state:.3f}Ah charge"
+
+
+class BatteryBank(object):
+    """
+    A bank of simulated batteries, with their capacities, cells, charge
+    states and voltage limits held in arrays so that thousands of packs can
+    be charged, discharged and measured at once.
+
+    `capacity` and `cells` may be single values or sequences, and are
+    broadcast against each other (or against `count`) to give the number of
+    batteries.  As with `Battery`, each starts at 50% capacity, and all
+    follow the same voltage `curve`.  Indexing the bank gives a view of a
+    single battery that acts like a `Battery`.
+
+    The batteries in a bank have no internal resistance: each takes the
+    full current until it reaches the given voltage, as a `Battery` with
+    no `resistance` does.
+    """
+
+    def __init__(
+        self, capacity, cells, count: int = None, curve: OCVCurve = None
+    ):
+        shape = np.broadcast_shapes(np.shape(capacity), np.shape(cells))
+        if count is not None:
+            shape = np.broadcast_shapes(shape, (count,))
+        if len(shape) != 1:
+            raise ValueError(f"Can't make a one-dimensional bank from {shape}")
+        self.capacity = np.broadcast_to(np.asarray(capacity, dtype=np.float64), shape).copy()
+        self.cells = np.broadcast_to(np.asarray(cells, dtype=np.int64), shape).copy()
+        self.charge_state = self.capacity / 2  # Start at half capacity
+        self.curve = curve if curve is not None else Battery.curve
+        minimum, maximum = Battery.minimum_voltage, Battery.maximum_voltage
+        if curve is not None:
+            minimum, maximum = curve.minimum_voltage, curve.maximum_voltage
+        self.minimum_voltage = np.full(shape, minimum)
+        self.maximum_voltage = np.full(shape, maximum)
+
+    def __len__(self):
+        return len(self.capacity)
+
+    def charge_at_voltage(self, volts) -> np.ndarray:
+        """
+        The charge state of every battery, in amp-hours, at which it reaches
+        the given voltage, as `Battery.charge_at_voltage`.
+        """
+        vrange = self.maximum_voltage - self.minimum_voltage
+        level = (np.divide(volts, self.cells) - self.minimum_voltage) / vrange
+        soc = np.interp(level, self.curve.level_array, self.curve.soc_array)
+        return soc * self.capacity
 
-        This uses a hand-tuned cubic formula to simulate the voltage curve of
-        a LiIon battery, with a flat but gradual increase in the centre and
-        steep drop and climb at either end of charging.  So I can't really
-        explain why these constants, but they seem to work.
+    def charge(self, volts, amps, seconds):
+        """
+        Add amp-hours to every battery, as `Battery.charge` does.  The given
+        `volts`, `amps` and `seconds` may be single values or arrays, one
+        per battery.  Batteries already over the given voltage are not
+        charged, and each stops charging when it reaches the voltage or its
+        capacity.
+
+        Returns arrays of the amp-hours each battery took and the seconds
+        each spent charging.
+        """
+        charging = self.voltage <= volts
+        offered = np.multiply(amps, seconds) / 3600
+        room = np.minimum(self.charge_at_voltage(volts), self.capacity) - self.charge_state
+        taken = np.where(charging, np.clip(room, 0, offered), 0)
+        self.charge_state += taken
+        spent = np.where(
+            taken < offered, taken * 3600 / np.where(amps, amps, 1), seconds
+        )
+        return (taken, np.where(charging, spent, 0))
+
+    def discharge(self, amps, seconds, volts=0):
+        """
+        Subtract amp-hours from every battery, as `Battery.discharge` does,
+        without going below zero charge or the given cut-off voltage.
+
+        Returns arrays of the amp-hours each battery produced and the
+        seconds each spent discharging.
+        """
+        discharging = self.voltage >= volts
+        offered = np.multiply(amps, seconds) / 3600
+        floor = np.where(np.asarray(volts) > 0, self.charge_at_voltage(volts), 0)
+        given = np.where(discharging, np.clip(self.charge_state - floor, 0, offered), 0)
+        self.charge_state -= given
+        spent = np.where(
+            given < offered, given * 3600 / np.where(amps, amps, 1), seconds
+        )
+        return (given, np.where(discharging, spent, 0))
+
+    @property
+    def voltage(self) -> np.ndarray:
+        """
+        The voltage of every battery, from the bank's voltage curve.
         """
         vrange = self.maximum_voltage - self.minimum_voltage
-        frac_charge = (self.charge_state / self.capacity) - 0.5  # range -0.5 to 0.5
-        return (
-            (frac_charge ** 3 * 3.6 + frac_charge * 0.1 + 0.5)
-             * vrange + self.minimum_voltage
-        ) * self.cells
+        level = np.interp(
+            self.charge_state / self.capacity,
+            self.curve.soc_array, self.curve.level_array
+        )
+        return (level * vrange + self.minimum_voltage) * self.cells
+
+    def __getitem__(self, index: int) -> 'BankBattery':
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Battery {index} not in bank of {len(self)}")
+        return BankBattery(self, index % len(self))
+
+    def __iter__(self):
+        return (BankBattery(self, index) for index in range(len(self)))
 
     def __repr__(self):
-        return f"{self.capacity}Ah {self.cells}S battery with {self.charge_state:.3f}Ah charge"
+        return f"Bank of {len(self)} batteries with {self.charge_state.sum():.3f}Ah charge"
+
+
+def _bank_attribute(name: str, kind: type):
+    """
+    A property that reads and writes one battery's entry in the bank's
+    array of that name.
+    """
+    def getter(self):
+        return kind(getattr(self.bank, name)[self.index])
+
+    def setter(self, value):
+        getattr(self.bank, name)[self.index] = value
+
+    return property(getter, setter)
+
+
+class BankBattery(Battery):
+    """
+    One battery in a `BatteryBank`.  This acts just like a `Battery`, but
+    keeps its state in the bank's arrays - so its voltage is not cached, as
+    the bank can change its charge state.
+    """
+    capacity = _bank_attribute('capacity', float)
+    charge_state = _bank_attribute('charge_state', float)
+    cells = _bank_attribute('cells', int)
+    minimum_voltage = _bank_attribute('minimum_voltage', float)
+    maximum_voltage = _bank_attribute('maximum_voltage', float)
+
+    def __init__(self, bank: BatteryBank, index: int):
+        self.bank = bank
+        self.index = index
+
+    @property
+    def curve(self) -> OCVCurve:
+        return self.bank.curve
+
+    @property
+    def voltage(self) -> float:
+        vrange = self.maximum_voltage - self.minimum_voltage
+        level = self.curve.level_at(self.charge_state / self.capacity)
+        return (level * vrange + self.minimum_voltage) * self.cells
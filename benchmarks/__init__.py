@@ -0,0 +1,2 @@
+# Benchmarks for pyelcon - run each one with `python -m benchmarks.<name>`
+# Licensed under the GPL V3
@@ -0,0 +1,68 @@
+# Compare a list of Battery objects with a BatteryBank.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.battery [packs] [ticks]` from the top
+# directory.
+
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from battery import Battery, BatteryBank
+
+
+def charge_to_voltage(step: float):
+    """
+    Charge a battery from half full up to 4.1V per cell in steps of the
+    given number of seconds, and return the time and number of steps taken
+    and the final charge state.
+    """
+    bat = Battery(10, cells=30)
+    steps = 0
+    start = perf_counter()
+    while bat.charge(123.0, 5, step)[1] == step:
+        steps += 1
+    return perf_counter() - start, steps, bat.charge_state
+
+
+def main(packs: int = 10_000, ticks: int = 100):
+    rng = np.random.default_rng(0)
+    capacity = rng.uniform(2, 100, packs)
+    cells = rng.integers(1, 40, packs)
+    volts = cells * 4.1
+    amps = capacity / 4
+
+    bats = [Battery(cap, cells=n) for cap, n in zip(capacity.tolist(), cells.tolist())]
+    start = perf_counter()
+    for _ in range(ticks):
+        for bat, v, i in zip(bats, volts.tolist(), amps.tolist()):
+            bat.charge(v, i, 1)
+            bat.voltage
+    scalar = perf_counter() - start
+
+    bank = BatteryBank(capacity, cells)
+    start = perf_counter()
+    for _ in range(ticks):
+        bank.charge(volts, amps, 1)
+        bank.voltage
+    batch = perf_counter() - start
+
+    np.testing.assert_allclose(bank.charge_state, [b.charge_state for b in bats])
+    steps = packs * ticks
+    print(
+        f"{packs} packs x {ticks} ticks: list {scalar:.3f}s "
+        f"({steps / scalar:,.0f} pack-ticks/s), bank {batch:.3f}s "
+        f"({steps / batch:,.0f} pack-ticks/s), {scalar / batch:.0f}x faster"
+    )
+
+    for step in (1, 60, 600):
+        elapsed, steps, charge_state = charge_to_voltage(step)
+        print(
+            f"Charge to 123V in {step}s steps: {steps} steps in "
+            f"{elapsed * 1000:.2f}ms, ending at {charge_state:.9f}Ah"
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
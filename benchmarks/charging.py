@@ -0,0 +1,87 @@
+# Compare a fixed setpoint against the closed-loop CC/CV profile, reacting
+# to each status at once or only on the next tick, on the simulated
+# charger and battery.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.charging` from the top directory.
+
+import asyncio
+import logging
+
+from battery import Battery
+from charging import CCCVProfile
+from clock import VirtualClock
+from driver import ChargerDriver
+from loopback import LoopbackBus
+from simulator import ElconCharger
+
+volts = 16.4
+amps = 5
+termination_amps = 0.5
+session_seconds = 3 * 3600
+# Enough for the current to taper off over the last part of the charge
+resistance = 0.05
+
+
+async def session(profile=None, immediate=True):
+    """
+    Charge a half-full battery, and return the time the charge finished
+    (when the charger stopped, or first reported the termination current),
+    the charge it finished with, the longest a new setpoint from the profile
+    waited to be sent, the median time for the charger to reach each new
+    setpoint, and the commands sent.
+    """
+    asyncio.get_running_loop().set_debug(False)
+    clock = VirtualClock()
+    bus = LoopbackBus()
+    battery = Battery(capacity=10, cells=4)
+    battery.resistance = resistance
+    driver = ChargerDriver(bus.end(), clock=clock)
+    driver.verbose = False
+    driver.volts = volts
+    driver.amps = amps
+    driver.profile = profile
+    driver.profile_immediate = immediate
+    charger = ElconCharger(bus.end(), battery, clock=clock)
+    charger.verbose = False
+    driver.start()
+    tasks = [
+        asyncio.create_task(driver.main()),
+        asyncio.create_task(charger.main()),
+    ]
+    finished = None
+    while clock.now() < session_seconds and finished is None:
+        await clock.run(until=clock.now() + 1)
+        status = driver.statuses[-1] if driver.statuses else None
+        if not driver.running:
+            finished = clock.now()
+        elif profile is None and status is not None and clock.now() > 10 \
+                and status.current <= termination_amps:
+            finished = clock.now()
+    for task in tasks:
+        task.cancel()
+    return (
+        finished, battery.charge_state, driver.profile_reaction.percentile(100) or 0.0,
+        driver.setpoint_latency.percentile(50), driver.transmit.sent,
+    )
+
+
+def main():
+    logging.disable(logging.WARNING)
+    for name, profile, immediate in (
+        ('fixed setpoint', None, True),
+        ('CC/CV on tick', CCCVProfile(volts, amps, termination_amps), False),
+        ('CC/CV on status', CCCVProfile(volts, amps, termination_amps), True),
+    ):
+        finished, charge, reaction, latency, sent = asyncio.run(
+            session(profile, immediate)
+        )
+        print(
+            f"{name:16s} finished at {finished:8.1f}s with {charge:.4f}Ah, "
+            f"setpoints sent within {reaction:.3f}s, reached in {latency:.3f}s "
+            f"(median), {sent} commands"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Compare the scalar and batch Elcon frame codecs.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.codec [frames]` from the top directory.
+
+import sys
+from time import perf_counter
+
+from can import Message
+import numpy as np
+
+from utils import ElconUtils, elcon_broadcast_id, elcon_charger_id, elcon_manager_id
+
+
+def make_frames(count: int, seed: int = 0):
+    """
+    Make `count` random charger statuses, as arrays of arbitration IDs
+    and data bytes.
+    """
+    rng = np.random.default_rng(seed)
+    eu = ElconUtils(elcon_charger_id)
+    ids, data = eu.pack_command_array(
+        elcon_broadcast_id,
+        rng.uniform(1, 150, count), rng.uniform(0, 20, count),
+    )
+    data[:, 4] = rng.integers(0, 0x20, len(data))
+    return ids, data
+
+
+def bench_unpack(count: int):
+    ids, data = make_frames(count)
+    msgs = [
+        Message(arbitration_id=int(i), data=bytes(d), is_extended_id=True)
+        for i, d in zip(ids, data)
+    ]
+    eu = ElconUtils(elcon_manager_id)
+
+    start = perf_counter()
+    for msg in msgs:
+        eu.unpack_status(msg)
+    scalar = perf_counter() - start
+
+    raw = data.tobytes()
+    start = perf_counter()
+    eu.unpack_status_array(ids, raw)
+    batch = perf_counter() - start
+    return scalar, batch
+
+
+def bench_pack(count: int):
+    rng = np.random.default_rng(1)
+    volts = rng.uniform(1, 150, count)
+    amps = rng.uniform(0, 20, count)
+    eu = ElconUtils(elcon_manager_id)
+
+    start = perf_counter()
+    for v, i in zip(volts.tolist(), amps.tolist()):
+        eu.pack_command(elcon_charger_id, v, i, True)
+    scalar = perf_counter() - start
+
+    start = perf_counter()
+    eu.pack_command_array(elcon_charger_id, volts, amps, True)
+    batch = perf_counter() - start
+    return scalar, batch
+
+
+def main(count: int = 1_000_000):
+    for name, bench in (('unpack', bench_unpack), ('pack', bench_pack)):
+        scalar, batch = bench(count)
+        print(
+            f"{name:6s} {count} frames: scalar {scalar:.3f}s "
+            f"({count / scalar:,.0f}/s), batch {batch:.3f}s "
+            f"({count / batch:,.0f}/s), {scalar / batch:.0f}x faster"
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
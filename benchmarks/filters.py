@@ -0,0 +1,77 @@
+# Measure the CPU time the driver's CANBUS filters save on a busy bus.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.filters [interface channel]` from the top
+# directory; the default is python-can's `virtual` interface.  With
+# `socketcan vcan0` the unrelated traffic is dropped by the kernel.
+
+import asyncio
+import sys
+import threading
+from time import perf_counter, process_time
+
+import can
+
+from utils import ElconUtils, elcon_charger_id, elcon_manager_id
+
+flood_frames = 100_000
+
+
+def flood(bus, count: int):
+    """
+    Send `count` frames between addresses the driver doesn't care about,
+    then one status from the charger to tell the receiver to stop.
+    """
+    noise = ElconUtils(our_id=0x10)
+    for i in range(count):
+        bus.send(noise.pack_command(0x20 + (i % 16), 12.0, 1.0, True))
+    bus.send(ElconUtils(our_id=elcon_charger_id).pack_command(
+        elcon_manager_id, 120.0, 10.0, True
+    ))
+
+
+async def receive(interface: str, channel: str, filtered: bool):
+    """
+    Receive the flood as `ChargerDriver.receive_status` does, and return the
+    wall and CPU time taken to get through it, and the number of frames the
+    decoder had to reject.
+    """
+    utils = ElconUtils(our_id=elcon_manager_id)
+    receiver = can.Bus(channel, interface=interface)
+    sender = can.Bus(channel, interface=interface)
+    if filtered:
+        receiver.set_filters(utils.can_filters(sources=(elcon_charger_id,)))
+    reader = can.AsyncBufferedReader()
+    notifier = can.Notifier(receiver, [reader], loop=asyncio.get_running_loop())
+
+    wall, cpu = perf_counter(), process_time()
+    thread = threading.Thread(target=flood, args=(sender, flood_frames))
+    thread.start()
+    async for msg in reader:
+        status = utils.decode_status(msg)
+        if status is not None and status.source == elcon_charger_id:
+            break
+    wall, cpu = perf_counter() - wall, process_time() - cpu
+
+    thread.join()
+    notifier.stop()
+    receiver.shutdown()
+    sender.shutdown()
+    return wall, cpu, utils.rejected
+
+
+def main(interface: str = 'virtual', channel: str = 'pyelcon-bench'):
+    results = {}
+    for filtered in (False, True):
+        wall, cpu, rejected = asyncio.run(receive(interface, channel, filtered))
+        results[filtered] = cpu
+        print(
+            f"{'filtered' if filtered else 'unfiltered':10s} "
+            f"{flood_frames} unrelated frames on {interface}: "
+            f"{wall:.3f}s wall, {cpu:.3f}s CPU, {rejected} rejected in Python"
+        )
+    print(f"CPU saved by filters: {1 - results[True] / results[False]:.0%}")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
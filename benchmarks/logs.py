@@ -0,0 +1,82 @@
+# Measure what logging each status costs the event loop thread, printing
+# straight to a slow terminal against logging through the queue.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.logs [messages]` from the top directory.
+
+import io
+import logging
+import sys
+import time
+from time import perf_counter
+
+import logs
+
+messages = 20_000
+# How long the terminal (or journald) takes to take each line
+write_delay = 0.000_05
+
+
+class SlowStream(io.TextIOBase):
+    """
+    A stream that takes `write_delay` seconds to write each line, without
+    holding the interpreter lock, as a real write to a terminal would.
+    """
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        lines = text.count('\n')
+        self.lines += lines
+        if lines:
+            time.sleep(write_delay * lines)
+        return len(text)
+
+
+def status_args(i: int):
+    return (100 + (i % 50) / 10, 5.0, 'OK', 'OK', 'OK', 'OK', 'OK')
+
+
+def bench_print(count: int) -> float:
+    stream = SlowStream()
+    start = perf_counter()
+    for i in range(count):
+        args = status_args(i)
+        print(
+            f"Received from charger: {args[0]:.2f}V {args[1]:.2f}A "
+            f"HW={args[2]} Temp={args[3]} Vin={args[4]} Bat={args[5]} T/O={args[6]}",
+            file=stream
+        )
+    return (perf_counter() - start) / count
+
+
+def bench_logging(count: int, rate: int):
+    stream = SlowStream()
+    listener = logs.start_logging(
+        handler=logging.StreamHandler(stream), rate=rate
+    )
+    log = logging.getLogger('driver')
+    start = perf_counter()
+    for i in range(count):
+        log.info(
+            "Received from charger: %.2fV %.2fA "
+            "HW=%s Temp=%s Vin=%s Bat=%s T/O=%s", *status_args(i)
+        )
+    elapsed = perf_counter() - start
+    logs.stop_logging(listener)
+    return elapsed / count, stream.lines
+
+
+def main(count: int = messages):
+    per_print = bench_print(count)
+    print(f"print() to a slow terminal:   {per_print * 1e6:8.2f} us/message on the loop")
+    for rate in (count, 5):
+        per_log, lines = bench_logging(count, rate)
+        print(
+            f"queued logging, {rate:>6} a second: {per_log * 1e6:8.2f} us/message "
+            f"on the loop, {lines} lines written"
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
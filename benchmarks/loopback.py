@@ -0,0 +1,77 @@
+# Measure frames per second through the driver <-> simulator loop, on the
+# in-process loopback bus and on a CANBUS interface.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.loopback [interface channel]` from the top
+# directory; the default compares against `socketcan vcan0`, and is skipped
+# if that isn't available.
+
+import asyncio
+import sys
+from time import perf_counter
+
+import can
+
+from loopback import LoopbackBus, open_reader
+from utils import ElconUtils, elcon_broadcast_id, elcon_charger_id, elcon_manager_id
+
+round_trips = 20_000
+
+
+async def ping_pong(driver_bus, charger_bus, count: int) -> float:
+    """
+    Send `count` commands from the driver's side, each answered by a status
+    from the charger's side as the simulator does, and return the frames
+    per second through the loop.
+    """
+    manager = ElconUtils(our_id=elcon_manager_id)
+    charger = ElconUtils(our_id=elcon_charger_id)
+    driver_bus.set_filters(manager.can_filters(sources=(elcon_charger_id,)))
+    charger_bus.set_filters(charger.can_filters(sources=(elcon_manager_id,)))
+    driver_reader, driver_notifier = open_reader(driver_bus)
+    charger_reader, charger_notifier = open_reader(charger_bus)
+
+    async def answer():
+        async for msg in charger_reader:
+            command = charger.decode_status(msg)
+            charger_bus.send(charger.pack_command(
+                elcon_broadcast_id, command.voltage, command.current, True
+            ))
+
+    answering = asyncio.create_task(answer())
+    start = perf_counter()
+    for i in range(count):
+        driver_bus.send(manager.pack_command(
+            elcon_charger_id, 100 + (i % 50), 5, True
+        ))
+        status = manager.decode_status(await driver_reader.__anext__())
+        assert status.source == elcon_charger_id
+    elapsed = perf_counter() - start
+    answering.cancel()
+    for notifier in (driver_notifier, charger_notifier):
+        if notifier is not None:
+            notifier.stop()
+    return 2 * count / elapsed
+
+
+def main(interface: str = 'socketcan', channel: str = 'vcan0'):
+    bus = LoopbackBus()
+    fps = asyncio.run(ping_pong(bus.end(), bus.end(), round_trips))
+    print(f"{'loopback':24s} {fps:12,.0f} frames/s")
+    try:
+        driver_bus = can.Bus(channel, interface=interface)
+        charger_bus = can.Bus(channel, interface=interface)
+    except (can.CanError, OSError, ImportError) as e:
+        print(f"{interface + ' ' + channel:24s} skipped: {e}")
+        return
+    try:
+        compared = asyncio.run(ping_pong(driver_bus, charger_bus, round_trips))
+    finally:
+        driver_bus.shutdown()
+        charger_bus.shutdown()
+    print(f"{interface + ' ' + channel:24s} {compared:12,.0f} frames/s")
+    print(f"Loopback speed-up: {fps / compared:.1f}x")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
@@ -0,0 +1,63 @@
+# Measure the event loop time and broker messages that publishing charger
+# statuses to MQTT costs, publishing each status as it comes against the
+# batched, change-only bridge, as the number of chargers grows.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.mqttbridge [seconds]` from the top
+# directory.
+
+import asyncio
+import json
+import sys
+from time import perf_counter
+
+from clock import VirtualClock
+from mqttbridge import LocalBroker, TelemetryBridge
+
+seconds = 60
+
+
+def statuses(count: int, second: int):
+    # Chargers at a steady 5A, their voltage creeping up as they charge
+    for address in range(count):
+        yield f"charger/{address:02x}", 100 + second / 100 + address / 1000, 5.0, 0
+
+
+def bench_each(count: int, duration: int):
+    broker = LocalBroker()
+    start = perf_counter()
+    for second in range(duration):
+        for key, voltage, current, flags in statuses(count, second):
+            broker.publish(f"pyelcon/{key}", json.dumps(
+                {'voltage': voltage, 'current': current, 'flags': flags}
+            ))
+    return perf_counter() - start, len(broker.messages)
+
+
+async def bench_bridge(count: int, duration: int):
+    broker = LocalBroker()
+    clock = VirtualClock()
+    bridge = TelemetryBridge(broker, clock=clock)
+    on_loop = 0.0
+    for second in range(duration):
+        start = perf_counter()
+        for key, voltage, current, flags in statuses(count, second):
+            bridge.update(key, voltage, current, flags)
+        on_loop += perf_counter() - start
+        await bridge.flush()
+    return on_loop, len(broker.messages)
+
+
+def main(duration: int = seconds):
+    for count in (10, 100, 254):
+        each, each_messages = bench_each(count, duration)
+        bridged, bridge_messages = asyncio.run(bench_bridge(count, duration))
+        print(
+            f"{count:4d} chargers: each status {each / duration * 1e3:7.3f} ms/s on "
+            f"the loop, {each_messages / duration:6.1f} msg/s; bridge "
+            f"{bridged / duration * 1e3:7.3f} ms/s, {bridge_messages / duration:5.2f} msg/s"
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
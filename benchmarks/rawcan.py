@@ -0,0 +1,143 @@
+# Measure statuses per second received through python-can's Notifier and
+# AsyncBufferedReader, against the raw socket reader, on a CAN interface.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.rawcan [channel [frames]]` from the top
+# directory; the default channel is vcan0, and the comparison on it is
+# skipped if it isn't available.  Decoding from a buffer of frames, with
+# and without making a `can.Message` of each, is measured either way.
+
+import asyncio
+import socket
+import sys
+from struct import Struct
+from time import perf_counter
+
+import can
+
+import rawcan
+from utils import ElconUtils, elcon_charger_id, elcon_manager_id
+
+frames = 100_000
+_frame_struct = Struct('=IB3x8s')
+
+
+def status_frames(count: int) -> list:
+    charger = ElconUtils(our_id=elcon_charger_id)
+    return [
+        charger.pack_command(elcon_manager_id, 100 + (i % 50), 5, True)
+        for i in range(count)
+    ]
+
+
+def raw_frame(msg: can.Message) -> bytes:
+    # As the kernel gives it to a CAN_RAW socket
+    return _frame_struct.pack(
+        msg.arbitration_id | rawcan.CAN_EFF_FLAG, len(msg.data), bytes(msg.data)
+    )
+
+
+def bench_decode(count: int):
+    """
+    Decode a buffer of `struct can_frame`s, by making a `can.Message` of
+    each as python-can does and decoding that, and by decoding straight
+    from the buffer.  Returns the frames per second each way.
+    """
+    utils = ElconUtils(our_id=elcon_manager_id)
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    reader = rawcan.RawCANReader('buffer', utils, sock=receiver)
+    msgs = status_frames(reader.batch)
+    reader.buffer[:] = b''.join(raw_frame(msg) for msg in msgs)
+    rounds = max(1, count // reader.batch)
+    start = perf_counter()
+    for _ in range(rounds):
+        for offset in range(0, len(reader.buffer), rawcan.can_frame_size):
+            can_id = int.from_bytes(reader.buffer[offset:offset + 4], sys.byteorder)
+            utils.decode_status(can.Message(
+                arbitration_id=can_id & rawcan.CAN_EFF_MASK, is_extended_id=True,
+                dlc=reader.buffer[offset + 4],
+                data=reader.buffer[offset + 8:offset + 8 + reader.buffer[offset + 4]],
+            ))
+    via_message = rounds * reader.batch / (perf_counter() - start)
+    start = perf_counter()
+    for _ in range(rounds):
+        reader.decode(reader.batch)
+    direct = rounds * reader.batch / (perf_counter() - start)
+    start = perf_counter()
+    for _ in range(rounds):
+        reader.decode_array(reader.batch)
+    array = rounds * reader.batch / (perf_counter() - start)
+    reader.shutdown()
+    sender.close()
+    return via_message, direct, array
+
+
+async def receive(reader, count: int, channel: str) -> float:
+    """
+    Send `count` statuses on the channel, and return how many a second the
+    reader's side took in.
+    """
+    sender = can.Bus(channel, interface='socketcan')
+    received = 0
+    start = perf_counter()
+    for chunk in range(0, count, 100):
+        for msg in status_frames(min(100, count - chunk)):
+            sender.send(msg)
+        while received < chunk + min(100, count - chunk):
+            await reader.__anext__()
+            received += 1
+    elapsed = perf_counter() - start
+    sender.shutdown()
+    return count / elapsed
+
+
+async def bench_notifier(channel: str, count: int) -> float:
+    utils = ElconUtils(our_id=elcon_manager_id)
+    bus = can.Bus(channel, interface='socketcan')
+    bus.set_filters(utils.can_filters(sources=(elcon_charger_id,)))
+    buffered = can.AsyncBufferedReader()
+    notifier = can.Notifier(bus, [buffered], loop=asyncio.get_running_loop())
+
+    async def statuses():
+        async for msg in buffered:
+            yield utils.decode_status(msg)
+
+    try:
+        return await receive(statuses(), count, channel)
+    finally:
+        notifier.stop()
+        bus.shutdown()
+
+
+async def bench_raw(channel: str, count: int) -> float:
+    utils = ElconUtils(our_id=elcon_manager_id)
+    reader = rawcan.RawCANReader(channel, utils)
+    reader.set_filters(utils.can_filters(sources=(elcon_charger_id,)))
+    try:
+        return await receive(reader.__aiter__(), count, channel)
+    finally:
+        reader.shutdown()
+
+
+def main(channel: str = 'vcan0', count: int = frames):
+    count = int(count)
+    via_message, direct, array = bench_decode(count)
+    print(f"{'decode via can.Message':28s} {via_message:12,.0f} frames/s")
+    print(f"{'decode from the buffer':28s} {direct:12,.0f} frames/s")
+    print(f"{'decode buffer to an array':28s} {array:12,.0f} frames/s")
+    if not rawcan.available():
+        print(f"{'socketcan ' + channel:28s} skipped: no CAN sockets on this system")
+        return
+    try:
+        notified = asyncio.run(bench_notifier(channel, count))
+    except (can.CanError, OSError) as e:
+        print(f"{'socketcan ' + channel:28s} skipped: {e}")
+        return
+    raw = asyncio.run(bench_raw(channel, count))
+    print(f"{'Notifier on ' + channel:28s} {notified:12,.0f} statuses/s")
+    print(f"{'raw reader on ' + channel:28s} {raw:12,.0f} statuses/s")
+    print(f"Raw reader speed-up: {raw / notified:.1f}x")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
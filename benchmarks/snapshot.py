@@ -0,0 +1,105 @@
+# Measure how long it takes to snapshot, save, load and restore the state
+# of many simulated chargers and their batteries, against starting each
+# of them again from scratch and charging it back up to where it was.
+# As in `timeit`, garbage collection is held off while timing, since
+# thousands of chargers make for long collections at random moments.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.snapshot [chargers]` from the top
+# directory.
+
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from battery import Battery
+from clock import VirtualClock
+from loopback import LoopbackBus
+import snapshot
+from simulator import ElconCharger
+
+chargers = 5000
+# How far into its charge each charger is when the snapshot is taken
+charged_seconds = 1800
+# Charging takes a while with internal resistance, so only this many are
+# charged from scratch, and the time scaled up
+replayed = 50
+
+
+class Charger(ElconCharger):
+    # The status history isn't part of the snapshot, and an hour of it for
+    # each of thousands of chargers would only measure the memory system
+    telemetry_size = 1
+
+
+def make_chargers(count: int, clock):
+    bus = LoopbackBus()
+    made = []
+    for index in range(count):
+        charger = Charger(
+            bus.end(), Battery(capacity=10, cells=4), clock=clock,
+            address=index % 256
+        )
+        charger.verbose = False
+        charger.battery.resistance = 0.05
+        made.append(charger)
+    return made
+
+
+async def bench(count: int):
+    clock = VirtualClock()
+    before = make_chargers(count, clock)
+    after = make_chargers(count, clock)
+    gc.collect()
+    gc.disable()
+    start = perf_counter()
+    for charger in before[:replayed]:
+        charger.battery.charge(16.4, 5, charged_seconds)
+    replay = (perf_counter() - start) * count / min(count, replayed)
+    for charger in before[replayed:]:
+        charger.battery.charge_state = before[0].battery.charge_state
+    for charger in before:
+        charger.active = True
+        charger.volts, charger.amps = 16.4, 5
+        charger.reset_timeout()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'chargers.snap')
+        start = perf_counter()
+        records = snapshot.take(before, clock.now())
+        taken = perf_counter() - start
+        start = perf_counter()
+        snapshot.save(path, records, clock.now())
+        saved = perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = perf_counter()
+        records, taken_at = snapshot.load(path)
+        loaded = perf_counter() - start
+        start = perf_counter()
+        snapshot.restore(after, records, clock.now())
+        restored = perf_counter() - start
+    gc.enable()
+    assert all(
+        b.battery.charge_state == a.battery.charge_state for b, a in zip(before, after)
+    )
+    for charger in before + after:
+        charger.resume_timeout(None)
+    return replay, taken, saved, size, loaded, restored
+
+
+def main(count: int = chargers):
+    replay, taken, saved, size, loaded, restored = asyncio.run(bench(count))
+    print(f"{count} chargers, {size / 1024:.0f} KiB snapshot:")
+    print(f"  take    {taken * 1e3:8.2f} ms (on the event loop)")
+    print(f"  save    {saved * 1e3:8.2f} ms (in the writer thread)")
+    print(f"  load    {loaded * 1e3:8.2f} ms")
+    print(f"  restore {restored * 1e3:8.2f} ms")
+    print(f"  vs charging from scratch to {charged_seconds}s: {replay * 1e3:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
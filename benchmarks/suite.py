@@ -0,0 +1,305 @@
+# A quick run of the benchmarks that matter most, saved as JSON so that
+# each run can be compared against a baseline to catch regressions.
+# Everything runs offline, in one process, using python-can's `virtual`
+# interface for the bus.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.suite [results.json]` from the top
+# directory, and compare two runs with
+# `python -m benchmarks.suite compare baseline.json results.json [threshold]`,
+# which exits with status 1 if any metric is worse than its baseline by
+# more than its own threshold (a fraction, 0.1 unless it says otherwise),
+# or by more than `threshold` for every metric, if that is given.
+
+import asyncio
+import gc
+import json
+import logging
+import platform
+import sys
+import time
+from time import perf_counter
+
+import can
+
+from battery import Battery
+from benchmarks.loopback import ping_pong
+from driver import ChargerDriver
+from simulator import ElconCharger
+from utils import ElconUtils, elcon_broadcast_id, elcon_charger_id, elcon_manager_id
+
+# Each benchmark is run this many times and the best taken, which is the
+# least disturbed by whatever else the machine is doing.  Each run is made
+# long enough to take at least `minimum_time` seconds, so a single
+# preemption or frequency change can't swing it much.
+repeats = 7
+minimum_time = 0.2
+threshold = 0.1
+# Even so, back-to-back runs of the pure Python benchmarks on a busy
+# machine differ by 10% or so, so they are only flagged past this
+rate_threshold = 0.2
+# The keep-alive run, in seconds, and the update and status interval in it
+keepalive_seconds = 3.0
+keepalive_interval = 0.01
+
+
+def best_rate(operation, count: int) -> float:
+    """
+    Call `operation(count)` `repeats` times, and return the best rate of
+    operations per second.  The count is doubled until a call takes at
+    least `minimum_time`.  As in `timeit`, garbage collection is held off
+    while timing.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        while True:
+            start = perf_counter()
+            operation(count)
+            best = perf_counter() - start
+            if best >= minimum_time:
+                break
+            count *= 2
+        for attempt in range(repeats - 1):
+            start = perf_counter()
+            operation(count)
+            best = min(best, perf_counter() - start)
+    finally:
+        gc.enable()
+    return count / best
+
+
+def bench_elcon_id(count: int):
+    eu = ElconUtils(elcon_manager_id)
+
+    def operation(count):
+        for i in range(count):
+            eu.unpack_elcon_id(eu.pack_elcon_id(elcon_manager_id, i & 0xFF))
+    return best_rate(operation, count)
+
+
+def bench_pack_command(count: int):
+    eu = ElconUtils(elcon_manager_id)
+
+    def operation(count):
+        for i in range(count):
+            eu.pack_command(elcon_charger_id, 100 + (i % 50), 5, True)
+    return best_rate(operation, count)
+
+
+def bench_unpack_status(count: int):
+    charger = ElconUtils(elcon_charger_id)
+    msgs = [
+        charger.pack_command(elcon_broadcast_id, 100 + (i % 50), 5, True)
+        for i in range(count)
+    ]
+    eu = ElconUtils(elcon_manager_id)
+
+    def operation(count):
+        for i in range(count):
+            eu.unpack_status(msgs[i % len(msgs)])
+    return best_rate(operation, count)
+
+
+def bench_battery_voltage(count: int):
+    battery = Battery(capacity=10, cells=30)
+
+    def operation(count):
+        # A new charge state each time, so the voltage isn't cached
+        for i in range(count):
+            battery.charge_state = (i % 1000) / 100
+            battery.voltage
+    return best_rate(operation, count)
+
+
+def bench_battery_charge(count: int):
+    battery = Battery(capacity=10, cells=30)
+
+    def operation(count):
+        for i in range(count):
+            battery.charge_state = 2.0
+            battery.charge(123.0, 5, 1)
+    return best_rate(operation, count)
+
+
+def virtual_buses(channel: str):
+    return (
+        can.Bus(channel, interface='virtual'),
+        can.Bus(channel, interface='virtual'),
+    )
+
+
+def bench_virtual_frames(count: int) -> float:
+    driver_bus, charger_bus = virtual_buses('pyelcon-suite-frames')
+    try:
+        return asyncio.run(ping_pong(driver_bus, charger_bus, count))
+    finally:
+        driver_bus.shutdown()
+        charger_bus.shutdown()
+
+
+async def keepalive_session(seconds: float, interval: float):
+    driver_bus, charger_bus = virtual_buses('pyelcon-suite-keepalive')
+    driver = ChargerDriver(driver_bus)
+    driver.verbose = False
+    driver.update_time = interval
+    driver.volts, driver.amps = 123.0, 5
+    charger = ElconCharger(charger_bus, Battery(capacity=10, cells=30))
+    charger.verbose = False
+    charger.status_interval = interval
+    driving = asyncio.create_task(driver.main())
+    simulating = asyncio.create_task(charger.main())
+    driver.start()
+    try:
+        await asyncio.sleep(seconds)
+        driver.finish()
+        await driving
+    finally:
+        # Both stop their notifiers on the way out, before the loop closes
+        for task in (driving, simulating):
+            task.cancel()
+        await asyncio.gather(driving, simulating, return_exceptions=True)
+        driver_bus.shutdown()
+        charger_bus.shutdown()
+    return driver
+
+
+def bench_keepalive(seconds: float, interval: float):
+    """
+    Run the driver against the simulated charger on the real clock, and
+    return the median and 99th percentile of how far each keep-alive
+    strayed from the update interval.
+    """
+    driver = asyncio.run(keepalive_session(seconds, interval))
+    jitter = driver.keepalive_jitter
+    return jitter.percentile(50) or 0.0, jitter.percentile(99) or 0.0
+
+
+def run_suite(scale: float = 1.0) -> dict:
+    """
+    Run every benchmark, with `scale` times the usual number of operations,
+    and return the results: a dict of metric name to its `value`, its
+    `unit` and whether `higher` values are better.  Some metrics are
+    noisier than others, and carry their own `threshold`.
+    """
+    def count(n):
+        return max(1, int(n * scale))
+
+    metrics = {}
+
+    def rate(name, value):
+        metrics[name] = {
+            'value': value, 'unit': 'ops/s', 'higher': True,
+            'threshold': rate_threshold,
+        }
+
+    rate('elcon_id_round_trip', bench_elcon_id(count(100_000)))
+    rate('pack_command', bench_pack_command(count(50_000)))
+    rate('unpack_status', bench_unpack_status(count(50_000)))
+    rate('battery_voltage', bench_battery_voltage(count(20_000)))
+    rate('battery_charge', bench_battery_charge(count(5_000)))
+    # These go through python-can's threads, so depend on the scheduler
+    # as much as on us, and are allowed more
+    metrics['virtual_frames'] = {
+        'value': bench_virtual_frames(count(2_000)), 'unit': 'frames/s',
+        'higher': True, 'threshold': 0.3,
+    }
+    median, worst = bench_keepalive(keepalive_seconds * scale, keepalive_interval)
+    # Jitter is a few milliseconds at best, so a little more of it is a
+    # big fraction, and its tail is the noisiest of all
+    metrics['keepalive_jitter_p50'] = {
+        'value': median, 'unit': 's', 'higher': False, 'threshold': 0.5,
+    }
+    metrics['keepalive_jitter_p99'] = {
+        'value': worst, 'unit': 's', 'higher': False, 'threshold': 1.0,
+    }
+    return metrics
+
+
+def save_results(path: str, metrics: dict):
+    with open(path, 'w') as f:
+        json.dump({
+            'time': time.time(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'metrics': metrics,
+        }, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)['metrics']
+
+
+def compare(baseline: dict, results: dict) -> list:
+    """
+    Compare the results of two runs, and return a list of (name, baseline
+    value, value, change) for each metric in the baseline, where `change`
+    is how much worse the new value is as a fraction of the baseline (so
+    negative is better), or None if the metric is missing from the
+    results.
+    """
+    compared = []
+    for name, base in sorted(baseline.items()):
+        if name not in results:
+            compared.append((name, base['value'], None, None))
+            continue
+        value = results[name]['value']
+        if base['value'] == 0:
+            better = value >= 0 if base['higher'] else value <= 0
+            change = 0.0 if better else float('inf')
+        elif base['higher']:
+            change = (base['value'] - value) / base['value']
+        else:
+            change = (value - base['value']) / base['value']
+        compared.append((name, base['value'], value, change))
+    return compared
+
+
+def regressions(baseline: dict, compared: list, limit: float = None) -> list:
+    """
+    The names of the metrics that are missing, or worse by more than the
+    given `limit`, or if that is None, by more than their own threshold
+    (or the default `threshold`, if they don't have one).
+    """
+    return [
+        name for name, base_value, value, change in compared
+        if change is None or change > (
+            limit if limit is not None
+            else baseline[name].get('threshold', threshold)
+        )
+    ]
+
+
+def compare_main(baseline_path: str, results_path: str, limit: str = None) -> int:
+    limit = None if limit is None else float(limit)
+    baseline = load_results(baseline_path)
+    compared = compare(baseline, load_results(results_path))
+    failed = regressions(baseline, compared, limit)
+    for name, base_value, value, change in compared:
+        unit = baseline[name]['unit']
+        if change is None:
+            print(f"{name:24s} {base_value:14,.6g} {unit:8s} missing  REGRESSED")
+            continue
+        print(
+            f"{name:24s} {base_value:14,.6g} -> {value:14,.6g} {unit:8s} "
+            f"{abs(change):7.1%} {'worse' if change > 0 else 'better'}"
+            f"{'  REGRESSED' if name in failed else ''}"
+        )
+    return 1 if failed else 0
+
+
+def main(output: str = None):
+    # The simulated charger complains while it waits for its first command
+    logging.basicConfig(level=logging.ERROR)
+    metrics = run_suite()
+    for name, metric in metrics.items():
+        print(f"{name:24s} {metric['value']:14,.6g} {metric['unit']}")
+    if output is not None:
+        save_results(output, metrics)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['compare']:
+        sys.exit(compare_main(*sys.argv[2:5]))
+    main(*sys.argv[1:2])
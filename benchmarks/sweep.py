@@ -0,0 +1,49 @@
+# Measure how the charge session sweep scales with the number of worker
+# processes, against running the sessions one at a time in this process.
+# Licensed under the GPL V3
+#
+# Run with `python -m benchmarks.sweep [sessions]` from the top directory.
+
+import logging
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+import sweep
+
+sessions = 64
+
+
+def cases(count: int):
+    # 12S packs of 1 to 4Ah, charged at 5 to 20 amps
+    cases = sweep.grid(
+        capacity=[1.0, 2.0, 3.0, 4.0], cells=12, volts=49.2,
+        amps=[5.0, 10.0, 15.0, 20.0], resistance=[0.0, 0.1],
+    )
+    return np.resize(cases, count)
+
+
+def main(count: int = sessions):
+    logging.disable(logging.WARNING)
+    todo = cases(count)
+    start = perf_counter()
+    for case in todo:
+        sweep.run_session(case)
+    serial = perf_counter() - start
+    print(f"one at a time:  {len(todo) / serial:8.1f} sessions/s")
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        start = perf_counter()
+        sweep.run_sweep(todo, workers=workers, progress=None)
+        elapsed = perf_counter() - start
+        print(
+            f"{workers:3d} workers:    {len(todo) / elapsed:8.1f} sessions/s, "
+            f"{serial / elapsed:5.2f}x"
+        )
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,160 @@
+# capture - record and replay the Elcon frames on a CANBUS network.
+# Licensed under the GPL V3
+
+import asyncio
+import os
+from struct import Struct
+
+import can
+import numpy as np
+
+from clock import RealClock
+
+# Every capture file starts with this, followed by fixed-width records of
+# the frame's timestamp, its arbitration ID and its five data bytes.
+capture_magic = b'ELCONCAP'
+capture_dtype = np.dtype([
+    ('timestamp', '<f8'), ('arbitration_id', '<u4'), ('data', 'u1', (5,)),
+])
+_record_struct = Struct('<dI5s')
+assert _record_struct.size == capture_dtype.itemsize
+
+
+class CaptureWriter(can.Listener):
+    """
+    Record the Elcon frames on a bus to a capture file.
+
+    Attach this to a `can.Notifier` like any other listener, or call it
+    with each message (such as those read from a `loopback.LoopbackEnd`).
+    Frames whose data isn't the five bytes Elcon messages carry are
+    counted in `skipped` rather than recorded.  Records are buffered until
+    `flush` or `close` (or `stop`) is called.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'wb')
+        self.file.write(capture_magic)
+        self.written = 0
+        self.skipped = 0
+
+    def on_message_received(self, msg: can.Message):
+        if len(msg.data) != 5:
+            self.skipped += 1
+            return
+        self.file.write(_record_struct.pack(
+            msg.timestamp, msg.arbitration_id, bytes(msg.data)
+        ))
+        self.written += 1
+
+    def flush(self):
+        """
+        Write the buffered records to the file.
+        """
+        if not self.file.closed:
+            self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def stop(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class CaptureReader(object):
+    """
+    Read back a capture file, memory-mapped so that captures far larger
+    than memory can be replayed: only the pages being read are loaded.
+
+    `frames` is a structured array of `capture_dtype` backed by the file.
+    Frames can be replayed as `can.Message` objects, decoded in batches by
+    `ElconUtils.unpack_status_array`, or sent on a bus (such as an end of
+    a `loopback.LoopbackBus` shared with a `ChargerDriver` or
+    `ElconCharger`) at the pace they were captured, faster, or as fast as
+    possible.
+
+    A capture cut short (by a crash part way through writing a record, say)
+    is read up to its last whole record; the partial one is left out.
+    """
+    chunk_frames = 65536
+    # Unthrottled replays let the receivers catch up this often
+    yield_frames = 256
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            magic = f.read(len(capture_magic))
+        if magic != capture_magic:
+            raise ValueError(f"{path} is not an Elcon capture file")
+        count = (os.path.getsize(path) - len(capture_magic)) // capture_dtype.itemsize
+        if count == 0:
+            # An empty file can't be mapped
+            self.frames = np.zeros(0, dtype=capture_dtype)
+        else:
+            self.frames = np.memmap(
+                path, dtype=capture_dtype, mode='r', offset=len(capture_magic),
+                shape=(count,)
+            )
+
+    def __len__(self):
+        return len(self.frames)
+
+    def chunks(self):
+        """
+        Yield the frames in slices of at most `chunk_frames`.
+        """
+        for start in range(0, len(self.frames), self.chunk_frames):
+            yield self.frames[start:start + self.chunk_frames]
+
+    def messages(self):
+        """
+        Yield each frame as a `can.Message`.
+        """
+        for chunk in self.chunks():
+            for timestamp, arbitration_id, data in zip(
+                chunk['timestamp'].tolist(), chunk['arbitration_id'].tolist(),
+                chunk['data'],
+            ):
+                yield can.Message(
+                    timestamp=timestamp, arbitration_id=arbitration_id,
+                    data=data.tobytes(), is_extended_id=True,
+                )
+
+    def statuses(self, utils):
+        """
+        Yield the frames to the given `ElconUtils` object, decoded in
+        batches as arrays of `utils.elcon_status_dtype`.
+        """
+        for chunk in self.chunks():
+            yield utils.unpack_status_array(chunk['arbitration_id'], chunk['data'])
+
+    async def replay(self, bus, speed: float = 1.0, clock=None):
+        """
+        Send every frame on the given bus.  At a `speed` of 1 the frames
+        are sent with the gaps between them as captured; at 10 they go ten
+        times as fast, and with a `speed` of None they go as fast as the
+        bus takes them.  Returns the number of frames sent.
+
+        Time is kept by the given `clock`, which is the real time by default.
+        """
+        clock = clock if clock is not None else RealClock()
+        if not len(self.frames):
+            return 0
+        first = float(self.frames['timestamp'][0])
+        start = clock.now()
+        sent = 0
+        for msg in self.messages():
+            if speed is not None:
+                delay = start + (msg.timestamp - first) / speed - clock.now()
+                if delay > 0:
+                    await clock.sleep(delay)
+            elif sent % self.yield_frames == 0:
+                await asyncio.sleep(0)
+            bus.send(msg)
+            sent += 1
+        return sent
@@ -0,0 +1,61 @@
+# charging - charge profiles that set the charger from its own status.
+# Licensed under the GPL V3
+
+from typing import Optional, Tuple
+
+from utils import ChargerStatus
+
+
+class CCCVProfile(object):
+    """
+    A constant current, then constant voltage, charge profile.
+
+    In the constant current phase the charger is told to run at `amps`,
+    limited to `volts`.  Once the charger reports it has reached `volts`
+    (to within `tolerance`), the profile moves to constant voltage: the
+    current limit follows the current the battery is still taking down, with
+    `headroom` to spare so the charger stays voltage-limited, and once that
+    falls to `termination_amps` the charge is finished.
+
+    Give each status from the charger to `next_setpoint`, which returns
+    the (volts, amps) to run at next, or None once the charge is finished.
+    A status with any fault or timeout flag set says nothing about the
+    battery, so the setpoint is held where it was until they clear.
+    """
+    tolerance: float = 0.1
+    headroom: float = 1.1
+
+    def __init__(self, volts: float, amps: float, termination_amps: float):
+        self.volts = volts
+        self.amps = amps
+        self.termination_amps = termination_amps
+        self.phase = 'cc'
+        self.setpoint = (volts, amps)
+
+    @property
+    def finished(self) -> bool:
+        return self.phase == 'done'
+
+    def next_setpoint(self, status: ChargerStatus) -> Optional[Tuple[float, float]]:
+        if self.phase == 'done':
+            return None
+        if status.flags:
+            return self.setpoint
+        if self.phase == 'cc' and status.voltage >= self.volts - self.tolerance:
+            self.phase = 'cv'
+        if self.phase == 'cv' and status.current <= self.termination_amps:
+            self.phase = 'done'
+        if self.phase == 'done':
+            return None
+        if self.phase == 'cc':
+            self.setpoint = (self.volts, self.amps)
+        else:
+            amps = min(self.amps, max(status.current * self.headroom, self.termination_amps))
+            self.setpoint = (self.volts, amps)
+        return self.setpoint
+
+    def __repr__(self):
+        return (
+            f"CCCVProfile: {self.amps:.2f}A to {self.volts:.2f}V, "
+            f"until {self.termination_amps:.2f}A, {self.phase}"
+        )
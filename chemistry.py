@@ -0,0 +1,108 @@
+# chemistry - open-circuit voltage curves for simulated battery cells.
+# Licensed under the GPL V3
+
+from bisect import bisect_right
+import csv
+
+import numpy as np
+
+
+class OCVCurve(object):
+    """
+    The open-circuit voltage curve of a cell, as a table of state of charge
+    (from 0 to 1) against voltage level (from 0 at the cell's minimum
+    voltage to 1 at its maximum).  Voltages between the points in the table
+    are interpolated, and so are states of charge looked up by voltage -
+    both by bisecting the table.
+
+    The curve is scaled by the battery's own minimum and maximum voltage,
+    so the same curve can be used for any battery of that chemistry.  The
+    `minimum_voltage` and `maximum_voltage` of the cell the curve came from
+    are kept as defaults.
+    """
+
+    def __init__(
+        self, soc, level, minimum_voltage: float = 3.0,
+        maximum_voltage: float = 4.2
+    ):
+        self.soc = [float(s) for s in soc]
+        self.level = [float(v) for v in level]
+        if len(self.soc) != len(self.level) or len(self.soc) < 2:
+            raise ValueError("Need at least two matching points on the curve")
+        if any(b <= a for a, b in zip(self.soc, self.soc[1:])):
+            raise ValueError("State of charge must increase along the curve")
+        if any(b <= a for a, b in zip(self.level, self.level[1:])):
+            raise ValueError("Voltage must increase along the curve")
+        self.minimum_voltage = minimum_voltage
+        self.maximum_voltage = maximum_voltage
+        # The same tables as arrays, for batteries in a bank
+        self.soc_array = np.array(self.soc)
+        self.level_array = np.array(self.level)
+
+    @classmethod
+    def cubic(cls, points: int = 1001) -> 'OCVCurve':
+        """
+        The built-in curve: a hand-tuned cubic that simulates a LiIon cell,
+        with a flat but gradual increase in the centre and a steep drop and
+        climb at either end of charging.  So I can't really explain why
+        these constants, but they seem to work.
+        """
+        soc = [i / (points - 1) for i in range(points)]
+        level = []
+        for s in soc:
+            frac_charge = s - 0.5  # range -0.5 to 0.5
+            level.append(frac_charge ** 3 * 3.6 + frac_charge * 0.1 + 0.5)
+        return cls(soc, level)
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'OCVCurve':
+        """
+        Load a curve from a CSV file of real cell data, with the state of
+        charge (as a fraction or a percentage) in the first column and the
+        cell's voltage in the second.  A header line is skipped.  The
+        cell's minimum and maximum voltages are taken from the first and
+        last points.
+        """
+        points = []
+        with open(path, newline='') as fh:
+            for row in csv.reader(fh):
+                try:
+                    points.append((float(row[0]), float(row[1])))
+                except (ValueError, IndexError):
+                    if points:
+                        raise ValueError(f"Can't read {row} in {path}")
+        points.sort()
+        if points and points[-1][0] > 1:
+            points = [(s / 100, v) for s, v in points]
+        minimum, maximum = points[0][1], points[-1][1]
+        return cls(
+            [s for s, v in points],
+            [(v - minimum) / (maximum - minimum) for s, v in points],
+            minimum_voltage=minimum, maximum_voltage=maximum
+        )
+
+    @staticmethod
+    def _interpolate(x: float, xs: list, ys: list) -> float:
+        if x <= xs[0]:
+            return ys[0]
+        if x >= xs[-1]:
+            return ys[-1]
+        i = bisect_right(xs, x) - 1
+        return ys[i] + (x - xs[i]) * (ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i])
+
+    def level_at(self, soc: float) -> float:
+        """
+        The voltage level at the given state of charge.
+        """
+        return self._interpolate(soc, self.soc, self.level)
+
+    def soc_at(self, level: float) -> float:
+        """
+        The state of charge at which the cell reaches the given voltage
+        level, clamped to between 0 and 1.
+        """
+        return self._interpolate(level, self.level, self.soc)
+
+
+# The curve for batteries that don't bring their own
+default_curve = OCVCurve.cubic()
@@ -0,0 +1,123 @@
+# clocks - real and simulated time for the driver and simulator.
+# Licensed under the GPL V3
+
+import asyncio
+from heapq import heappop, heappush
+from itertools import count
+import time
+
+
+class RealClock(object):
+    """
+    The real time: sleeping takes as long as it says.  Time is monotonic
+    (as the event loop's is), so intervals between times are never thrown
+    out by the system clock being set; `wall_time` turns a time into
+    seconds since the epoch, for display.
+    """
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def wall_time(self, when: float) -> float:
+        return time.time() - (time.monotonic() - when)
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    def call_later(self, seconds: float, callback):
+        """
+        Call `callback` once the given number of seconds have passed.  This
+        returns a handle whose `cancel` method stops the call.
+        """
+        loop = asyncio.get_running_loop()
+        return loop.call_at(loop.time() + seconds, callback)
+
+
+class VirtualClock(object):
+    """
+    A discrete-event clock for running simulations faster than real time.
+
+    Tasks sleep on this clock as they would on the real one, and the `run`
+    coroutine advances time straight to the next wakeup whenever all the
+    tasks have settled.  Time starts at `start` seconds.
+
+    Everything that shares the clock must talk through asyncio (queues,
+    futures and the like) rather than threads, since the clock only waits
+    for the event loop to settle before moving on: that is, until nothing
+    else is ready to run.  `settle` is the most passes through the event
+    loop it waits for that, in case some task never stops being ready.
+    """
+    settle = 1000
+
+    def __init__(self, start: float = 0.0):
+        self._now = start
+        self._sequence = count()
+        self._waiters = []
+        # Set while `run` is waiting for anyone to sleep
+        self._idle = None
+
+    def now(self) -> float:
+        return self._now
+
+    def wall_time(self, when: float) -> float:
+        # Virtual time is whatever it was started at
+        return when
+
+    def _schedule(self, seconds: float):
+        future = asyncio.get_running_loop().create_future()
+        heappush(
+            self._waiters,
+            (self._now + max(seconds, 0), next(self._sequence), future)
+        )
+        if self._idle is not None and not self._idle.done():
+            self._idle.set_result(None)
+        return future
+
+    async def sleep(self, seconds: float):
+        await self._schedule(seconds)
+
+    def call_later(self, seconds: float, callback):
+        """
+        Call `callback` once the given number of seconds have passed on this
+        clock.  This returns a handle whose `cancel` method stops the call.
+        """
+        future = self._schedule(seconds)
+        future.add_done_callback(
+            lambda f: None if f.cancelled() else callback()
+        )
+        return future
+
+    async def _settle(self):
+        # Event loops that don't keep their ready callbacks in `_ready` (such
+        # as uvloop) get every pass
+        ready = getattr(asyncio.get_running_loop(), '_ready', None)
+        for _ in range(self.settle):
+            await asyncio.sleep(0)
+            if ready is not None and not ready:
+                break
+
+    async def run(self, until: float = None):
+        """
+        Advance the clock from wakeup to wakeup, until it reaches `until`
+        (if given).
+        """
+        while until is None or self._now < until:
+            await self._settle()
+            # Forget anyone who has given up waiting
+            while self._waiters and self._waiters[0][2].done():
+                heappop(self._waiters)
+            if not self._waiters:
+                self._idle = asyncio.get_running_loop().create_future()
+                await self._idle
+                continue
+            when = self._waiters[0][0]
+            if until is not None and when > until:
+                self._now = until
+                break
+            self._now = when
+            # Wake everyone due at this time together
+            while self._waiters and self._waiters[0][0] == when:
+                future = heappop(self._waiters)[2]
+                if not future.done():
+                    future.set_result(None)
+        await self._settle()
@@ -1,10 +1,23 @@
 import asyncio
-import can
+from collections import deque
+import json
+import logging
+import os
+import stat
+import sys
 
+from clock import RealClock
+from loopback import open_reader
+from metrics import Metrics
+from rawcan import RawCANReader
+from telemetry import Telemetry
+from transmit import TransmitQueue
 from utils import (
     ElconUtils, elcon_charger_id, elcon_manager_id, elcon_broadcast_id
 )
 
+log = logging.getLogger(__name__)
+
 
 class ChargerDriver(object):
     """
@@ -14,6 +27,44 @@ class ChargerDriver(object):
     an Elcon charger with the `volts` and `amps` to run at.  Messages will be
     sent from when the 'start' method is called until the 'stop' method is
     called.  The 'finished' method will cause the driver to exit completely.
+
+    If `periodic` is set, the message is instead handed to the bus to send
+    cyclically (in the kernel on socketcan, or in a thread otherwise), so
+    the keep-alive goes out on time even if the event loop stalls.  Call
+    `update` after changing `volts`, `amps` or `max_watts` to change the
+    cyclic message in place; otherwise it is updated on the next tick.
+
+    Ticks are timed by the given `clock`, which is the real time by default.
+
+    Statuses from the charger are kept in `telemetry`, a ring buffer of the
+    last `telemetry_size` samples (in a file at `telemetry_path`, if set),
+    and the last `status_history` of them in `statuses`.  Both are made
+    when first used, so the sizes can be set until then.
+    If `raw_channel` is set (on Linux), they are read and decoded straight
+    from a raw socket on that CAN interface by a `rawcan.RawCANReader`,
+    rather than through python-can; commands still go out on the bus.
+
+    Commands (see `help_text`) can be typed at standard input if
+    `interactive` is set, and sent to a local socket at `control_path` if
+    that is set; both are read through the event loop, so neither holds up
+    the keep-alive.
+
+    If a `profile` (such as a `charging.CCCVProfile`) is set, the voltage
+    and current are set from it as each status arrives, and a changed
+    setpoint is sent straight away (unless `profile_immediate` is False, in
+    which case it waits for the next tick).  The driver stops when the
+    profile finishes.
+
+    If a `bridge` (a `mqttbridge.TelemetryBridge`) is set, each status is
+    handed to it to publish, under the charger's address.
+
+    How the loop is performing is recorded in the histograms in `metrics`:
+    the time from a new setpoint being sent to the first status from the
+    charger matching it, how far each keep-alive strays from `update_time`
+    after the last, how long each status takes to decode, how long a new
+    setpoint from the profile waits to be sent, and (while they are
+    served) how late the event loop runs.  They are served in Prometheus
+    text on the local `metrics_port`, if that is set.
     """
     volts: float = 0.0
     amps: float = 0.0
@@ -21,115 +72,437 @@ class ChargerDriver(object):
     max_watts: float = 1000.0
     update_time: int = 1
     verbose: bool = True
+    periodic: bool = False
+    status_history: int = 100
+    telemetry_size: int = 3600
+    telemetry_path: str = None
+    interactive: bool = False
+    control_path: str = None
+    metrics_port: int = None
+    raw_channel: str = None
+    bridge = None
+    _statuses = None
+    _telemetry = None
+    profile = None
+    profile_immediate: bool = True
 
-    def __init__(self, bus):
+    def __init__(self, bus, clock=None):
         self.bus = bus
+        self.clock = clock if clock is not None else RealClock()
+        # Frames are sent through here, so a full bus can't block us
+        self.transmit = TransmitQueue(bus, self.clock)
         self.utils = ElconUtils(our_id=elcon_manager_id)
         self.running = False
         self.finished = False
+        # The bus's cyclic send task and its message, in periodic mode
+        self.cyclic_task = None
+        self.cyclic_msg = None
+        self.metrics = Metrics()
+        self.setpoint_latency = self.metrics.histogram(
+            'pyelcon_setpoint_latency_seconds',
+            'Time from sending a new setpoint to the first status matching it'
+        )
+        self.profile_reaction = self.metrics.histogram(
+            'pyelcon_profile_reaction_seconds',
+            'Time from a status changing the profile setpoint to sending it'
+        )
+        self.keepalive_jitter = self.metrics.histogram(
+            'pyelcon_keepalive_jitter_seconds',
+            'How far the time between keep-alives strays from the update time'
+        )
+        self.utils.decode_time = self.metrics.histogram(
+            'pyelcon_decode_seconds', 'Time taken to decode each status'
+        )
+        # The last setpoint sent, and the time it was first sent while we
+        # wait for the charger to match it
+        self.setpoint = None
+        self.setpoint_sent = None
+        # When a status last changed the setpoint from our profile, until
+        # the new setpoint is sent
+        self.profile_changed = None
+        self.last_keepalive = None
+
+    @property
+    def statuses(self) -> deque:
+        """
+        The most recent statuses received from the charger, newest last.
+        """
+        if self._statuses is None:
+            self._statuses = deque(maxlen=self.status_history)
+        return self._statuses
+
+    @property
+    def telemetry(self) -> Telemetry:
+        """
+        A longer history of the charger's status, for analysis.
+        """
+        if self._telemetry is None:
+            self._telemetry = Telemetry(self.telemetry_size, self.telemetry_path)
+        return self._telemetry
 
     def _curb_amps_to_power(self):
         if (self.volts * self.amps) / self.efficiency_pct > self.max_watts:
             self.amps = (self.max_watts / self.volts) * self.efficiency_pct
 
+    def _command(self):
+        """
+        Pack the command for the charger from our current settings.
+        """
+        self._curb_amps_to_power()
+        msg = self.utils.pack_command(
+            elcon_charger_id, self.volts, self.amps, enable=True
+        )
+        if msg is not None and msg.data != self.setpoint:
+            self.setpoint = msg.data
+            self.setpoint_sent = self.clock.now()
+            if self.profile_changed is not None:
+                self.profile_reaction.record(self.setpoint_sent - self.profile_changed)
+        # Whatever the profile changed has now been sent, or rounded away
+        self.profile_changed = None
+        return msg
+
+    def _check_setpoint(self, status):
+        """
+        Record how long the charger took to reach a new setpoint, the first
+        time its status matches it: that is, when it is running at either
+        the set current or the set voltage (to within the tenth of a unit
+        it reports).
+        """
+        if self.setpoint_sent is None:
+            return
+        volts = int.from_bytes(self.setpoint[0:2], 'big') / 10
+        amps = int.from_bytes(self.setpoint[2:4], 'big') / 10
+        if abs(status.current - amps) < 0.11 or abs(status.voltage - volts) < 0.11:
+            self.setpoint_latency.record(self.clock.now() - self.setpoint_sent)
+            self.setpoint_sent = None
+
+    def _follow_profile(self, status):
+        """
+        Set the voltage and current from our profile, given the charger's
+        latest status, and send the command at once if it has changed.
+        """
+        setpoint = self.profile.next_setpoint(status)
+        if setpoint is None:
+            log.info("Charge finished: %r", self.profile)
+            self.stop()
+            return
+        previous = (self.volts, self.amps)
+        self.volts, self.amps = setpoint
+        self._curb_amps_to_power()
+        if (self.volts, self.amps) != previous and self.profile_changed is None:
+            self.profile_changed = self.clock.now()
+        if self.periodic:
+            self.update()
+            return
+        if not self.profile_immediate:
+            return
+        sent = self.setpoint
+        msg = self._command()
+        if msg is not None and msg.data != sent:
+            self.transmit.send(msg)
+
+    def _stop_cyclic(self):
+        if self.cyclic_task is not None:
+            self.cyclic_task.stop()
+            self.cyclic_task = None
+            self.cyclic_msg = None
+
+    def update(self):
+        """
+        In periodic mode, start, change or stop the cyclic message to the
+        charger to match our current settings.
+        """
+        if not self.periodic:
+            return
+        msg = self._command() if self.running and not self.finished else None
+        if msg is None:
+            self._stop_cyclic()
+        elif self.cyclic_task is None:
+            self.cyclic_task = self.bus.send_periodic(msg, self.update_time)
+            self.cyclic_msg = msg
+        elif msg.data != self.cyclic_msg.data:
+            self.cyclic_task.modify_data(msg)
+            self.cyclic_msg = msg
+        else:
+            return
+        if self.verbose and msg is not None:
+            log.info("Charger told to run at %.2fV %.2fA", self.volts, self.amps)
+
     def start(self):
         self.running = True
+        self.update()
 
     def stop(self):
         self.running = False
+        self.update()
 
     def finish(self):
         # Any shutdown
         self.finished = True
+        self._stop_cyclic()
 
     async def send_message(self):
         """
         Send the message to the charger.
         """
         while not self.finished:
-            if self.running:
-                self._curb_amps_to_power()
-                msg = self.utils.pack_command(
-                    elcon_charger_id, self.volts, self.amps, enable=True
-                )
+            if self.periodic:
+                # The bus sends the message; we just pick up any changes
+                self.update()
+            elif self.running:
+                msg = self._command()
                 if msg is not None:
-                    self.bus.send(msg)
+                    self.transmit.send(msg)
+                    now = self.clock.now()
+                    if self.last_keepalive is not None:
+                        self.keepalive_jitter.record(abs(
+                            now - self.last_keepalive - self.update_time
+                        ))
+                    self.last_keepalive = now
                     if self.verbose:
-                        print(f"Charger told to run at {self.volts:.2f}V {self.amps:.2f}A")
-            await asyncio.sleep(self.update_time)
+                        log.info("Charger told to run at %.2fV %.2fA", self.volts, self.amps)
+            else:
+                self.last_keepalive = None
+            await self.clock.sleep(self.update_time)
+        self._stop_cyclic()
 
     async def receive_status(self):
         """
         Receive status from charger, report status
         """
         async for msg in self.reader:
-            if self.utils.unpack_status(msg):
-                print(
-                    f"Received from charger: {self.utils.voltage:.2f}V "
-                    f"{self.utils.current:.2f}A "
-                    f"HW={'XX' if self.utils.hardware_failure else 'OK'} "
-                    f"Temp={'XX' if self.utils.over_temperature else 'OK'} "
-                    f"Vin={'XX' if self.utils.input_voltage else 'OK'} "
-                    f"Bat={'No' if self.utils.no_battery else 'OK'} "
-                    f"T/O={'XX' if self.utils.timeout else 'OK'} "
-                )
-            else:
-                pass
+            status = self.utils.decode_status(msg)
+            if status is not None:
+                self._handle_status(status)
+
+    async def receive_raw_status(self):
+        """
+        Receive status from charger through the raw socket reader, which
+        decodes it itself
+        """
+        async for status in self.reader:
+            self._handle_status(status)
+
+    def _handle_status(self, status):
+        self.statuses.append(status)
+        self.telemetry.append_status(self.clock.now(), status)
+        if self.bridge is not None:
+            self.bridge.update_status(f"charger/{status.source:02x}", status)
+        self._check_setpoint(status)
+        if self.profile is not None and self.running:
+            self._follow_profile(status)
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                "Received from charger: %.2fV %.2fA "
+                "HW=%s Temp=%s Vin=%s Bat=%s T/O=%s",
+                status.voltage, status.current,
+                'XX' if status.hardware_failure else 'OK',
+                'XX' if status.over_temperature else 'OK',
+                'XX' if status.input_voltage else 'OK',
+                'No' if status.no_battery else 'OK',
+                'XX' if status.timeout else 'OK',
+            )
+
+    help_text = (
+        "Help - commands we recognise:\n"
+        "start    : start sending messages\n"
+        "stop     : stop sending messages\n"
+        "volts <x>: set output voltage to <x>\n"
+        "amps <x> : set output amperage to <x>\n"
+        "watts <x>: set maximum wattage to <x>\n"
+        "quit     : finish operation and exit"
+    )
 
     def split_cmd_float(self, cmd):
-        cmd, val_s = cmd.split()
         try:
+            cmd, val_s = cmd.split()
             return float(val_s)
         except ValueError:
-            print(f"Didn't understand {val_s} as a float")
             return None
 
-    async def read_command_line(self):
-        while not self.finished:
-            cmd = input("Cmd: ").strip().lower()
-
-            if cmd in ('help', 'h', '?'):
-                print("Help - commands we recognise:")
-                print("start    : start sending messages")
-                print("stop     : stop sending messages")
-                print("volts <x>: set output voltage to <x>")
-                print("amps <x> : set output amperage to <x>")
-                print("watts <x>: set maximum wattage to <x>")
-                print("quit     : finish operation and exit")
-            if cmd in ('start', 'go'):
-                self.start()
-            elif cmd in ('stop', ):
-                self.stop()
-            elif cmd in ('finish', 'exit', 'quit', 'q'):
-                self.finish()
-            elif cmd.startswith('volts'):
-                volts = self.split_cmd_float(cmd)
-                if volts is not None:
-                    self.volts = volts
+    def run_command(self, cmd: str):
+        """
+        Carry out one command, as typed at the command line, and return a
+        tuple of whether it was understood and the reply to show.
+        """
+        cmd = cmd.strip().lower()
+        if cmd in ('help', 'h', '?'):
+            return (True, self.help_text)
+        elif cmd in ('start', 'go'):
+            self.start()
+        elif cmd in ('stop', ):
+            self.stop()
+        elif cmd in ('finish', 'exit', 'quit', 'q'):
+            self.finish()
+        elif cmd.startswith(('volts', 'amps', 'watts')):
+            value = self.split_cmd_float(cmd)
+            if value is None:
+                return (False, f"Didn't understand '{cmd}' as a float setting")
+            if cmd.startswith('volts'):
+                self.volts = value
             elif cmd.startswith('amps'):
-                amps = self.split_cmd_float(cmd)
-                if amps is not None:
-                    self.amps = amps
-            elif cmd.startswith('watts'):
-                watts = self.split_cmd_float(cmd)
-                if watts is not None:
-                    self.max_watts = watts
+                self.amps = value
             else:
-                print(f"Unrecognised command '{cmd}'")
+                self.max_watts = value
+            self.update()
+        else:
+            return (False, f"Unrecognised command '{cmd}'")
+        return (True, repr(self))
 
+    def run_json_command(self, line: str) -> dict:
+        """
+        Carry out one command given as a JSON object, such as
+        `{"command": "volts", "value": 120}`, and return the reply as a
+        dictionary of whether it was understood, the reply text and our
+        current settings.
+        """
+        try:
+            request = json.loads(line)
+            cmd = str(request['command'])
+            if request.get('value') is not None:
+                cmd = f"{cmd} {request['value']}"
+        except (ValueError, TypeError, KeyError):
+            ok, reply = (False, "Expected a JSON object with a 'command'")
+        else:
+            ok, reply = self.run_command(cmd)
+        return {
+            'ok': ok, 'reply': reply, 'running': self.running,
+            'volts': self.volts, 'amps': self.amps, 'max_watts': self.max_watts,
+        }
 
-    async def main(self):
+    async def read_command_line(self, stream=None):
         """
-        Run the receive and send coroutines
+        Read commands from the given stream (by default, standard input)
+        through the event loop, so waiting for a keystroke doesn't hold up
+        sending or receiving.  Stops at the end of the input.
         """
-        loop = asyncio.get_event_loop()
-        self.reader = can.AsyncBufferedReader()
-        notifier = can.Notifier(self.bus, [self.reader], loop=loop)
-        await asyncio.gather(
-            self.send_message(),
-            self.receive_status(),
+        stream = stream if stream is not None else sys.stdin
+        mode = os.fstat(stream.fileno()).st_mode
+        if not (stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stream.isatty()):
+            # A file (or /dev/null) can't be watched by the event loop, but
+            # never keeps us waiting either, so its commands are run as read
+            for line in stream:
+                if self.finished:
+                    break
+                if isinstance(line, bytes):
+                    line = line.decode(errors='replace')
+                ok, reply = self.run_command(line)
+                print(reply)
+                await asyncio.sleep(0)
+            return
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), stream
         )
-        notifier.stop()
+        try:
+            while not self.finished:
+                print("Cmd: ", end='', flush=True)
+                line = await reader.readline()
+                if not line:
+                    break
+                ok, reply = self.run_command(line.decode(errors='replace'))
+                print(reply)
+        finally:
+            transport.close()
+
+    async def handle_control(self, reader, writer):
+        """
+        Serve one connection to the control socket.  Each line is a command,
+        answered with a line: lines starting with '{' are JSON commands with
+        JSON replies, and anything else is a command as typed at the command
+        line, answered with 'OK' or 'ERR' and the reply's first line.
+        """
+        try:
+            async for line in reader:
+                line = line.decode(errors='replace').strip()
+                if not line:
+                    continue
+                if line.startswith('{'):
+                    reply = json.dumps(self.run_json_command(line))
+                else:
+                    ok, text = self.run_command(line)
+                    reply = f"{'OK' if ok else 'ERR'} {text.splitlines()[0]}"
+                writer.write(reply.encode() + b'\n')
+                # Let slow readers hold up only their own connection
+                await writer.drain()
+                # A flood of buffered commands doesn't wait for the loop, so
+                # give the keep-alive its turn between them
+                await asyncio.sleep(0)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_control(self, path: str = None):
+        """
+        Listen for commands on a local (Unix-domain) socket at the given
+        path, or our `control_path`, until we're finished.  Any number of
+        connections can send commands at once.
+        """
+        path = path if path is not None else self.control_path
+        server = await asyncio.start_unix_server(self.handle_control, path=path)
+        async with server:
+            while not self.finished:
+                await self.clock.sleep(self.update_time)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    async def main(self):
+        """
+        Run the receive and send coroutines, and the command line and
+        control socket if asked for, until we're finished.
+        """
+        # Only wake up for messages from the charger
+        filters = self.utils.can_filters(sources=(elcon_charger_id,))
+        if self.raw_channel is not None:
+            self.reader = RawCANReader(self.raw_channel, self.utils)
+            self.reader.set_filters(filters)
+            notifier = None
+            receive = self.receive_raw_status()
+        else:
+            self.bus.set_filters(filters)
+            self.reader, notifier = open_reader(self.bus)
+            receive = self.receive_status()
+        coroutines = [self.send_message(), receive, self.transmit.run()]
+        if self.interactive:
+            coroutines.append(self.read_command_line())
+        if self.control_path is not None:
+            coroutines.append(self.serve_control())
+        if self.bridge is not None:
+            coroutines.append(self.bridge.run())
+        server = None
+        if self.metrics_port is not None:
+            server = await self.metrics.serve(self.metrics_port)
+            coroutines.append(self.metrics.watch_loop())
+        tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+        keepalive = tasks[0]
+        done, pending = set(), set(tasks)
+        try:
+            # The keep-alive stops when we finish; the rest would run forever,
+            # so they are stopped then (or when any of them fails).  The
+            # command line ends by itself at the end of its input, which
+            # leaves the rest running.
+            while keepalive in pending and not any(
+                task.cancelled() or task.exception() for task in done
+            ):
+                finished, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                done |= finished
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if notifier is not None:
+                notifier.stop()
+            if self.raw_channel is not None:
+                self.reader.shutdown()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+        for task in done:
+            task.result()
 
     def __repr__(self):
         if not self.running:
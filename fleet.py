@@ -0,0 +1,267 @@
+# fleet - drive many Elcon chargers sharing one CANBUS network.
+# Licensed under the GPL V3
+
+import asyncio
+from collections import deque
+import logging
+
+from clock import RealClock
+from loopback import open_reader
+from transmit import TransmitQueue
+from utils import ElconUtils, elcon_manager_id
+
+log = logging.getLogger(__name__)
+
+
+class FleetCharger(object):
+    """
+    The settings for, and statuses from, one charger in a `FleetDriver`.
+
+    As with `ChargerDriver`, the charger is told to run at `volts` and
+    `amps` while it is `running`, with the current curbed so the charger
+    draws no more than `max_watts`.  The last `status_history` statuses
+    from the charger are kept in `statuses`, made when first used.
+    """
+    efficiency_pct: float = 0.95
+    status_history: int = 100
+    _statuses = None
+
+    def __init__(
+        self, address: int, volts: float = 0.0, amps: float = 0.0,
+        max_watts: float = 1000.0
+    ):
+        self.address = address
+        self.volts = volts
+        self.amps = amps
+        self.max_watts = max_watts
+        self.running = False
+        # The slot in the driver's timer wheel this charger is sent in
+        self.slot = None
+
+    @property
+    def statuses(self) -> deque:
+        """
+        The most recent statuses received from the charger, newest last.
+        """
+        if self._statuses is None:
+            self._statuses = deque(maxlen=self.status_history)
+        return self._statuses
+
+    @property
+    def status(self):
+        """
+        The latest status received from the charger, or None.
+        """
+        return self.statuses[-1] if self.statuses else None
+
+    def watts(self) -> float:
+        """
+        The power the charger would draw at its current settings, after
+        curbing the current to `max_watts`.
+        """
+        return (self.volts * self.command_amps()) / self.efficiency_pct
+
+    def command_amps(self) -> float:
+        """
+        The current to tell the charger to run at, curbed to `max_watts`.
+        Unlike `ChargerDriver`, `amps` itself is left as it was set.
+        """
+        if self.volts and (self.volts * self.amps) / self.efficiency_pct > self.max_watts:
+            return (self.max_watts / self.volts) * self.efficiency_pct
+        return self.amps
+
+    def __repr__(self):
+        if not self.running:
+            return f"FleetCharger {self.address:#04x}: not running"
+        return f"FleetCharger {self.address:#04x}: running at {self.volts:.2f}V {self.amps:.2f}A"
+
+
+class FleetDriver(object):
+    """
+    Drive many Elcon chargers, keyed by their CANBUS address, on one bus.
+
+    Rather than each charger having its own send and receive loops, one
+    timer wheel sends all the keep-alive commands: the `update_time` is
+    split into `slots`, each charger is put in the least busy slot, and
+    each tick sends just the chargers in that slot.  This staggers the
+    commands across the period instead of sending them all in a burst.
+    One receive coroutine hands each status to its charger by the address
+    it came from.
+
+    Each charger's current is curbed to its own `max_watts`, and if the
+    driver's `max_watts` is set the current to all running chargers is
+    scaled down together to keep their total power under it.
+
+    Ticks are timed by the given `clock`, which is the real time by default.
+    If a `bridge` (a `mqttbridge.TelemetryBridge`) is set, each status is
+    handed to it to publish, under the charger's address.
+    """
+    update_time: int = 1
+    slots: int = 16
+    max_watts: float = None
+    verbose: bool = True
+    bridge = None
+
+    def __init__(self, bus, clock=None):
+        self.bus = bus
+        self.clock = clock if clock is not None else RealClock()
+        # Frames are sent through here, so a full bus can't block us
+        self.transmit = TransmitQueue(bus, self.clock)
+        self.utils = ElconUtils(our_id=elcon_manager_id)
+        self.chargers = {}
+        self.wheel = [[] for _ in range(self.slots)]
+        self.finished = False
+        # The number of statuses received from addresses we don't drive
+        self.unknown = 0
+        self.reader = None
+
+    def add(self, address: int, **settings) -> FleetCharger:
+        """
+        Add a charger at the given CANBUS address, with any of the
+        `FleetCharger` settings, and return it.
+        """
+        if address in self.chargers:
+            raise ValueError(f"Already driving a charger at {address:#04x}")
+        charger = FleetCharger(address, **settings)
+        charger.slot = min(range(self.slots), key=lambda s: len(self.wheel[s]))
+        self.wheel[charger.slot].append(charger)
+        self.chargers[address] = charger
+        self.update_filters()
+        return charger
+
+    def remove(self, address: int) -> FleetCharger:
+        """
+        Stop driving the charger at the given CANBUS address, and return it.
+        """
+        charger = self.chargers.pop(address)
+        self.wheel[charger.slot].remove(charger)
+        charger.slot = None
+        self.update_filters()
+        return charger
+
+    def __getitem__(self, address: int) -> FleetCharger:
+        return self.chargers[address]
+
+    def __len__(self):
+        return len(self.chargers)
+
+    def update_filters(self):
+        """
+        Once we're receiving, only wake up for messages from our chargers.
+        """
+        if self.reader is not None:
+            self.bus.set_filters(self.utils.can_filters(sources=self.chargers))
+
+    def start(self, *addresses):
+        """
+        Start the chargers at the given addresses, or all of them.
+        """
+        for address in addresses or self.chargers:
+            self.chargers[address].running = True
+
+    def stop(self, *addresses):
+        """
+        Stop the chargers at the given addresses, or all of them.
+        """
+        for address in addresses or self.chargers:
+            self.chargers[address].running = False
+
+    def finish(self):
+        # Any shutdown
+        self.finished = True
+
+    def power_scale(self) -> float:
+        """
+        The fraction of their current the running chargers are told to run
+        at, to keep their total power under our `max_watts`.
+        """
+        if self.max_watts is None:
+            return 1.0
+        total = sum(
+            charger.watts() for charger in self.chargers.values()
+            if charger.running
+        )
+        if total <= self.max_watts:
+            return 1.0
+        return self.max_watts / total
+
+    def send_slot(self, slot: int):
+        """
+        Send the commands to the running chargers in the given slot of the
+        timer wheel.
+        """
+        chargers = [charger for charger in self.wheel[slot] if charger.running]
+        if not chargers:
+            return
+        scale = self.power_scale()
+        for charger in chargers:
+            msg = self.utils.pack_command(
+                charger.address, charger.volts,
+                charger.command_amps() * scale, enable=True
+            )
+            if msg is not None:
+                self.transmit.send(msg)
+
+    async def send_messages(self):
+        """
+        Turn the timer wheel, sending each slot's commands in turn so each
+        charger hears from us once every `update_time`.
+        """
+        tick = self.update_time / self.slots
+        slot = 0
+        while not self.finished:
+            self.send_slot(slot)
+            slot = (slot + 1) % self.slots
+            await self.clock.sleep(tick)
+
+    async def receive_status(self):
+        """
+        Receive statuses from the chargers, and hand them to each charger.
+        """
+        async for msg in self.reader:
+            status = self.utils.decode_status(msg)
+            if status is None:
+                continue
+            charger = self.chargers.get(status.source)
+            if charger is None:
+                self.unknown += 1
+                continue
+            charger.statuses.append(status)
+            if self.bridge is not None:
+                self.bridge.update_status(f"charger/{status.source:02x}", status)
+            if self.verbose:
+                log.info(
+                    "Received from charger %#04x: %.2fV %.2fA flags=%#04x",
+                    status.source, status.voltage, status.current, status.flags
+                )
+
+    async def main(self):
+        """
+        Run the receive and send coroutines until we're finished.
+        """
+        self.reader, notifier = open_reader(self.bus)
+        self.update_filters()
+        coroutines = [
+            self.send_messages(), self.receive_status(), self.transmit.run()
+        ]
+        if self.bridge is not None:
+            coroutines.append(self.bridge.run())
+        tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+        try:
+            # Sending stops when we finish; the rest would run forever, so
+            # they are stopped then (or when any of them fails)
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if notifier is not None:
+                notifier.stop()
+        for task in done:
+            task.result()
+
+    def __repr__(self):
+        running = sum(1 for charger in self.chargers.values() if charger.running)
+        return f"FleetDriver: {running} of {len(self.chargers)} chargers running"
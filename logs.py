@@ -0,0 +1,96 @@
+# logs - queued, rate-limited logging for the driver and simulator.
+# Licensed under the GPL V3
+
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import sys
+import time
+
+log_format = '%(asctime)s %(name)s %(levelname)s %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `rate` records of each kind every `per` seconds.
+
+    Records are the same kind if they come from the same logger with the
+    same message template, whatever their arguments, so a flood of
+    "Ignoring message" or status lines collapses to a few a second.  The
+    first record let through after some were held back says how many.
+    """
+
+    def __init__(self, rate: int = 5, per: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        # Per kind: the start of its window, the records let through in it
+        # and the records suppressed since the last one let through
+        self.windows = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.per:
+            held = window[2] if window is not None else 0
+            window = self.windows[key] = [now, 0, held]
+        if window[1] >= self.rate:
+            window[2] += 1
+            self.suppressed += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record.msg = f"{record.msg} [%d similar suppressed]"
+            record.args = (record.args if isinstance(record.args, tuple) else ()) + (window[2],)
+            window[2] = 0
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    A `QueueHandler` that leaves formatting the message to the thread
+    draining the queue, so the caller only pays for making the record.
+    The arguments of messages logged this way mustn't change afterwards.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_logging(
+    level: int = logging.INFO, handler: logging.Handler = None,
+    rate: int = 5, per: float = 1.0
+) -> QueueListener:
+    """
+    Send everything logged at `level` and above through a queue to the
+    given handler (by default, standard error) on a background thread,
+    rate-limited by a `RateLimitFilter`.  Returns the queue's listener,
+    to give to `stop_logging` when finished.
+    """
+    if handler is None:
+        handler = logging.StreamHandler(sys.stderr)
+    if handler.formatter is None:
+        handler.setFormatter(logging.Formatter(log_format))
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(rate, per))
+    root = logging.getLogger()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.queue_handler = queue_handler
+    listener.previous_level = root.level
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+def stop_logging(listener: QueueListener):
+    """
+    Stop queueing log records, and wait for those queued to be handled.
+    """
+    root = logging.getLogger()
+    root.removeHandler(listener.queue_handler)
+    root.setLevel(listener.previous_level)
+    listener.stop()
@@ -1,15 +1,31 @@
 import asyncio
-import can
 
 import battery
 import driver
+import logs
+import loopback
 import simulator
 
-can0 = can.Bus('vcan0', bustype='socketcan')
-bat = battery.Battery(capacity=10, cells=30)
-driver = driver.ChargerDriver(can0)
-driver.volts = 120
-driver.amps = 10
-driver.start()
+# Log through a queue, so writing to the terminal never holds up the loop
+listener = logs.start_logging()
 
-sim = simulator.ElconCharger(can0, bat)
+
+async def main():
+    # The driver and simulated charger share an in-process bus; pass them
+    # can.Bus('vcan0', bustype='socketcan') instead to go through the kernel.
+    # To drive several interfaces at once, see shard.Supervisor.
+    # Everything is made in the event loop that runs it.
+    bus = loopback.LoopbackBus()
+    bat = battery.Battery(capacity=10, cells=30)
+    drv = driver.ChargerDriver(bus.end())
+    drv.volts = 120
+    drv.amps = 10
+    drv.start()
+
+    sim = simulator.ElconCharger(bus.end(), bat)
+    await asyncio.gather(drv.main(), sim.main())
+
+try:
+    asyncio.run(main())
+finally:
+    logs.stop_logging(listener)
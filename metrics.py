@@ -0,0 +1,196 @@
+# metrics - latency histograms for the driver and simulator, with a
+# snapshot API and a Prometheus text endpoint.
+# Licensed under the GPL V3
+
+import asyncio
+
+# Each power of two is split into 2 ** (_sub_bits - 1) buckets, so values
+# are kept to within one part in 64.
+_sub_bits = 7
+_half = 1 << (_sub_bits - 1)
+
+
+class Histogram(object):
+    """
+    An HDR-style histogram of durations in seconds.
+
+    Values are counted in whole microseconds, in buckets that are linear
+    within each power of two, so the relative error stays under 2% from a
+    microsecond up to days, and recording a value is only a little integer
+    arithmetic and a list increment.  Percentiles are read from the
+    buckets; the count, sum, minimum and maximum are exact.
+    """
+    unit = 1e-6
+
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self.counts = []
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds: float):
+        if seconds < 0:
+            seconds = 0.0
+        value = int(seconds / self.unit)
+        shift = value.bit_length() - _sub_bits
+        if shift < 0:
+            shift = 0
+        index = (shift << (_sub_bits - 1)) + (value >> shift)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def _bucket_middle(index: int) -> float:
+        # The middle of the range of microseconds counted in the bucket
+        if index < (1 << _sub_bits):
+            return float(index)
+        shift = (index >> (_sub_bits - 1)) - 1
+        lower = (index - (shift << (_sub_bits - 1))) << shift
+        return lower + ((1 << shift) - 1) / 2
+
+    def percentile(self, percent: float) -> float:
+        """
+        The value below which the given percentage of the values lie, or
+        None if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                value = self._bucket_middle(index) * self.unit
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def reset(self):
+        self.counts = []
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def snapshot(self) -> dict:
+        """
+        The histogram's count, sum, mean, minimum, maximum and percentiles
+        as a dictionary.
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+    def __repr__(self):
+        if not self.count:
+            return f"Histogram {self.name}: empty"
+        return (
+            f"Histogram {self.name}: {self.count} values, "
+            f"p50 {self.percentile(50):.6f}s, p99 {self.percentile(99):.6f}s, "
+            f"max {self.max:.6f}s"
+        )
+
+
+class Metrics(object):
+    """
+    A set of named histograms, which can be read as a dictionary with
+    `snapshot` or as Prometheus text with `prometheus`, and served over
+    HTTP on a local port with `serve`.
+    """
+    quantiles = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self):
+        self.histograms = {}
+
+    def histogram(self, name: str, help: str = '') -> Histogram:
+        """
+        Get the histogram with the given name, making it if need be.
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help)
+        return self.histograms[name]
+
+    def snapshot(self) -> dict:
+        return {
+            name: histogram.snapshot()
+            for name, histogram in self.histograms.items()
+        }
+
+    def prometheus(self) -> str:
+        """
+        The histograms in the Prometheus text exposition format, as
+        summaries with quantiles.
+        """
+        lines = []
+        for name, histogram in self.histograms.items():
+            if histogram.help:
+                lines.append(f"# HELP {name} {histogram.help}")
+            lines.append(f"# TYPE {name} summary")
+            for quantile in self.quantiles:
+                value = histogram.percentile(quantile * 100)
+                lines.append(
+                    f'{name}{{quantile="{quantile}"}} '
+                    f'{"NaN" if value is None else repr(value)}'
+                )
+            lines.append(f"{name}_sum {histogram.sum!r}")
+            lines.append(f"{name}_count {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    async def watch_loop(self, interval: float = 0.1):
+        """
+        Record how late the event loop wakes us up, every `interval`
+        seconds, in the `pyelcon_loop_lag_seconds` histogram.  This is
+        always in real time, whatever clock the rest of the code runs on.
+        """
+        lag = self.histogram(
+            'pyelcon_loop_lag_seconds',
+            'How late the event loop ran a timer that was due'
+        )
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag.record(loop.time() - due)
+
+    async def _handle(self, reader, writer):
+        try:
+            # Whatever was asked for, the answer is the metrics
+            while (await reader.readline()).strip():
+                pass
+            body = self.prometheus().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """
+        Start serving the metrics in Prometheus text over HTTP, on the
+        given local port, and return the server.
+        """
+        return await asyncio.start_server(self._handle, host=host, port=port)
@@ -0,0 +1,160 @@
+# mqttbridge - publish charger telemetry to an MQTT broker.
+# Licensed under the GPL V3
+
+import asyncio
+import json
+import logging
+
+from clock import RealClock
+
+log = logging.getLogger(__name__)
+
+
+def connect(host: str = 'localhost', port: int = 1883, client_id: str = ''):
+    """
+    Connect to the MQTT broker at the given host and port, with paho-mqtt
+    (which is only needed for this), and start its network thread.
+    Returns the client, to give to a `TelemetryBridge`.
+    """
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        raise RuntimeError("paho-mqtt is needed to publish to an MQTT broker")
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    else:
+        client = mqtt.Client(client_id=client_id)
+    client.connect(host, port)
+    client.loop_start()
+    return client
+
+
+class LocalBroker(object):
+    """
+    An in-process stand-in for an MQTT broker and its client, with no
+    network behind it, that keeps what is published to it.
+
+    Pass it to a `TelemetryBridge` in place of a paho-mqtt client.  Each
+    message published is kept in `messages` as a (topic, payload) tuple,
+    and handed to the callbacks subscribed to its topic.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.subscribers = {}
+
+    def subscribe(self, topic: str, callback):
+        self.subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False):
+        self.messages.append((topic, payload))
+        for callback in self.subscribers.get(topic, ()):
+            callback(topic, payload)
+
+
+class TelemetryBridge(object):
+    """
+    Publish charger statuses to MQTT, only when they change, in batches.
+
+    The driver, fleet driver and simulator hand each status to `update`
+    (if their `bridge` is set), under a key naming the charger.  A status
+    is only kept if its voltage or current has moved by at least
+    `volts_deadband` or `amps_deadband` from the last one kept for that
+    charger, or any of its flags have changed; the rest are counted in
+    `suppressed`.  Only the latest status kept for each charger waits to be
+    published.
+
+    Every `flush_interval` seconds, `run` publishes everything waiting as
+    one JSON message to `topic`, mapping each charger's key to its latest
+    status.  Encoding and publishing are done in a thread off the event
+    loop, so however many chargers there are, the loop only pays for a
+    comparison per status and the broker sees one message per interval.
+
+    The `client` is a paho-mqtt client (from `connect`, say) or anything
+    else with its `publish` method, such as a `LocalBroker`.  Flushes are
+    timed by the given `clock`, which is the real time by default.
+    """
+    volts_deadband: float = 0.5
+    amps_deadband: float = 0.2
+    flush_interval: float = 1.0
+    topic: str = 'pyelcon/status'
+    qos: int = 0
+
+    def __init__(self, client, clock=None):
+        self.client = client
+        self.clock = clock if clock is not None else RealClock()
+        # The last status kept for each charger, to compare the next with
+        self.last = {}
+        # The statuses waiting to be published, by charger
+        self.pending = {}
+        self.updates = 0
+        self.suppressed = 0
+        self.published = 0
+        self.running = False
+
+    def update(self, key: str, voltage: float, current: float, flags: int) -> bool:
+        """
+        Note the latest status of the charger with the given key, to be
+        published if it has changed enough.  Returns whether it had.
+        """
+        self.updates += 1
+        last = self.last.get(key)
+        if last is not None and flags == last[2] \
+                and abs(voltage - last[0]) < self.volts_deadband \
+                and abs(current - last[1]) < self.amps_deadband:
+            self.suppressed += 1
+            return False
+        self.last[key] = (voltage, current, flags)
+        self.pending[key] = (self.clock.now(), voltage, current, flags)
+        return True
+
+    def update_status(self, key: str, status) -> bool:
+        """
+        Note a `utils.ChargerStatus` for the charger with the given key.
+        """
+        return self.update(key, status.voltage, status.current, status.flags)
+
+    def _publish(self, now: float, batch: dict):
+        # Times go out as seconds since the epoch
+        wall_time = self.clock.wall_time
+        payload = json.dumps({
+            'time': wall_time(now),
+            'chargers': {
+                key: {
+                    'time': wall_time(time), 'voltage': voltage, 'current': current,
+                    'flags': flags,
+                }
+                for key, (time, voltage, current, flags) in batch.items()
+            },
+        })
+        self.client.publish(self.topic, payload, qos=self.qos)
+
+    async def flush(self):
+        """
+        Publish everything waiting, if anything is, off the event loop.
+        """
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._publish, self.clock.now(), batch)
+        self.published += 1
+
+    async def run(self):
+        """
+        Publish what is waiting every `flush_interval` seconds.  If the
+        bridge is already being run (by another driver or simulator
+        sharing it), this returns straight away.
+        """
+        if self.running:
+            return
+        self.running = True
+        try:
+            while True:
+                await self.clock.sleep(self.flush_interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    log.exception("Failed to publish to MQTT")
+        finally:
+            self.running = False
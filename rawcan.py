@@ -0,0 +1,193 @@
+# rawcan - read Elcon statuses straight from a Linux CAN_RAW socket.
+# Licensed under the GPL V3
+
+import asyncio
+import socket
+from struct import Struct
+
+import numpy as np
+
+from utils import ChargerStatus, ElconUtils, elcon_broadcast_id
+
+# The kernel's `struct can_frame`: the CAN ID (with the extended, remote
+# and error flags in its top bits) in host order, the data length, three
+# bytes of padding and eight of data.
+can_frame_dtype = np.dtype([
+    ('can_id', '=u4'), ('len', 'u1'), ('pad', 'u1', (3,)), ('data', 'u1', (8,)),
+])
+_can_id_struct = Struct('=I')
+# The Elcon voltage, current and flags at the start of the data
+_data_struct = Struct('>HHB')
+_filter_struct = Struct('=II')
+can_frame_size = can_frame_dtype.itemsize
+assert can_frame_size == 16
+
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1FFFFFFF
+CAN_SFF_MASK = 0x000007FF
+# socket.CAN_RAW_FILTER and socket.SOL_CAN_RAW, which only exist on Linux
+_SOL_CAN_RAW = 101
+_CAN_RAW_FILTER = 1
+
+
+def available() -> bool:
+    """
+    Whether this system can open CAN_RAW sockets at all.
+    """
+    return hasattr(socket, 'AF_CAN') and hasattr(socket, 'CAN_RAW')
+
+
+def pack_filters(filters) -> bytes:
+    """
+    Pack filters, in the form `can.BusABC.set_filters` (and
+    `ElconUtils.can_filters`) gives them, into the kernel's array of
+    `struct can_filter` for the CAN_RAW_FILTER socket option.
+    """
+    packed = bytearray()
+    for f in filters:
+        can_id, can_mask = f['can_id'], f['can_mask']
+        if f.get('extended', False):
+            can_id = (can_id & CAN_EFF_MASK) | CAN_EFF_FLAG
+            can_mask = (can_mask & CAN_EFF_MASK) | CAN_EFF_FLAG
+        else:
+            can_id &= CAN_SFF_MASK
+            can_mask = (can_mask & CAN_SFF_MASK) | CAN_EFF_FLAG
+        packed += _filter_struct.pack(can_id, can_mask)
+    return bytes(packed)
+
+
+class RawCANReader(object):
+    """
+    Read Elcon statuses straight from a CAN_RAW socket, for the driver's
+    fast path on Linux.
+
+    Rather than python-can's `Notifier` thread making a `can.Message` of
+    each frame and handing it to the event loop, the socket is read on the
+    event loop itself: whenever it is readable, up to `batch` frames are
+    read into a buffer allocated once, and each is decoded from its slot
+    in the buffer into a `ChargerStatus` for `utils`, the way
+    `ElconUtils.decode_status` would.  Iterating over the reader yields
+    those statuses; `batches` yields them as arrays instead.
+
+    The socket is bound to the CAN interface `channel`, unless an already
+    open datagram `sock` carrying `struct can_frame`s is given instead.
+    Frames that aren't extended data frames to us or to the broadcast
+    address are counted in `utils.rejected`.
+    """
+    batch: int = 256
+
+    def __init__(self, channel: str, utils: ElconUtils, sock: socket.socket = None):
+        self.utils = utils
+        if sock is None:
+            sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+            sock.bind((channel,))
+        sock.setblocking(False)
+        self.sock = sock
+        self.channel_info = f"raw CAN on {channel}"
+        self.buffer = bytearray(self.batch * can_frame_size)
+        self.slots = [
+            memoryview(self.buffer)[i * can_frame_size:(i + 1) * can_frame_size]
+            for i in range(self.batch)
+        ]
+        # Set by the event loop when the socket is readable
+        self.readable = asyncio.Event()
+        self.loop = None
+        self.received = 0
+        self.reads = 0
+
+    def set_filters(self, filters=None):
+        """
+        Have the kernel only pass the frames matching the given filters,
+        in the form `can.BusABC.set_filters` takes; None passes everything.
+        """
+        if filters is None:
+            filters = [{'can_id': 0, 'can_mask': 0, 'extended': False}]
+        self.sock.setsockopt(_SOL_CAN_RAW, _CAN_RAW_FILTER, pack_filters(filters))
+
+    def read_frames(self) -> int:
+        """
+        Read as many frames as are waiting, up to `batch` of them, into the
+        buffer without waiting, and return how many were read.
+        """
+        count = 0
+        recv_into = self.sock.recv_into
+        for slot in self.slots:
+            try:
+                recv_into(slot, can_frame_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            count += 1
+        self.reads += 1
+        self.received += count
+        return count
+
+    def decode(self, count: int) -> list:
+        """
+        Decode the first `count` frames in the buffer into statuses.
+        """
+        statuses = []
+        buffer = self.buffer
+        our_id = self.utils.our_id
+        for offset in range(0, count * can_frame_size, can_frame_size):
+            (can_id,) = _can_id_struct.unpack_from(buffer, offset)
+            dest = (can_id >> 8) & 0xFF
+            if (can_id & (CAN_EFF_FLAG | CAN_RTR_FLAG | CAN_ERR_FLAG)) != CAN_EFF_FLAG \
+                    or buffer[offset + 4] != 5 \
+                    or not (dest == our_id or dest == elcon_broadcast_id):
+                self.utils.rejected += 1
+                continue
+            voltage, current, flags = _data_struct.unpack_from(buffer, offset + 8)
+            statuses.append(ChargerStatus(
+                can_id & 0xFF, dest, voltage / 10, current / 10, flags
+            ))
+        return statuses
+
+    def decode_array(self, count: int) -> np.ndarray:
+        """
+        Decode the first `count` frames in the buffer into an array of
+        `utils.elcon_status_dtype`, as `ElconUtils.unpack_status_array`.
+        """
+        frames = np.frombuffer(self.buffer, dtype=can_frame_dtype, count=count)
+        ids = frames['can_id']
+        keep = ((ids & (CAN_EFF_FLAG | CAN_RTR_FLAG | CAN_ERR_FLAG)) == CAN_EFF_FLAG) \
+            & (frames['len'] == 5)
+        self.utils.rejected += count - np.count_nonzero(keep)
+        return self.utils.unpack_status_array(
+            ids[keep] & CAN_EFF_MASK, frames['data'][keep, :5]
+        )
+
+    def _watch(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(self.sock.fileno(), self.readable.set)
+
+    async def _wait_frames(self) -> int:
+        self._watch()
+        while True:
+            count = self.read_frames()
+            if count:
+                return count
+            self.readable.clear()
+            await self.readable.wait()
+
+    async def batches(self):
+        """
+        Yield arrays of the statuses read, a batch at a time.
+        """
+        while True:
+            count = await self._wait_frames()
+            yield self.decode_array(count)
+
+    async def __aiter__(self):
+        while True:
+            count = await self._wait_frames()
+            for status in self.decode(count):
+                yield status
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.loop = None
+        self.sock.close()
@@ -0,0 +1,312 @@
+# shard - drive several CANBUS interfaces at once, one worker process each.
+# Licensed under the GPL V3
+
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+import can
+import numpy as np
+
+from battery import Battery
+from fleet import FleetDriver
+from simulator import ElconCharger
+from snapshot import Snapshotter
+
+log = logging.getLogger(__name__)
+
+# Each worker's heartbeat, and how often it has been (re)started
+header_dtype = np.dtype([
+    ('pid', '<i8'), ('heartbeat', '<f8'), ('starts', '<u4'),
+])
+# One row for each address on each bus: the latest status from the
+# charger there and the setpoint it is being sent.  `seq` is odd while
+# the row is being written.
+row_dtype = np.dtype([
+    ('seq', '<u8'), ('timestamp', '<f8'),
+    ('voltage', '<f8'), ('current', '<f8'), ('flags', 'u1'),
+    ('set_volts', '<f8'), ('set_amps', '<f8'), ('running', '?'),
+])
+addresses = 256
+
+
+class ShardTable(object):
+    """
+    The latest status and setpoint of every charger on every bus, in
+    shared memory, so that a coordinator can read what all the workers
+    are doing without asking them.
+
+    `rows` is an array of `row_dtype` indexed by [shard, address], and
+    `headers` one of `header_dtype` indexed by shard.  Each shard's rows
+    are only written by its own worker, through `write_status` and
+    `write_setpoint`; `read` takes a consistent copy of them, retrying any
+    row caught half written.
+
+    The table is created (with a name chosen by the system, unless one is
+    given) unless `create` is False, when the existing table of that name
+    is attached to.  The creator should `unlink` it when finished.
+    """
+    read_retries: int = 1000
+
+    def __init__(self, shards: int, name: str = None, create: bool = True):
+        size = shards * (header_dtype.itemsize + addresses * row_dtype.itemsize)
+        self.memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.name = self.memory.name
+        self.shards = shards
+        self.headers = np.ndarray(
+            (shards,), dtype=header_dtype, buffer=self.memory.buf
+        )
+        self.rows = np.ndarray(
+            (shards, addresses), dtype=row_dtype, buffer=self.memory.buf,
+            offset=shards * header_dtype.itemsize
+        )
+        if create:
+            self.headers[:] = 0
+            self.rows[:] = 0
+
+    def write_status(self, shard: int, status, timestamp: float):
+        row = self.rows[shard, status.source]
+        row['seq'] += 1
+        row['timestamp'] = timestamp
+        row['voltage'] = status.voltage
+        row['current'] = status.current
+        row['flags'] = status.flags
+        row['seq'] += 1
+
+    def write_setpoint(self, shard: int, address: int, volts: float, amps: float, running: bool):
+        row = self.rows[shard, address]
+        row['seq'] += 1
+        row['set_volts'] = volts
+        row['set_amps'] = amps
+        row['running'] = running
+        row['seq'] += 1
+
+    def read(self, shard: int = None) -> np.ndarray:
+        """
+        A consistent copy of the rows of the given shard, or of all of
+        them.  A row still being written after `read_retries` tries (left
+        that way by a worker that died, say) is returned as it stands.
+        """
+        rows = self.rows if shard is None else self.rows[shard]
+        copy = rows.copy()
+        for attempt in range(self.read_retries):
+            torn = ((copy['seq'] & 1) == 1) | (copy['seq'] != rows['seq'])
+            if not torn.any():
+                break
+            copy[torn] = rows[torn]
+        return copy
+
+    def chargers(self, shard: int) -> np.ndarray:
+        """
+        The addresses on the given shard that have been heard from or
+        given a setpoint.
+        """
+        rows = self.read(shard)
+        return np.flatnonzero(rows['seq'])
+
+    def close(self):
+        self.headers = self.rows = None
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+class ShardPublisher(object):
+    """
+    Keep one worker's rows in a `ShardTable` up to date with its
+    `FleetDriver`.
+
+    Set as the fleet's `bridge`, each status goes into the table as it
+    arrives; `run` writes every charger's setpoint, and the worker's
+    heartbeat, every `interval` seconds.
+    """
+    interval: float = 0.1
+
+    def __init__(self, table: ShardTable, shard: int, fleet: FleetDriver):
+        self.table = table
+        self.shard = shard
+        self.fleet = fleet
+
+    def update_status(self, key: str, status) -> bool:
+        self.table.write_status(self.shard, status, time.time())
+        return True
+
+    def publish(self):
+        for charger in self.fleet.chargers.values():
+            self.table.write_setpoint(
+                self.shard, charger.address, charger.volts,
+                charger.command_amps(), charger.running
+            )
+        # Only ever compared with the time now, so not thrown out if the
+        # system clock is set
+        self.table.headers[self.shard]['heartbeat'] = time.monotonic()
+
+    async def run(self):
+        while True:
+            self.publish()
+            await self.fleet.clock.sleep(self.interval)
+
+
+async def _work(shard: int, config: dict, table: ShardTable):
+    interface = config.get('interface', 'socketcan')
+    fleet = FleetDriver(can.Bus(config['channel'], interface=interface))
+    fleet.verbose = False
+    for address, settings in config['chargers'].items():
+        fleet.add(int(address), **settings)
+    fleet.bridge = ShardPublisher(table, shard, fleet)
+    chargers = []
+    # Simulated chargers have to be in this process to share a virtual bus
+    if config.get('simulate', False):
+        for address in fleet.chargers:
+            charger = ElconCharger(
+                can.Bus(config['channel'], interface=interface),
+                Battery(**config.get('battery', {'capacity': 10, 'cells': 4})),
+                address=address
+            )
+            charger.verbose = False
+            chargers.append(charger)
+    # All of them are saved in the one file, by the one thread
+    snapshotter = None
+    if chargers and config.get('snapshot_path') is not None:
+        snapshotter = Snapshotter(chargers, config['snapshot_path'])
+        snapshotter.interval = config.get('snapshot_interval', snapshotter.interval)
+        snapshotter.restore()
+        for charger in chargers:
+            charger.snapshotter = snapshotter
+    simulating = [asyncio.create_task(charger.main()) for charger in chargers]
+    if snapshotter is not None:
+        simulating.append(asyncio.create_task(snapshotter.run()))
+    fleet.start()
+    try:
+        await fleet.main()
+    finally:
+        for task in simulating:
+            task.cancel()
+        await asyncio.gather(*simulating, return_exceptions=True)
+        if snapshotter is not None:
+            snapshotter.close()
+
+
+def run_worker(shard: int, config: dict, table_name: str, shards: int):
+    """
+    Drive the chargers on one bus, as given by its `config`, publishing
+    into the shared table of the given name.  This is the body of each
+    worker process.
+    """
+    table = ShardTable(shards, table_name, create=False)
+    table.headers[shard]['pid'] = multiprocessing.current_process().pid
+    try:
+        asyncio.run(_work(shard, config, table))
+    finally:
+        table.close()
+
+
+class Supervisor(object):
+    """
+    Run a `FleetDriver` in a worker process for each bus in `configs`, all
+    publishing into one `ShardTable`, and restart any that die.
+
+    Each config is a dict giving the bus's `channel` and python-can
+    `interface` (socketcan by default), and the `chargers` on it as a
+    dict of address to `FleetCharger` settings.  If `simulate` is set, the
+    worker also simulates those chargers on the bus, with a `Battery` made
+    from the `battery` settings, which is how `virtual` buses (which only
+    reach within one process) are tested.  If `snapshot_path` is also
+    given, the simulated chargers are all saved there every
+    `snapshot_interval` seconds, and restored from there when the worker
+    (re)starts.
+
+    `check` restarts any worker that has exited, or whose heartbeat is
+    more than `heartbeat_timeout` seconds old (after giving it
+    `start_timeout` seconds to start); `run` checks every `check_interval`
+    seconds.  Workers are started with the `spawn` method, so they don't
+    inherit the supervisor's event loop.
+    """
+    heartbeat_timeout: float = 5.0
+    start_timeout: float = 30.0
+    check_interval: float = 1.0
+
+    def __init__(self, configs: list):
+        self.configs = list(configs)
+        self.table = ShardTable(len(self.configs))
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = [None] * len(self.configs)
+        self.started = [0.0] * len(self.configs)
+        self.restarts = 0
+
+    def _start(self, shard: int):
+        # A worker killed part way through writing a row leaves its `seq`
+        # odd, which the next worker's writes would keep it; make them all
+        # even before it starts
+        rows = self.table.rows[shard]
+        rows['seq'] += rows['seq'] & 1
+        self.table.headers[shard]['heartbeat'] = 0
+        self.table.headers[shard]['starts'] += 1
+        process = self.context.Process(
+            target=run_worker, daemon=True,
+            args=(shard, self.configs[shard], self.table.name, len(self.configs)),
+            name=f"shard-{shard}-{self.configs[shard]['channel']}",
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started[shard] = time.monotonic()
+
+    def start(self):
+        for shard in range(len(self.configs)):
+            self._start(shard)
+
+    def _stale(self, shard: int, now: float) -> bool:
+        heartbeat = self.table.headers[shard]['heartbeat']
+        if heartbeat == 0:
+            return now - self.started[shard] > self.start_timeout
+        return now - heartbeat > self.heartbeat_timeout
+
+    def check(self) -> list:
+        """
+        Restart any workers that have died or stopped beating, and return
+        the shards restarted.
+        """
+        now = time.monotonic()
+        restarted = []
+        for shard, process in enumerate(self.processes):
+            if process is None:
+                continue
+            if process.is_alive() and not self._stale(shard, now):
+                continue
+            log.warning(
+                "Restarting worker for %s (exit code %s)",
+                self.configs[shard]['channel'], process.exitcode
+            )
+            if process.is_alive():
+                process.kill()
+            process.join()
+            self._start(shard)
+            self.restarts += 1
+            restarted.append(shard)
+        return restarted
+
+    async def run(self):
+        """
+        Start the workers, and keep them running.
+        """
+        self.start()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            self.check()
+
+    def stop(self):
+        """
+        Stop the workers, and release the shared table.
+        """
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join()
+        self.processes = [None] * len(self.configs)
+        self.table.close()
+        self.table.unlink()
@@ -1,14 +1,23 @@
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime
 import asyncio
+import logging
 
 # from can import Bus, Message, Listener
-import can
 
 from battery import Battery
+from clock import RealClock
+from loopback import open_reader
+from metrics import Metrics
+from snapshot import Snapshotter
+from telemetry import Telemetry
+from transmit import TransmitQueue
 from utils import (
     ElconUtils, elcon_charger_id, elcon_manager_id, elcon_broadcast_id
 )
 
+log = logging.getLogger(__name__)
+
 
 class ElconCharger(object):
     """
@@ -16,88 +25,250 @@ class ElconCharger(object):
 
     Elcon chargers emit their current status every second, and expect to
     receive a message no later than once every two seconds telling them what
-    state to charge the battery.
+    state to charge the battery.  The timeout is a single deadline, re-armed
+    by every command, so an idle charger costs nothing until it fires.
+
+    Time is kept by the given `clock` - by default the real time, but a
+    `clock.VirtualClock` lets whole charge sessions run in moments.
+
+    The status emitted each interval is kept in `telemetry`, a ring buffer
+    of the last `telemetry_size` samples (in a file at `telemetry_path`, if
+    set), and the last `command_history` commands received in `commands`.
+    Both are made when first used, so the sizes can be set until then.
+
+    The gaps between the commands received, how far each status strays
+    from `status_interval` after the last, and how long each command takes
+    to decode are recorded in the histograms in `metrics`, and served in
+    Prometheus text on the local `metrics_port` if that is set (along with
+    how late the event loop runs, which is only watched then, so an idle
+    charger costs nothing).
+
+    The charger answers to the CANBUS `address` given, so that many of them
+    can share a bus.  If a `bridge` (a `mqttbridge.TelemetryBridge`) is
+    set, the status it emits is handed to it to publish as well.
+
+    If `snapshot_path` is set, the state of the charger and its battery is
+    saved there every `snapshot_interval` seconds and when the charger
+    stops, and restored from there when it starts, so a long simulation
+    can pick up where it left off.  Many chargers are better served by one
+    `snapshot.Snapshotter` for them all, set as `snapshotter` on each: its
+    owner restores, runs and closes it, and the chargers only note whether
+    they were restored.
     """
     status_interval = 1
     update_timeout = 2
     verbose = True
+    command_history = 100
+    telemetry_size = 3600
+    telemetry_path = None
+    metrics_port = None
+    bridge = None
+    snapshot_path = None
+    snapshot_interval = 60
+    snapshotter = None
+    _commands = None
+    _telemetry = None
 
-    def __init__(self, bus, battery):
+    def __init__(self, bus, battery, clock=None, address=elcon_charger_id):
         self.battery = battery
         self.bus = bus
-        self.utils = ElconUtils(our_id=elcon_charger_id)
+        self.clock = clock if clock is not None else RealClock()
+        # Frames are sent through here, so a full bus can't block us
+        self.transmit = TransmitQueue(bus, self.clock)
+        self.utils = ElconUtils(our_id=address)
         self.active = False
-        self.last_time = datetime.now()
+        self.last_time = self.clock.now()
+        self.timeout_handle = None
+        self.timeout_at = None
         self.volts: float = 0.0
         self.amps: float = 0.0
         self.output_amps: float = 0.0
+        self.metrics = Metrics()
+        self.command_interval = self.metrics.histogram(
+            'pyelcon_charger_command_interval_seconds',
+            'Time between commands from the driver while active'
+        )
+        self.status_jitter = self.metrics.histogram(
+            'pyelcon_charger_status_jitter_seconds',
+            'How far the time between statuses strays from the status interval'
+        )
+        self.utils.decode_time = self.metrics.histogram(
+            'pyelcon_charger_decode_seconds', 'Time taken to decode each command'
+        )
+
+    @property
+    def commands(self) -> deque:
+        """
+        The most recent commands received from the driver, newest last.
+        """
+        if self._commands is None:
+            self._commands = deque(maxlen=self.command_history)
+        return self._commands
+
+    @property
+    def telemetry(self) -> Telemetry:
+        """
+        The history of the status we've emitted, for analysis.
+        """
+        if self._telemetry is None:
+            self._telemetry = Telemetry(self.telemetry_size, self.telemetry_path)
+        return self._telemetry
 
     async def emit_status(self):
         """
         Emit the charger's status every interval, to console and on CANBUS
         """
+        last = None
         while True:
-            if self.active:
-                print(
-                    f"Charger active, set to {self.volts:.2f}V "
-                    f"{self.amps:.2f}A, output {self.output_amps:.2f}A"
+            now = self.clock.now()
+            if last is not None:
+                self.status_jitter.record(abs(now - last - self.status_interval))
+            last = now
+            if self.verbose:
+                if self.active:
+                    log.info(
+                        "Charger active, set to %.2fV %.2fA, output %.2fA",
+                        self.volts, self.amps, self.output_amps
+                    )
+                else:
+                    log.info(
+                        "Charger inactive, last update %s",
+                        datetime.fromtimestamp(self.clock.wall_time(self.last_time))
+                    )
+                # Only unchanging values, as the record may be formatted
+                # after the battery has charged some more
+                log.info(
+                    "... Battery: %.3fAh charge at %.2fV",
+                    self.battery.charge_state, self.battery.voltage
                 )
-            else:
-                print(f"Charger inactive, last update {self.last_time:%X}")
-            print(f"... Battery: {self.battery} at {self.battery.voltage:.2f}V")
-            msg = self.utils.pack_command(
-                elcon_broadcast_id, self.volts, self.output_amps, enable=True
+            # While charging, the output is held at the battery's voltage
+            # until it reaches the set voltage
+            volts = self.output_volts()
+            self.telemetry.append(
+                now, volts, self.output_amps, self.utils.status_flags
             )
-            if msg:  # voltage / current too low = None for msg
-                self.bus.send(msg)
-            await asyncio.sleep(self.status_interval)
+            if self.bridge is not None:
+                self.bridge.update(
+                    f"simulator/{self.utils.our_id:02x}",
+                    volts, self.output_amps, self.utils.status_flags
+                )
+            # Until it has been told a voltage, an idle charger has nothing
+            # to report, which is routine rather than worth a warning
+            if volts:
+                msg = self.utils.pack_command(
+                    elcon_broadcast_id, volts, self.output_amps, enable=True
+                )
+                if msg:  # voltage / current too low = None for msg
+                    self.transmit.send(msg)
+            await self.clock.sleep(self.status_interval)
 
-    async def check_timeout(self):
-        while True:
-            if datetime.now() - self.last_time > timedelta(seconds=self.update_timeout):
-                self.active = False
-                self.utils.timeout = True
-            await asyncio.sleep(self.status_interval)  # or update_timeout?
+    def output_volts(self) -> float:
+        """
+        The voltage the charger reports: the battery's voltage (at the
+        current it is taking) while it is active, or the set voltage
+        otherwise.
+        """
+        if self.active:
+            return self.battery.terminal_voltage(self.output_amps)
+        return self.volts
+
+    def reset_timeout(self):
+        """
+        Time out `update_timeout` seconds from now, unless this is called
+        again before then.
+        """
+        self.resume_timeout(self.update_timeout)
+
+    def resume_timeout(self, seconds):
+        """
+        Time out the given number of seconds from now, or not at all if
+        that is None, instead of when we were going to.
+        """
+        if self.timeout_handle is not None:
+            self.timeout_handle.cancel()
+            self.timeout_handle = self.timeout_at = None
+        if seconds is not None:
+            self.timeout_at = self.clock.now() + seconds
+            self.timeout_handle = self.clock.call_later(seconds, self.timed_out)
+
+    def timed_out(self):
+        self.timeout_handle = self.timeout_at = None
+        self.active = False
+        self.utils.timeout = True
 
     async def read_messages(self):
         async for msg in self.reader:
-            if self.utils.unpack_status(msg):
+            command = self.utils.decode_status(msg)
+            if command is not None:
+                self.commands.append(command)
                 charge_time = 0.0
-                now = datetime.now()
-                # Transfer data from utils message to voltage
-                self.volts = self.utils.voltage
-                self.amps = self.utils.current
+                now = self.clock.now()
                 if self.active:
-                    # Calculate time to charge battery from previous time
-                    charge_time = (now - self.last_time).seconds
-                    if self.battery.voltage > self.volts:
-                        self.output_amps = 0.0
-                    else:
-                        self.battery.charge(self.volts, self.amps, charge_time)
-                        self.output_amps = self.amps
+                    # Charge the battery from the previous time, at the
+                    # settings we were running at
+                    charge_time = now - self.last_time
+                    self.command_interval.record(charge_time)
+                    taken, seconds = self.battery.charge(
+                        self.volts, self.amps, charge_time
+                    )
+                    # Report the average current over the period, which tapers
+                    # off as the battery reaches the set voltage (a command
+                    # straight after another leaves it as it was)
+                    if charge_time > 0:
+                        self.output_amps = taken * 3600 / charge_time
                 else:
                     self.active = True
                     self.utils.timeout = False
+                # Transfer data from the command to our settings
+                self.volts = command.voltage
+                self.amps = command.current
                 self.last_time = now
+                self.reset_timeout()
                 # if self.verbose:
                 #     print(
                 #         f"... set to {self.volts:.2f}V {self.amps:.2f}A, "
                 #         f"output {self.output_amps:.2f}A"
                 #     )
-            else:
-                if self.verbose:
-                    print(f"Ignoring {msg}")
 
     async def main(self):
-        loop = asyncio.get_event_loop()
-        self.reader = can.AsyncBufferedReader()
-        notifier = can.Notifier(self.bus, [self.reader], loop=loop)
-        await asyncio.gather(
+        # Only wake up for commands from the manager
+        self.bus.set_filters(self.utils.can_filters(sources=(elcon_manager_id,)))
+        self.reader, notifier = open_reader(self.bus)
+        snapshotter = self.snapshotter
+        own_snapshotter = None
+        if snapshotter is None and self.snapshot_path is not None:
+            snapshotter = own_snapshotter = Snapshotter(
+                [self], self.snapshot_path, clock=self.clock
+            )
+            snapshotter.interval = self.snapshot_interval
+            snapshotter.restore()
+        # Time out if we don't hear from the driver at all, unless we're
+        # carrying on from a snapshot
+        if snapshotter is None or not snapshotter.restored:
+            self.reset_timeout()
+        coroutines = [
             self.emit_status(),
-            self.check_timeout(),
             self.read_messages(),
-        )
-        notifier.stop()
+            self.transmit.run(),
+        ]
+        server = None
+        if self.metrics_port is not None:
+            server = await self.metrics.serve(self.metrics_port)
+            coroutines.append(self.metrics.watch_loop())
+        if self.bridge is not None:
+            coroutines.append(self.bridge.run())
+        if own_snapshotter is not None:
+            coroutines.append(own_snapshotter.run())
+        try:
+            await asyncio.gather(*coroutines)
+        finally:
+            if notifier is not None:
+                notifier.stop()
+            if own_snapshotter is not None:
+                own_snapshotter.close()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
 
     def __repr__(self):
         if not self.active:
@@ -0,0 +1,212 @@
+# snapshot - save and restore the state of simulated chargers and batteries.
+# Licensed under the GPL V3
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import os
+from struct import Struct
+
+import numpy as np
+
+from clock import RealClock
+
+log = logging.getLogger(__name__)
+
+# Every snapshot file starts with this and the time the snapshot was
+# taken, followed by a fixed-width record for each charger.
+snapshot_magic = b'ELCONSNP'
+_header_struct = Struct('<d')
+# Times are kept relative to when the snapshot was taken: how long since
+# the charger's last command, and how long until it times out (NaN if it
+# isn't waiting to).
+snapshot_dtype = np.dtype([
+    ('address', 'u1'),
+    ('capacity', '<f8'), ('cells', '<u2'), ('charge_state', '<f8'),
+    ('minimum_voltage', '<f8'), ('maximum_voltage', '<f8'), ('resistance', '<f8'),
+    ('active', '?'), ('timeout', '?'),
+    ('volts', '<f8'), ('amps', '<f8'), ('output_amps', '<f8'),
+    ('since_command', '<f8'), ('timeout_in', '<f8'),
+])
+
+
+def take(chargers, now: float, records: np.ndarray = None) -> np.ndarray:
+    """
+    Record the state of the given `simulator.ElconCharger`s, and of their
+    batteries, as an array of `snapshot_dtype`, one row per charger.  The
+    `records` array is filled in if it is given and the right size.
+    """
+    if records is None or len(records) != len(chargers):
+        records = np.zeros(len(chargers), dtype=snapshot_dtype)
+    records[:] = [
+        (
+            charger.utils.our_id,
+            charger.battery.capacity, charger.battery.cells,
+            charger.battery.charge_state, charger.battery.minimum_voltage,
+            charger.battery.maximum_voltage, charger.battery.resistance,
+            charger.active, charger.utils.timeout,
+            charger.volts, charger.amps, charger.output_amps,
+            now - charger.last_time,
+            math.nan if charger.timeout_at is None else charger.timeout_at - now,
+        )
+        for charger in chargers
+    ]
+    return records
+
+
+def restore(chargers, records: np.ndarray, now: float):
+    """
+    Put the given chargers, and their batteries, back in the state
+    recorded, as though no time had passed since the snapshot.  A charger
+    that was waiting to time out does so as long after `now` as it had
+    left to wait then, so this must be called in the event loop.
+
+    The records are matched to the chargers in order, and must have been
+    taken from chargers at the same addresses.
+    """
+    if len(records) != len(chargers):
+        raise ValueError(
+            f"Snapshot of {len(records)} chargers can't restore {len(chargers)}"
+        )
+    for charger, record in zip(chargers, records.tolist()):
+        (
+            address, capacity, cells, charge_state, minimum_voltage,
+            maximum_voltage, resistance, active, timeout, volts, amps,
+            output_amps, since_command, timeout_in
+        ) = record
+        if address != charger.utils.our_id:
+            raise ValueError(
+                f"Snapshot of charger {address:#04x} can't restore "
+                f"charger {charger.utils.our_id:#04x}"
+            )
+        battery = charger.battery
+        battery.capacity = capacity
+        battery.cells = cells
+        battery.minimum_voltage = minimum_voltage
+        battery.maximum_voltage = maximum_voltage
+        battery.resistance = resistance
+        battery.charge_state = charge_state
+        charger.active = active
+        charger.utils.timeout = timeout
+        charger.volts = volts
+        charger.amps = amps
+        charger.output_amps = output_amps
+        charger.last_time = now - since_command
+        charger.resume_timeout(None if math.isnan(timeout_in) else timeout_in)
+
+
+def save(path: str, records: np.ndarray, taken_at: float):
+    """
+    Write the records to a snapshot file.  The file is written alongside
+    and then moved into place, so a crash part way through leaves the
+    previous snapshot intact.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(snapshot_magic)
+        f.write(_header_struct.pack(taken_at))
+        f.write(np.ascontiguousarray(records, dtype=snapshot_dtype).tobytes())
+    os.replace(temporary, path)
+
+
+def load(path: str):
+    """
+    Read a snapshot file, returning its records and the time it was taken.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    start = len(snapshot_magic) + _header_struct.size
+    if data[:len(snapshot_magic)] != snapshot_magic:
+        raise ValueError(f"{path} is not an Elcon snapshot file")
+    (taken_at,) = _header_struct.unpack_from(data, len(snapshot_magic))
+    records = np.frombuffer(data, dtype=snapshot_dtype, offset=start)
+    return records, taken_at
+
+
+class Snapshotter(object):
+    """
+    Save the state of some simulated chargers to the snapshot file at
+    `path` every `interval` seconds, and restore it from there.
+
+    Taking a snapshot only copies each charger's state into an array; the
+    file is written by a thread of our own, one snapshot after another, so
+    neither the simulation nor the interval is held up by the disk.  Time
+    is kept by the given `clock`, which is the real time by default.
+
+    One snapshotter serves any number of chargers, all in the one file:
+    whoever makes it restores the chargers with `restore` before they
+    start, runs `run` alongside them, and calls `close` when they stop,
+    which saves them once more and stops the thread.
+    """
+    interval: float = 60.0
+
+    def __init__(self, chargers, path: str, clock=None):
+        self.chargers = list(chargers)
+        self.path = path
+        self.clock = clock if clock is not None else RealClock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot')
+        self.saved = 0
+        self.restored = False
+        self.closed = False
+
+    def _written(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            log.error(
+                "Failed to save a snapshot to %s", self.path,
+                exc_info=future.exception()
+            )
+        else:
+            self.saved += 1
+
+    def save(self):
+        """
+        Take a snapshot, and start writing it to the file.  Returns a
+        future that is done when it has been written.
+        """
+        now = self.clock.now()
+        records = take(self.chargers, now)
+        future = asyncio.get_running_loop().run_in_executor(
+            self.writer, save, self.path, records, self.clock.wall_time(now)
+        )
+        future.add_done_callback(self._written)
+        return future
+
+    def restore(self) -> bool:
+        """
+        Restore the chargers from the file, if there is one.  Returns
+        whether there was.
+        """
+        if not os.path.exists(self.path):
+            return False
+        records, taken_at = load(self.path)
+        restore(self.chargers, records, self.clock.now())
+        self.restored = True
+        log.info(
+            "Restored %d chargers from the snapshot taken at %.0f",
+            len(records), taken_at
+        )
+        return True
+
+    def close(self):
+        """
+        Wait for any snapshot being written, then save the chargers as they
+        are now, so nothing since the last interval is lost, and stop the
+        writer thread.  Does nothing if already closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.shutdown(wait=True)
+        now = self.clock.now()
+        save(self.path, take(self.chargers, now), self.clock.wall_time(now))
+        self.saved += 1
+
+    async def run(self):
+        due = self.clock.now()
+        while True:
+            due += self.interval
+            await self.clock.sleep(due - self.clock.now())
+            self.save()
@@ -0,0 +1,230 @@
+# sweep - simulate many charge sessions at once, to size chargers for packs.
+# Licensed under the GPL V3
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import math
+import multiprocessing
+import os
+
+import numpy as np
+
+from battery import Battery
+from charging import CCCVProfile
+from clock import VirtualClock
+from driver import ChargerDriver
+from logs import RateLimitFilter
+from loopback import LoopbackBus
+from simulator import ElconCharger
+
+log = logging.getLogger(__name__)
+
+# One charge session to simulate
+case_dtype = np.dtype([
+    ('capacity', '<f8'), ('cells', '<u2'), ('resistance', '<f8'),
+    ('max_watts', '<f8'), ('efficiency_pct', '<f8'),
+    ('volts', '<f8'), ('amps', '<f8'), ('termination_amps', '<f8'),
+])
+# What came of it: the time the charge finished (NaN if it didn't in
+# time), the energy and peak power the charger delivered, how often the
+# charger timed out, and the battery's charge at the end
+result_dtype = np.dtype(case_dtype.descr + [
+    ('time_to_full', '<f8'), ('energy_wh', '<f8'), ('peak_watts', '<f8'),
+    ('timeouts', '<u4'), ('charge', '<f8'),
+])
+
+# Unless given, the charge finishes when the current falls to this much of
+# the set current
+termination_fraction = 0.1
+# The longest session to simulate, in (simulated) seconds
+max_seconds = 12 * 3600
+
+
+def grid(**values) -> np.ndarray:
+    """
+    Every combination of the values given for the fields of `case_dtype`,
+    as an array of cases.  Each field may be given a single value or a
+    sequence of them; `resistance`, `max_watts` and `efficiency_pct` default
+    to those of `Battery` and `ChargerDriver`, and `termination_amps` to
+    `termination_fraction` of `amps`.
+    """
+    values.setdefault('resistance', Battery.resistance)
+    values.setdefault('max_watts', ChargerDriver.max_watts)
+    values.setdefault('efficiency_pct', ChargerDriver.efficiency_pct)
+    unknown = set(values) - set(case_dtype.names)
+    if unknown:
+        raise ValueError(f"Unknown fields {sorted(unknown)} for a charge session")
+    names = [name for name in case_dtype.names if name in values]
+    columns = [np.atleast_1d(values[name]) for name in names]
+    cases = np.zeros(math.prod(len(column) for column in columns), dtype=case_dtype)
+    for index, combination in enumerate(itertools.product(*columns)):
+        for name, value in zip(names, combination):
+            cases[index][name] = value
+    if 'termination_amps' not in values:
+        cases['termination_amps'] = cases['amps'] * termination_fraction
+    return cases
+
+
+async def _session(case, max_seconds: float):
+    clock = VirtualClock()
+    bus = LoopbackBus()
+    battery = Battery(capacity=float(case['capacity']), cells=int(case['cells']))
+    battery.resistance = float(case['resistance'])
+    driver = ChargerDriver(bus.end(), clock=clock)
+    driver.verbose = False
+    driver.volts = float(case['volts'])
+    driver.amps = float(case['amps'])
+    driver.max_watts = float(case['max_watts'])
+    driver.efficiency_pct = float(case['efficiency_pct'])
+    driver.profile = CCCVProfile(
+        driver.volts, driver.amps, float(case['termination_amps'])
+    )
+    charger = ElconCharger(bus.end(), battery, clock=clock)
+    charger.verbose = False
+    driver.start()
+    tasks = [
+        asyncio.create_task(driver.main()),
+        asyncio.create_task(charger.main()),
+    ]
+    time_to_full = math.nan
+    energy = peak = 0.0
+    timeouts = 0
+    timed_out = False
+    charge = battery.charge_state
+    # Look at the charger as often as it reports its status
+    while clock.now() < max_seconds:
+        await clock.run(until=clock.now() + charger.status_interval)
+        volts = charger.output_volts()
+        energy += (battery.charge_state - charge) * volts
+        charge = battery.charge_state
+        if charger.active:
+            peak = max(peak, volts * charger.output_amps)
+        if charger.utils.timeout and not timed_out:
+            timeouts += 1
+        timed_out = charger.utils.timeout
+        if not driver.running:
+            time_to_full = clock.now()
+            break
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return (time_to_full, energy, peak, timeouts, battery.charge_state)
+
+
+def run_session(case, max_seconds: float = max_seconds) -> np.ndarray:
+    """
+    Simulate one charge session, on its own bus and virtual clock, with the
+    driver following a CC/CV profile until it finishes or `max_seconds`
+    pass.  Returns the result as a one-element array of `result_dtype`.
+    """
+    result = np.zeros(1, dtype=result_dtype)
+    for name in case_dtype.names:
+        result[name] = case[name]
+    outcome = asyncio.run(_session(case, max_seconds))
+    for name, value in zip(result_dtype.names[len(case_dtype.names):], outcome):
+        result[name] = value
+    return result
+
+
+def _run_chunk(cases: np.ndarray, max_seconds: float) -> np.ndarray:
+    return np.concatenate([run_session(case, max_seconds) for case in cases])
+
+
+class _Relay(logging.Handler):
+    """
+    Hand the records logged in the workers on to the logger of the same
+    name here, to go wherever this process's logging goes.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)
+
+
+def _worker_logging(records):
+    # Each worker's logging goes back to us through the queue, rate-limited
+    # so the same warning from thousands of sessions doesn't drown the rest
+    handler = QueueHandler(records)
+    handler.addFilter(RateLimitFilter())
+    logging.getLogger().handlers[:] = [handler]
+
+
+def _log_progress(done: int, total: int):
+    log.info("%d of %d sessions simulated", done, total)
+
+
+def run_sweep(
+    cases: np.ndarray, path: str = None, workers: int = None,
+    chunks_per_worker: int = 4, max_seconds: float = max_seconds,
+    progress=_log_progress
+) -> np.ndarray:
+    """
+    Simulate each of the `cases` (from `grid`, say) in a pool of `workers`
+    processes (by default, one per CPU), and return their results as an
+    array of `result_dtype`, in the same order.
+
+    The cases are split into `chunks_per_worker` chunks for each worker,
+    so that each process only sends back a few arrays while still sharing
+    the work out evenly.  After each chunk, `progress` is called with the
+    number of sessions done and the total.  If a `path` is given, the
+    results are saved there a column to an array, to load with
+    `load_results`.  What the workers log is logged here, by the loggers
+    of the same names.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = [
+        chunk for chunk in
+        np.array_split(cases, max(1, min(len(cases), workers * chunks_per_worker)))
+        if len(chunk)
+    ]
+    results = [None] * len(chunks)
+    done = 0
+    records = multiprocessing.Queue()
+    listener = QueueListener(records, _Relay())
+    listener.start()
+    pool = ProcessPoolExecutor(
+        max_workers=workers, initializer=_worker_logging, initargs=(records,)
+    )
+    try:
+        futures = {
+            pool.submit(_run_chunk, chunk, max_seconds): index
+            for index, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            done += len(chunks[index])
+            if progress is not None:
+                progress(done, len(cases))
+    finally:
+        pool.shutdown()
+        listener.stop()
+    results = (
+        np.concatenate(results) if results else np.zeros(0, dtype=result_dtype)
+    )
+    if path is not None:
+        save_results(path, results)
+    return results
+
+
+def save_results(path: str, results: np.ndarray):
+    """
+    Save sweep results with each field as its own array, so one column can
+    be read without the rest.
+    """
+    np.savez(path, **{name: results[name] for name in result_dtype.names})
+
+
+def load_results(path: str) -> np.ndarray:
+    """
+    Load the results saved by `save_results` back into an array of
+    `result_dtype`.
+    """
+    with np.load(path) as columns:
+        results = np.zeros(len(columns[result_dtype.names[0]]), dtype=result_dtype)
+        for name in result_dtype.names:
+            results[name] = columns[name]
+    return results
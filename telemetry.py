@@ -0,0 +1,173 @@
+# telemetry - keep a bounded history of charger statuses for analysis.
+# Licensed under the GPL V3
+
+import os
+
+import numpy as np
+
+# One sample in a `Telemetry` history, and one bucket of a downsampled
+# history as returned by `Telemetry.downsample`.
+telemetry_dtype = np.dtype([
+    ('timestamp', '<f8'), ('voltage', '<f8'), ('current', '<f8'), ('flags', 'u1'),
+])
+summary_dtype = np.dtype([
+    ('timestamp', '<f8'), ('count', '<u4'),
+    ('voltage_min', '<f8'), ('voltage_mean', '<f8'), ('voltage_max', '<f8'),
+    ('current_min', '<f8'), ('current_mean', '<f8'), ('current_max', '<f8'),
+    ('flags', 'u1'),
+])
+
+# History files start with the number of samples ever appended
+_count_dtype = np.dtype('<u8')
+
+
+class Telemetry(object):
+    """
+    A fixed-capacity ring buffer of charger status samples.
+
+    The samples are held in one preallocated structured array of
+    `telemetry_dtype`, so appending a sample allocates nothing and the
+    memory used never grows: once `capacity` samples are held, each new
+    one overwrites the oldest.  Samples must be appended in time order.
+
+    If a `path` is given, the buffer is a memory-mapped file instead, so
+    the history is kept on disk (and in the page cache) rather than in
+    the process's memory, and survives a restart: opening an existing
+    file of the same capacity carries on where it left off.
+    """
+
+    def __init__(self, capacity: int = 3600, path: str = None):
+        self.capacity = capacity
+        self.path = path
+        if path is None:
+            self._count = np.zeros(1, dtype=_count_dtype)
+            self.samples = np.zeros(capacity, dtype=telemetry_dtype)
+        else:
+            self._open(path)
+        # Views of each field, to write samples into without making rows
+        self._fields = tuple(self.samples[name] for name in telemetry_dtype.names)
+
+    def _open(self, path: str):
+        capacity = self.capacity
+        size = _count_dtype.itemsize + capacity * telemetry_dtype.itemsize
+        mode = 'r+'
+        if not os.path.exists(path):
+            mode = 'w+'
+        elif os.path.getsize(path) != size:
+            raise ValueError(
+                f"{path} doesn't hold a history of {capacity} samples"
+            )
+        self._count = np.memmap(path, dtype=_count_dtype, mode=mode, shape=(1,))
+        self.samples = np.memmap(
+            path, dtype=telemetry_dtype, mode='r+', shape=(capacity,),
+            offset=_count_dtype.itemsize
+        )
+
+    @property
+    def count(self) -> int:
+        """
+        The number of samples ever appended, including those overwritten.
+        """
+        return int(self._count[0])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp: float, voltage: float, current: float, flags: int):
+        """
+        Add a sample, overwriting the oldest if the buffer is full.
+        """
+        count = int(self._count[0])
+        row = count % self.capacity
+        timestamps, voltages, currents, flag_bytes = self._fields
+        timestamps[row] = timestamp
+        voltages[row] = voltage
+        currents[row] = current
+        flag_bytes[row] = flags
+        self._count[0] = count + 1
+
+    def append_status(self, timestamp: float, status):
+        """
+        Add a `utils.ChargerStatus` as a sample at the given time.
+        """
+        self.append(timestamp, status.voltage, status.current, status.flags)
+
+    def flush(self):
+        """
+        Write a memory-mapped history out to its file.
+        """
+        if self.path is not None:
+            self._count.flush()
+            self.samples.flush()
+
+    def _segments(self):
+        # The held samples in time order, as one or two views
+        count = self.count
+        if count <= self.capacity:
+            return (self.samples[:count],)
+        split = count % self.capacity
+        return (self.samples[split:], self.samples[:split])
+
+    def history(self) -> np.ndarray:
+        """
+        Return a copy of all the held samples, oldest first.
+        """
+        return np.concatenate(self._segments())
+
+    def window(self, seconds: float, now: float = None) -> np.ndarray:
+        """
+        Return a copy of the samples from the last `seconds` before `now`
+        (by default, the time of the newest sample), oldest first.
+        """
+        segments = self._segments()
+        if now is None:
+            if not len(self):
+                return np.zeros(0, dtype=telemetry_dtype)
+            now = float(segments[-1]['timestamp'][-1])
+        since = now - seconds
+        return np.concatenate([
+            segment[
+                np.searchsorted(segment['timestamp'], since, side='left'):
+                np.searchsorted(segment['timestamp'], now, side='right')
+            ]
+            for segment in segments
+        ])
+
+    def downsample(
+        self, seconds: float, bucket: float, now: float = None
+    ) -> np.ndarray:
+        """
+        Summarise the samples from the last `seconds` before `now` in
+        buckets of `bucket` seconds, as an array of `summary_dtype`: the
+        start of each bucket, the number of samples in it, the minimum,
+        mean and maximum voltage and current, and all the flags seen.
+        Buckets without samples are left out.
+
+        With a `bucket` as long as `seconds`, this summarises the whole
+        window in one row.
+        """
+        samples = self.window(seconds, now)
+        if not len(samples):
+            return np.zeros(0, dtype=summary_dtype)
+        if now is None:
+            now = float(samples['timestamp'][-1])
+        start = now - seconds
+        index = np.floor((samples['timestamp'] - start) / bucket).astype(np.int64)
+        # A sample right at the end of the window goes in the last bucket
+        index = np.minimum(index, max(int(np.ceil(seconds / bucket)) - 1, 0))
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        counts = np.diff(np.r_[starts, len(samples)])
+
+        summary = np.empty(len(starts), dtype=summary_dtype)
+        summary['timestamp'] = start + index[starts] * bucket
+        summary['count'] = counts
+        for field in ('voltage', 'current'):
+            values = samples[field]
+            summary[field + '_min'] = np.minimum.reduceat(values, starts)
+            summary[field + '_mean'] = np.add.reduceat(values, starts) / counts
+            summary[field + '_max'] = np.maximum.reduceat(values, starts)
+        summary['flags'] = np.bitwise_or.reduceat(samples['flags'], starts)
+        return summary
+
+    def __repr__(self):
+        return f"Telemetry: {len(self)} of {self.capacity} samples"
@@ -1,6 +1,9 @@
 import unittest
 
-from battery import Battery
+import numpy as np
+
+from battery import Battery, BatteryBank
+from chemistry import OCVCurve
 
 
 class BatteryTestCase(unittest.TestCase):
@@ -43,15 +46,114 @@ class BatteryTestCase(unittest.TestCase):
         # Voltage has risen slightly
         self.assertGreater(bat.voltage, 14.4)
 
-        # At this stage we can push a battery beyond the charge voltage if we
-        # give a long enough duration, but we can't go over the battery's
-        # capacity.
-        bat.charge(volts=16.6, amps=3, seconds=3600)  # Should be well over
-        # But capacity is limited to
+        # A long enough duration charges the battery up to the charge
+        # voltage, and stops there.
+        taken, seconds = bat.charge(volts=16.6, amps=3, seconds=3600)
+        self.assertAlmostEqual(bat.voltage, 16.6)
+        self.assertLess(bat.charge_state, bat.capacity)
+        self.assertAlmostEqual(taken, bat.charge_state - 1.55)
+        self.assertAlmostEqual(seconds, taken * 3600 / 3)
+        self.assertLess(seconds, 3600)
+        # It won't charge any further at that voltage
+        self.assertEqual(bat.charge(volts=16.6, amps=3, seconds=60), (0, 0))
+        self.assertAlmostEqual(bat.voltage, 16.6)
+
+        # But we can't go over the battery's capacity
+        bat.charge(volts=20, amps=3, seconds=3600)
         self.assertEqual(bat.charge_state, bat.capacity)
         # And voltage is maxed out
         self.assertEqual(bat.voltage, 16.8)
 
+    def test_large_steps(self):
+        # Big steps reach the same end state as small ones, in fewer calls
+        small = Battery(10.0, cells=4)
+        large = Battery(10.0, cells=4)
+        small_steps = 0
+        while small.charge(volts=16.5, amps=2, seconds=1)[1] == 1:
+            small_steps += 1
+        large_steps = 0
+        while large.charge(volts=16.5, amps=2, seconds=600)[1] == 600:
+            large_steps += 1
+        self.assertAlmostEqual(small.charge_state, large.charge_state, places=9)
+        self.assertAlmostEqual(large.voltage, 16.5, places=9)
+        self.assertGreater(small_steps, 500 * large_steps)
+
+    def test_resistance(self):
+        bat = Battery(10.0, cells=4)
+        bat.resistance = 0.05
+        # Well below the charging voltage, the full current flows
+        taken, seconds = bat.charge(volts=16.4, amps=5, seconds=60)
+        self.assertAlmostEqual(taken, 5 * 60 / 3600)
+        self.assertEqual(seconds, 60)
+        self.assertAlmostEqual(bat.terminal_voltage(5), bat.voltage + 0.25)
+        # Near it, the current tapers off
+        bat.charge_state = bat.charge_at_voltage(16.3)
+        taken, seconds = bat.charge(volts=16.4, amps=5, seconds=60)
+        self.assertEqual(seconds, 60)
+        self.assertLess(taken * 3600 / 60, 2)
+        currents = []
+        for minute in range(60):
+            taken, seconds = bat.charge(volts=16.4, amps=5, seconds=60)
+            currents.append(taken * 60)
+        self.assertEqual(currents, sorted(currents, reverse=True))
+        self.assertLess(currents[-1], currents[0] / 2)
+        self.assertLess(bat.voltage, 16.4)
+
+    def test_resistance_large_steps(self):
+        # However long the period, the taper is followed exactly: one call
+        # for two hours ends where many short ones, or a fine integration
+        # of the current, do
+        def battery():
+            bat = Battery(10.0, cells=4)
+            bat.resistance = 0.05
+            bat.charge_state = 2.0
+            return bat
+        large = battery()
+        taken, seconds = large.charge(volts=16.4, amps=5, seconds=7200)
+        self.assertEqual(seconds, 7200)
+        self.assertAlmostEqual(taken, large.charge_state - 2.0)
+        self.assertLess(large.voltage, 16.4)
+        small = battery()
+        for minute in range(120):
+            small.charge(volts=16.4, amps=5, seconds=60)
+        self.assertAlmostEqual(small.charge_state, large.charge_state, places=9)
+        fine = battery()
+        for step in range(7200 * 10):
+            current = min(5, (16.4 - fine.voltage) / fine.resistance)
+            fine.charge_state += current * 0.1 / 3600
+        self.assertAlmostEqual(fine.charge_state, large.charge_state, places=6)
+        # Past the battery's maximum voltage, it stops when it's full
+        full = battery()
+        taken, seconds = full.charge(volts=20, amps=5, seconds=7200)
+        self.assertEqual(full.charge_state, full.capacity)
+        self.assertAlmostEqual(seconds, 8 * 3600 / 5)
+
+    def test_voltage_inverse(self):
+        bat = Battery(3.0, cells=4)
+        for charge in (0.01, 0.5, 1.5, 2.0, 2.99):
+            bat.charge_state = charge
+            self.assertAlmostEqual(bat.charge_at_voltage(bat.voltage), charge)
+        # Clamped to the battery's range
+        self.assertEqual(bat.charge_at_voltage(10), 0)
+        self.assertEqual(bat.charge_at_voltage(20), 3.0)
+
+    def test_voltage_cache(self):
+        bat = Battery(3.0, cells=4)
+        bat.charge_state = 1.5
+        # Anything the voltage depends on gives a fresh one
+        for name, value in (
+            ('cells', 8), ('capacity', 6.0), ('minimum_voltage', 2.5),
+            ('maximum_voltage', 4.0), ('curve', OCVCurve([0, 1], [0, 1])),
+        ):
+            before = bat.voltage
+            setattr(bat, name, value)
+            fresh = Battery(bat.capacity, bat.cells, bat.curve)
+            fresh.minimum_voltage = bat.minimum_voltage
+            fresh.maximum_voltage = bat.maximum_voltage
+            fresh.charge_state = 1.5
+            self.assertNotEqual(bat.voltage, before, name)
+            self.assertEqual(bat.voltage, fresh.voltage, name)
+
     def test_discharge(self):
         bat = Battery(3.0, cells=4)
 
@@ -67,7 +169,66 @@ class BatteryTestCase(unittest.TestCase):
         # Voltage has lowered slightly
         self.assertLess(bat.voltage, 14.4)
 
+        # Can discharge down to a cut-off voltage
+        given, seconds = bat.discharge(amps=3, seconds=3600, volts=13.0)
+        self.assertAlmostEqual(bat.voltage, 13.0)
+        self.assertAlmostEqual(seconds, given * 3600 / 3)
+
         # Can discharge only down to zero capacity
         bat.discharge(amps=3, seconds=3600)
         self.assertEqual(bat.charge_state, 0)
         self.assertEqual(bat.voltage, 12.0)
+
+
+class BatteryBankTestCase(unittest.TestCase):
+    """
+    Test that a bank of batteries behaves like that many batteries.
+    """
+
+    def test_matches_batteries(self):
+        capacities = [3.0, 10.0, 40.0, 3.0]
+        cells = [4, 30, 12, 1]
+        bank = BatteryBank(capacities, cells)
+        bats = [Battery(cap, cells=n) for cap, n in zip(capacities, cells)]
+        self.assertEqual(len(bank), 4)
+
+        volts = np.array([16.6, 100.0, 50.0, 4.1])
+        for amps, seconds in ((3, 60), (10, 600), (5, 3600)):
+            taken, spent = bank.charge(volts, amps, seconds)
+            results = [bat.charge(v, amps, seconds) for bat, v in zip(bats, volts)]
+            np.testing.assert_allclose(taken, [r[0] for r in results])
+            np.testing.assert_allclose(spent, [r[1] for r in results])
+            np.testing.assert_allclose(bank.charge_state, [b.charge_state for b in bats])
+            np.testing.assert_allclose(bank.voltage, [b.voltage for b in bats])
+
+        cutoffs = [13.0, 0, 0, 3.5]
+        given, spent = bank.discharge([1, 2, 3, 4], 7200, volts=cutoffs)
+        results = [
+            bat.discharge(amps, 7200, volts=v)
+            for bat, amps, v in zip(bats, [1, 2, 3, 4], cutoffs)
+        ]
+        np.testing.assert_allclose(given, [r[0] for r in results])
+        np.testing.assert_allclose(spent, [r[1] for r in results])
+        np.testing.assert_allclose(bank.charge_state, [b.charge_state for b in bats])
+        bank.discharge([1, 2, 3, 4], 7200)
+        # Can't discharge below zero
+        self.assertEqual(bank.charge_state[3], 0)
+
+    def test_single_view(self):
+        bank = BatteryBank(3.0, cells=4, count=10)
+        bat = bank[2]
+        self.assertIsInstance(bat, Battery)
+        # Acts like a fresh battery
+        self.assertEqual(bat.capacity, 3.0)
+        self.assertEqual(bat.cells, 4)
+        self.assertEqual(bat.charge_state, 1.5)
+        self.assertEqual(bat.voltage, 14.4)
+        self.assertEqual(repr(bat), "3.0Ah 4S battery with 1.500Ah charge")
+        # Charging the view charges that battery in the bank, and no other
+        bat.charge(volts=16.6, amps=3, seconds=60)
+        self.assertEqual(bat.charge_state, 1.55)
+        self.assertEqual(bank.charge_state[2], 1.55)
+        self.assertEqual(bank.charge_state[1], 1.5)
+        self.assertEqual(bank[-8].charge_state, 1.55)
+        with self.assertRaises(IndexError):
+            bank[10]
@@ -0,0 +1,131 @@
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import can
+
+from capture import CaptureReader, CaptureWriter, capture_dtype
+from clock import VirtualClock
+from driver import ChargerDriver
+from loopback import LoopbackBus
+from utils import ElconUtils, elcon_broadcast_id, elcon_charger_id, elcon_manager_id
+
+
+def status(voltage, current, timestamp):
+    msg = ElconUtils(elcon_charger_id).pack_command(
+        elcon_broadcast_id, voltage, current, True
+    )
+    msg.timestamp = timestamp
+    return msg
+
+
+class CaptureTests(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'session.cap')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, msgs):
+        with CaptureWriter(self.path) as writer:
+            for msg in msgs:
+                writer(msg)
+        return writer
+
+    def test_round_trip(self):
+        msgs = [status(100 + i, i / 10, 1000 + i * 0.5) for i in range(10)]
+        writer = self.write(msgs + [can.Message(arbitration_id=1, data=b'\x00')])
+        self.assertEqual((writer.written, writer.skipped), (10, 1))
+        self.assertEqual(
+            os.path.getsize(self.path), 8 + 10 * capture_dtype.itemsize
+        )
+        reader = CaptureReader(self.path)
+        reader.chunk_frames = 3
+        self.assertEqual(len(reader), 10)
+        for msg, got in zip(msgs, reader.messages()):
+            self.assertEqual(got.timestamp, msg.timestamp)
+            self.assertEqual(got.arbitration_id, msg.arbitration_id)
+            self.assertEqual(got.data, msg.data)
+        decoded = list(reader.statuses(ElconUtils(elcon_manager_id)))
+        self.assertEqual([len(batch) for batch in decoded], [3, 3, 3, 1])
+        self.assertEqual(decoded[-1]['voltage'][0], 109)
+
+    def test_truncated(self):
+        msgs = [status(100 + i, i / 10, 1000 + i * 0.5) for i in range(4)]
+        writer = CaptureWriter(self.path)
+        for msg in msgs:
+            writer(msg)
+        writer.flush()
+        # Killed part way through writing the fourth record
+        os.truncate(self.path, 8 + 3 * capture_dtype.itemsize + 7)
+        reader = CaptureReader(self.path)
+        self.assertEqual(len(reader), 3)
+        self.assertEqual([msg.timestamp for msg in reader.messages()], [1000, 1000.5, 1001])
+        writer.close()
+        # Or before writing any
+        os.truncate(self.path, 8 + 5)
+        self.assertEqual(len(CaptureReader(self.path)), 0)
+        self.assertEqual(list(CaptureReader(self.path).messages()), [])
+
+    def test_not_a_capture(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'nonsense' * 4)
+        with self.assertRaises(ValueError):
+            CaptureReader(self.path)
+
+    async def test_notifier(self):
+        # Record from a bus, as a Notifier listener
+        bus = can.Bus('pyelcon-test-capture', interface='virtual')
+        sender = can.Bus('pyelcon-test-capture', interface='virtual')
+        writer = CaptureWriter(self.path)
+        notifier = can.Notifier(bus, [writer], loop=asyncio.get_running_loop())
+        for i in range(5):
+            sender.send(status(100, i, 0))
+        while writer.written < 5:
+            await asyncio.sleep(0.01)
+        notifier.stop()
+        writer.stop()
+        bus.shutdown()
+        sender.shutdown()
+        self.assertEqual(len(CaptureReader(self.path)), 5)
+
+    async def test_replay_speed(self):
+        self.write([status(100, i, 50 + i * 2) for i in range(5)])
+        reader = CaptureReader(self.path)
+        bus = LoopbackBus()
+        listener = bus.end()
+        clock = VirtualClock()
+        received = []
+
+        async def listen():
+            async for msg in listener:
+                received.append(clock.now())
+
+        task = asyncio.create_task(listen())
+        replay = asyncio.create_task(reader.replay(bus.end(), speed=4, clock=clock))
+        await clock.run(until=2)
+        self.assertEqual(await replay, 5)
+        task.cancel()
+        # Two seconds apart as captured, a half second apart at four times
+        self.assertEqual(received, [0, 0.5, 1, 1.5, 2])
+
+    async def test_replay_into_driver(self):
+        self.write([status(100 + i % 50, 5, i) for i in range(1000)])
+        bus = LoopbackBus()
+        driver = ChargerDriver(bus.end())
+        driver.reader = driver.bus
+        receiver = asyncio.create_task(driver.receive_status())
+        with contextlib.redirect_stdout(io.StringIO()):
+            sent = await CaptureReader(self.path).replay(bus.end(), speed=None)
+            await asyncio.sleep(0)
+        receiver.cancel()
+        self.assertEqual(sent, 1000)
+        self.assertEqual(len(driver.statuses), driver.status_history)
+        self.assertEqual(driver.statuses[-1].voltage, 100 + 999 % 50)
+        # And the driver has caught up with every frame
+        self.assertEqual(driver.bus.queue.qsize(), 0)
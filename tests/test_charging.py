@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+from battery import Battery
+from charging import CCCVProfile
+from clock import VirtualClock
+from driver import ChargerDriver
+from loopback import LoopbackBus
+from simulator import ElconCharger
+from utils import ChargerStatus, elcon_charger_id, elcon_manager_id
+
+
+def status(volts, amps, flags=0):
+    return ChargerStatus(elcon_charger_id, elcon_manager_id, volts, amps, flags)
+
+
+class CCCVProfileTests(unittest.TestCase):
+
+    def test_phases(self):
+        profile = CCCVProfile(16.4, 5, 0.5)
+        self.assertEqual(profile.next_setpoint(status(15.0, 5.0)), (16.4, 5))
+        self.assertEqual(profile.phase, 'cc')
+        # At the voltage, the current limit follows the current down
+        self.assertEqual(profile.next_setpoint(status(16.4, 5.0)), (16.4, 5))
+        self.assertEqual(profile.phase, 'cv')
+        self.assertAlmostEqual(profile.next_setpoint(status(16.4, 2.0))[1], 2.2)
+        self.assertEqual(profile.next_setpoint(status(16.4, 0.4)), None)
+        self.assertTrue(profile.finished)
+        self.assertEqual(profile.next_setpoint(status(16.4, 2.0)), None)
+        self.assertEqual(repr(profile), "CCCVProfile: 5.00A to 16.40V, until 0.50A, done")
+
+    def test_faults(self):
+        profile = CCCVProfile(16.4, 5, 0.5)
+        # A timed out charger reads as full and idle, but it isn't
+        self.assertEqual(profile.next_setpoint(status(16.4, 0.0, 0x10)), (16.4, 5))
+        self.assertEqual(profile.phase, 'cc')
+        self.assertAlmostEqual(profile.next_setpoint(status(16.4, 4.0))[1], 4.4)
+        self.assertEqual(profile.phase, 'cv')
+        self.assertAlmostEqual(profile.next_setpoint(status(16.4, 2.0))[1], 2.2)
+        # Nor does a fault end the charge; the setpoint is held
+        for flags in (0x01, 0x02, 0x04, 0x08, 0x10):
+            self.assertAlmostEqual(profile.next_setpoint(status(16.4, 0.0, flags))[1], 2.2)
+        self.assertEqual(profile.phase, 'cv')
+        self.assertEqual(profile.next_setpoint(status(16.4, 0.4)), None)
+
+
+class ProfileSessionTests(unittest.IsolatedAsyncioTestCase):
+
+    async def session(self, immediate):
+        asyncio.get_running_loop().set_debug(False)
+        clock = VirtualClock()
+        bus = LoopbackBus()
+        battery = Battery(capacity=2, cells=4)
+        battery.resistance = 0.05
+        battery.charge_state = battery.charge_at_voltage(16.0)
+        driver = ChargerDriver(bus.end(), clock=clock)
+        driver.verbose = False
+        driver.volts = 16.4
+        driver.amps = 5
+        # Only 60W, so the current is curbed to that power
+        driver.max_watts = 60
+        driver.profile = CCCVProfile(16.4, 5, 0.5)
+        driver.profile_immediate = immediate
+        driver.start()
+        charger = ElconCharger(bus.end(), battery, clock=clock)
+        charger.verbose = False
+        tasks = [
+            asyncio.create_task(driver.main()),
+            asyncio.create_task(charger.main()),
+        ]
+        await clock.run(until=1800)
+        for task in tasks:
+            task.cancel()
+        return driver, charger, battery
+
+    async def test_charge(self):
+        driver, charger, battery = await self.session(immediate=True)
+        # The charge finished, and the driver stopped
+        self.assertTrue(driver.profile.finished)
+        self.assertFalse(driver.running)
+        self.assertGreater(battery.voltage, 16.3)
+        self.assertLessEqual(battery.voltage, 16.4)
+        # Never more than the power allows
+        self.assertLessEqual(max(c.current for c in charger.commands), 60 / 16.4 + 0.1)
+        # The current limit followed the current down, each as the status
+        # arrived
+        self.assertLess(charger.commands[-1].current, 1)
+        self.assertGreater(driver.profile_reaction.count, 5)
+        self.assertEqual(driver.profile_reaction.percentile(100), 0)
+
+    async def test_on_tick(self):
+        driver, charger, battery = await self.session(immediate=False)
+        self.assertTrue(driver.profile.finished)
+        self.assertFalse(driver.running)
+        # Each new setpoint waited for the next keep-alive
+        self.assertGreater(driver.profile_reaction.percentile(50), 0.5)
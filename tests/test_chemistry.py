@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from battery import Battery
+from chemistry import OCVCurve, default_curve
+
+
+class OCVCurveTestCase(unittest.TestCase):
+    """
+    Test the voltage curves batteries use, both ways round.
+    """
+
+    def test_cubic(self):
+        # Points in the table are exact, points between are close
+        for soc in (0, 0.25, 0.5, 0.6543, 0.9, 1):
+            frac_charge = soc - 0.5
+            expected = frac_charge ** 3 * 3.6 + frac_charge * 0.1 + 0.5
+            self.assertAlmostEqual(default_curve.level_at(soc), expected, places=6)
+            self.assertAlmostEqual(default_curve.soc_at(expected), soc, places=5)
+        # Clamped at either end
+        self.assertEqual(default_curve.level_at(-1), 0)
+        self.assertEqual(default_curve.level_at(2), 1)
+        self.assertEqual(default_curve.soc_at(-1), 0)
+        self.assertEqual(default_curve.soc_at(2), 1)
+
+    def test_must_increase(self):
+        with self.assertRaises(ValueError):
+            OCVCurve([0, 0.5, 1], [0, 0.6, 0.5])
+        with self.assertRaises(ValueError):
+            OCVCurve([0], [0])
+
+    def test_from_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as fh:
+            fh.write("soc_pct,volts\n0,2.5\n100,3.65\n10,3.2\n50,3.3\n90,3.35\n")
+        try:
+            curve = OCVCurve.from_csv(fh.name)
+        finally:
+            os.unlink(fh.name)
+        self.assertEqual(curve.soc, [0, 0.1, 0.5, 0.9, 1.0])
+        self.assertEqual(curve.minimum_voltage, 2.5)
+        self.assertEqual(curve.maximum_voltage, 3.65)
+
+        # A LiFePO4 battery with this curve
+        bat = Battery(100, cells=4, curve=curve)
+        self.assertEqual(bat.minimum_voltage, 2.5)
+        self.assertAlmostEqual(bat.voltage, 13.2)
+        self.assertAlmostEqual(bat.charge_at_voltage(13.2), 50)
+        bat.charge_state = 70
+        self.assertAlmostEqual(bat.voltage, 13.3)
+        self.assertAlmostEqual(bat.charge_at_voltage(13.3), 70)
+
+    def test_voltage_cache(self):
+        bat = Battery(3.0, cells=4)
+        self.assertEqual(bat.voltage, 14.4)
+        self.assertIsNotNone(bat._voltage)
+        # Changing the charge state in any way invalidates the cache
+        bat.charge_state = 3.0
+        self.assertIsNone(bat._voltage)
+        self.assertEqual(bat.voltage, 16.8)
+        bat.discharge(amps=3, seconds=3600)
+        self.assertEqual(bat.voltage, 12.0)
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from clock import RealClock, VirtualClock
+
+
+class VirtualClockTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Test that the virtual clock wakes sleepers in order without waiting.
+    """
+
+    async def test_sleep_order(self):
+        clock = VirtualClock()
+        woken = []
+
+        async def sleeper(name, seconds):
+            await clock.sleep(seconds)
+            woken.append((name, clock.now()))
+
+        start = time.monotonic()
+        tasks = [
+            asyncio.create_task(sleeper('slow', 3600)),
+            asyncio.create_task(sleeper('fast', 0.25)),
+            asyncio.create_task(sleeper('never', 7200)),
+        ]
+        await clock.run(until=3600.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(woken, [('fast', 0.25), ('slow', 3600)])
+        self.assertEqual(clock.now(), 3600.5)
+        self.assertFalse(tasks[2].done())
+        tasks[2].cancel()
+
+    async def test_periodic(self):
+        clock = VirtualClock(start=100)
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(clock.now())
+                await clock.sleep(0.5)
+
+        task = asyncio.create_task(ticker())
+        await clock.run(until=102)
+        task.cancel()
+        self.assertEqual(ticks, [100, 100.5, 101, 101.5, 102])
+
+    async def test_settle(self):
+        # A message passed along a long chain of queues arrives before the
+        # clock moves on, however many hops it takes
+        clock = VirtualClock()
+        queues = [asyncio.Queue() for _ in range(50)]
+        arrived = []
+
+        async def relay(source, sink):
+            sink.put_nowait(await source.get())
+
+        async def sender():
+            await clock.sleep(1)
+            queues[0].put_nowait(clock.now())
+            arrived.append(await queues[-1].get())
+
+        tasks = [
+            asyncio.create_task(relay(source, sink))
+            for source, sink in zip(queues, queues[1:])
+        ]
+        tasks.append(asyncio.create_task(sender()))
+        waiting = asyncio.ensure_future(clock.sleep(2))
+        await clock.run(until=1.5)
+        self.assertEqual(arrived, [1])
+        waiting.cancel()
+        for task in tasks:
+            task.cancel()
+
+    async def test_call_later(self):
+        clock = VirtualClock()
+        called = []
+        clock.call_later(5, lambda: called.append(('five', clock.now())))
+        handle = clock.call_later(3, lambda: called.append(('three', clock.now())))
+        await clock.run(until=1)
+        handle.cancel()
+        await clock.run(until=5)
+        self.assertEqual(called, [('five', 5)])
+
+    async def test_real_clock(self):
+        clock = RealClock()
+        before = clock.now()
+        await clock.sleep(0.01)
+        self.assertGreaterEqual(clock.now() - before, 0.01)
+        called = asyncio.Event()
+        clock.call_later(0.01, called.set)
+        clock.call_later(0.001, lambda: None).cancel()
+        await asyncio.wait_for(called.wait(), 1)
+
+    def test_real_clock_set(self):
+        clock = RealClock()
+        before = clock.now()
+        self.assertAlmostEqual(clock.wall_time(before), time.time(), delta=0.1)
+        # The system clock being set back an hour doesn't take us with it
+        wall = time.time() - 3600
+        with mock.patch('time.time', return_value=wall):
+            self.assertGreaterEqual(clock.now(), before)
+            self.assertAlmostEqual(clock.wall_time(clock.now()), wall, delta=0.1)
+        # Virtual time is its own wall time
+        self.assertEqual(VirtualClock(start=1000).wall_time(1005), 1005)
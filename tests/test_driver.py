@@ -0,0 +1,275 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import can
+
+from driver import ChargerDriver
+from utils import ElconUtils, elcon_charger_id
+
+
+class Recorder(object):
+    """
+    Record the arrival times and data of the messages on a bus, in a thread
+    so the timing doesn't depend on the event loop.
+    """
+    def __init__(self, bus):
+        self.bus = bus
+        self.received = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            msg = self.bus.recv(timeout=0.05)
+            if msg is not None:
+                self.received.append((time.monotonic(), bytes(msg.data)))
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def max_gap(self):
+        times = [t for t, _ in self.received]
+        return max(b - a for a, b in zip(times, times[1:]))
+
+
+class ChargerDriverPeriodicTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Test that the keep-alive message keeps going out even when the event
+    loop is blocked.
+    """
+    channel = 'pyelcon-test-driver'
+    update_time = 0.05
+    blocked_time = 0.5
+
+    async def run_blocked(self, periodic):
+        driver_bus = can.Bus(self.channel, interface='virtual')
+        recorder = Recorder(can.Bus(self.channel, interface='virtual'))
+        driver = ChargerDriver(driver_bus)
+        driver.verbose = False
+        driver.periodic = periodic
+        driver.update_time = self.update_time
+        driver.volts = 120
+        driver.amps = 5
+        driver.start()
+        sender = asyncio.create_task(driver.send_message())
+        transmitter = asyncio.create_task(driver.transmit.run())
+        await asyncio.sleep(self.update_time * 4)
+        # Something hogs the event loop, as input() would
+        time.sleep(self.blocked_time)
+        await asyncio.sleep(self.update_time * 4)
+        driver.finish()
+        await sender
+        transmitter.cancel()
+        recorder.stop()
+        driver_bus.shutdown()
+        recorder.bus.shutdown()
+        return driver, recorder
+
+    async def test_sleep_loop_stalls(self):
+        _, recorder = await self.run_blocked(periodic=False)
+        self.assertGreaterEqual(recorder.max_gap(), self.blocked_time)
+
+    async def test_periodic_keeps_time(self):
+        driver, recorder = await self.run_blocked(periodic=True)
+        self.assertIsNone(driver.cyclic_task)
+        self.assertGreater(len(recorder.received), 10)
+        # No keep-alive was held up by the blocked loop
+        self.assertLess(recorder.max_gap(), self.update_time * 3)
+
+    async def test_periodic_update(self):
+        driver_bus = can.Bus(self.channel, interface='virtual')
+        recorder = Recorder(can.Bus(self.channel, interface='virtual'))
+        driver = ChargerDriver(driver_bus)
+        driver.verbose = False
+        driver.periodic = True
+        driver.update_time = self.update_time
+        driver.volts = 120
+        driver.amps = 5
+        driver.start()
+        task = driver.cyclic_task
+        await asyncio.sleep(self.update_time * 3)
+        # Power limits apply to the cyclic message too
+        driver.max_watts = 300
+        driver.update()
+        self.assertIs(driver.cyclic_task, task)
+        await asyncio.sleep(self.update_time * 3)
+        driver.stop()
+        self.assertIsNone(driver.cyclic_task)
+        recorder.stop()
+        driver_bus.shutdown()
+        recorder.bus.shutdown()
+
+        utils = ElconUtils(elcon_charger_id)
+        first = recorder.received[0][1]
+        last = recorder.received[-1][1]
+        self.assertEqual(first, bytes(utils.pack_command(elcon_charger_id, 120, 5, True).data))
+        self.assertEqual(last, bytes(utils.pack_command(elcon_charger_id, 120, 300 / 120 * 0.95, True).data))
+
+
+class ChargerDriverControlTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Test that commands from the command line and the control socket are
+    served without holding up the keep-alive.
+    """
+    channel = 'pyelcon-test-control'
+    update_time = 0.05
+
+    def make_driver(self):
+        driver = ChargerDriver(can.Bus(self.channel, interface='virtual'))
+        driver.verbose = False
+        driver.update_time = self.update_time
+        driver.volts = 120
+        driver.amps = 5
+        return driver
+
+    def test_run_command(self):
+        driver = self.make_driver()
+        self.assertEqual(driver.run_command('Volts 100')[0], True)
+        self.assertEqual(driver.volts, 100)
+        self.assertEqual(driver.run_command('amps lots'), (False, "Didn't understand 'amps lots' as a float setting"))
+        self.assertEqual(driver.run_command('help'), (True, driver.help_text))
+        self.assertFalse(driver.run_command('dance')[0])
+        reply = driver.run_json_command('{"command": "watts", "value": 500}')
+        self.assertTrue(reply['ok'])
+        self.assertEqual(reply['max_watts'], 500)
+        self.assertFalse(driver.run_json_command('[1, 2]')['ok'])
+        driver.run_command('quit')
+        self.assertTrue(driver.finished)
+        driver.bus.shutdown()
+
+    async def test_quit(self):
+        driver = self.make_driver()
+        driver.start()
+        main = asyncio.create_task(driver.main())
+        await asyncio.sleep(self.update_time * 2)
+        self.assertFalse(main.done())
+        driver.run_command('quit')
+        # Everything stops with the next keep-alive
+        await asyncio.wait_for(main, self.update_time * 4)
+        driver.bus.shutdown()
+
+    async def test_command_line_closed(self):
+        # As when standard input is a closed pipe, or /dev/null
+        read_fd, write_fd = os.pipe()
+        os.close(write_fd)
+        for stream in (open(read_fd, 'rb', buffering=0), open(os.devnull, 'rb')):
+            driver = self.make_driver()
+            driver.interactive = True
+            driver.start()
+            with stream:
+                read_command_line = driver.read_command_line
+                driver.read_command_line = lambda: read_command_line(stream)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main = asyncio.create_task(driver.main())
+                    await asyncio.sleep(self.update_time * 3)
+            # The keep-alive carries on without the command line
+            self.assertFalse(main.done())
+            driver.finish()
+            await asyncio.wait_for(main, self.update_time * 4)
+            driver.bus.shutdown()
+
+    async def test_command_file(self):
+        driver = self.make_driver()
+        with tempfile.TemporaryFile() as stream:
+            stream.write(b'volts 100\nstart\n')
+            stream.seek(0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.wait_for(driver.read_command_line(stream), 1)
+        self.assertEqual(driver.volts, 100)
+        self.assertTrue(driver.running)
+        driver.bus.shutdown()
+
+    async def test_metrics_server(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        # The server is closed when the driver finishes, so the port can be
+        # served again
+        for attempt in range(2):
+            driver = self.make_driver()
+            driver.metrics_port = port
+            main = asyncio.create_task(driver.main())
+            await asyncio.sleep(self.update_time * 2)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+            self.assertIn(b'pyelcon_loop_lag_seconds', await reader.read())
+            writer.close()
+            driver.finish()
+            await asyncio.wait_for(main, self.update_time * 4)
+            driver.bus.shutdown()
+
+    async def test_command_line(self):
+        driver = self.make_driver()
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, 'rb', buffering=0) as stream:
+            reader = asyncio.create_task(driver.read_command_line(stream))
+            with contextlib.redirect_stdout(io.StringIO()):
+                os.write(write_fd, b'volts 100\nstart\n')
+                await asyncio.sleep(0.05)
+                self.assertEqual(driver.volts, 100)
+                self.assertTrue(driver.running)
+                os.close(write_fd)
+                await asyncio.wait_for(reader, 1)
+        driver.bus.shutdown()
+
+    async def test_control_socket(self):
+        driver = self.make_driver()
+        recorder = Recorder(can.Bus(self.channel, interface='virtual'))
+        driver.start()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'control')
+            sender = asyncio.create_task(driver.send_message())
+            transmitter = asyncio.create_task(driver.transmit.run())
+            server = asyncio.create_task(driver.serve_control(path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+
+            async def operator(number, commands):
+                reader, writer = await asyncio.open_unix_connection(path)
+                for i in range(commands):
+                    if i % 2:
+                        line = f'{{"command": "amps", "value": {number}}}'
+                    else:
+                        line = f'volts {100 + number}'
+                    writer.write(line.encode() + b'\n')
+                replies = [await reader.readline() for _ in range(commands)]
+                writer.close()
+                await writer.wait_closed()
+                return replies
+
+            start = time.monotonic()
+            operators = 8
+            commands = 1000
+            results = await asyncio.gather(*(
+                operator(number, commands) for number in range(operators)
+            ))
+            elapsed = time.monotonic() - start
+            driver.finish()
+            await sender
+            await server
+            transmitter.cancel()
+            self.assertFalse(os.path.exists(path))
+        recorder.stop()
+        driver.bus.shutdown()
+        recorder.bus.shutdown()
+
+        for replies in results:
+            self.assertEqual(len(replies), commands)
+            for i, reply in enumerate(replies):
+                if i % 2:
+                    self.assertTrue(json.loads(reply)['ok'])
+                else:
+                    self.assertTrue(reply.startswith(b'OK '))
+        # Thousands of commands a second, and the keep-alive never stalled
+        self.assertGreater(operators * commands / elapsed, 1000)
+        self.assertLess(recorder.max_gap(), self.update_time * 3)
@@ -0,0 +1,160 @@
+import asyncio
+from collections import Counter
+import unittest
+
+from battery import Battery
+from clock import VirtualClock
+from fleet import FleetDriver
+from loopback import LoopbackBus
+from simulator import ElconCharger
+from utils import elcon_broadcast_id, elcon_manager_id
+
+
+# Every address a charger can have on a bus shared with the manager
+charger_addresses = [
+    address for address in range(256)
+    if address not in (elcon_manager_id, elcon_broadcast_id)
+]
+
+
+class FleetDriverTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Run the fleet driver against a bus full of simulated chargers on a
+    virtual clock.
+    """
+
+    async def asyncSetUp(self):
+        # Debug mode makes every trip through the event loop much slower
+        asyncio.get_running_loop().set_debug(False)
+        self.clock = VirtualClock()
+        self.bus = LoopbackBus()
+        self.fleet = FleetDriver(self.bus.end(), clock=self.clock)
+        self.fleet.verbose = False
+        self.chargers = {}
+        self.tasks = []
+        for address in charger_addresses:
+            self.fleet.add(address, volts=16.4, amps=5)
+            end = self.bus.end()
+            charger = ElconCharger(
+                end, Battery(capacity=10, cells=4), clock=self.clock,
+                address=address
+            )
+            charger.verbose = False
+            charger.reader = end
+            end.set_filters(charger.utils.can_filters(sources=(elcon_manager_id,)))
+            charger.reset_timeout()
+            self.chargers[address] = charger
+            self.tasks += [
+                asyncio.create_task(charger.emit_status()),
+                asyncio.create_task(charger.read_messages()),
+                asyncio.create_task(charger.transmit.run()),
+            ]
+        self.fleet.reader = self.fleet.bus
+        self.fleet.update_filters()
+        # Note when every frame goes past
+        self.sent = []
+        self.tasks += [
+            asyncio.create_task(self.listen(self.bus.end())),
+            asyncio.create_task(self.fleet.send_messages()),
+            asyncio.create_task(self.fleet.receive_status()),
+            asyncio.create_task(self.fleet.transmit.run()),
+        ]
+
+    async def listen(self, end):
+        async for msg in end:
+            self.sent.append((self.clock.now(), msg.arbitration_id))
+
+    def tearDown(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def test_fleet(self):
+        self.assertEqual(len(self.fleet), len(charger_addresses))
+        self.fleet.start()
+        await self.clock.run(until=10)
+        # Every charger is charging, and we've heard from all of them
+        for address, charger in self.chargers.items():
+            self.assertTrue(charger.active)
+            self.assertEqual(charger.volts, 16.4)
+            self.assertEqual(charger.amps, 5)
+            status = self.fleet[address].status
+            self.assertEqual(status.source, address)
+            self.assertEqual(status.current, 5)
+        self.assertEqual(self.fleet.unknown, 0)
+
+    async def test_staggered(self):
+        self.fleet.start()
+        await self.clock.run(until=10)
+        # The commands are spread evenly over each second
+        bursts = Counter(
+            when for when, arbitration_id in self.sent
+            if (arbitration_id & 0xFF) == self.fleet.utils.our_id
+        )
+        per_tick = -(-len(charger_addresses) // self.fleet.slots)
+        self.assertLessEqual(max(bursts.values()), per_tick)
+        # And each charger is sent one every second
+        times = {}
+        for when, arbitration_id in self.sent:
+            if (arbitration_id & 0xFF) == self.fleet.utils.our_id:
+                times.setdefault((arbitration_id >> 8) & 0xFF, []).append(when)
+        self.assertEqual(set(times), set(charger_addresses))
+        for sent in times.values():
+            self.assertGreaterEqual(len(sent), 9)
+            self.assertEqual({b - a for a, b in zip(sent, sent[1:])}, {1})
+
+    async def test_stop_one(self):
+        self.fleet.start()
+        await self.clock.run(until=5)
+        self.fleet.stop(charger_addresses[0])
+        await self.clock.run(until=10)
+        self.assertFalse(self.chargers[charger_addresses[0]].active)
+        self.assertTrue(self.chargers[charger_addresses[1]].active)
+
+    async def test_power_caps(self):
+        first, second = charger_addresses[:2]
+        # One charger curbed on its own, the fleet curbed in total
+        self.fleet[first].max_watts = 16.4 * 2 / 0.95
+        self.fleet.max_watts = 16.4 * 500 / 0.95
+        self.fleet.start()
+        await self.clock.run(until=5)
+        scale = 500 / (2 + 5 * (len(charger_addresses) - 1))
+        # The charger is told the current in tenths of an amp
+        self.assertAlmostEqual(self.chargers[first].amps, 2 * scale, delta=0.1)
+        self.assertAlmostEqual(self.chargers[second].amps, 5 * scale, delta=0.1)
+        self.assertEqual(self.fleet[first].amps, 5)
+
+
+class FleetWheelTests(unittest.TestCase):
+
+    def test_add_remove(self):
+        fleet = FleetDriver(None)
+        for address in range(40):
+            fleet.add(address)
+        # Chargers are spread evenly over the wheel
+        self.assertEqual({len(slot) for slot in fleet.wheel}, {2, 3})
+        charger = fleet.remove(3)
+        self.assertIsNone(charger.slot)
+        self.assertNotIn(charger, sum(fleet.wheel, []))
+        with self.assertRaises(ValueError):
+            fleet.add(4)
+
+
+class FleetMainTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_finish(self):
+        clock = VirtualClock()
+        fleet = FleetDriver(LoopbackBus().end(), clock=clock)
+        fleet.verbose = False
+        fleet.add(0x20, volts=16.4, amps=5)
+        fleet.start()
+        main = asyncio.create_task(fleet.main())
+        await clock.run(until=5)
+        self.assertFalse(main.done())
+        fleet.finish()
+        # Everything stops with the next turn of the wheel (and something
+        # has to be waiting on the clock for it to get there)
+        waiting = asyncio.ensure_future(clock.sleep(10))
+        await clock.run(until=6)
+        self.assertTrue(main.done())
+        main.result()
+        waiting.cancel()
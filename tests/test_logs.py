@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+import unittest
+
+from can import Message
+
+import logs
+from utils import ElconUtils, elcon_manager_id
+
+
+class Recording(logging.Handler):
+    """
+    Keep the formatted messages, and which thread handled them.
+    """
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.add(threading.get_ident())
+
+
+class RateLimitFilterTests(unittest.TestCase):
+
+    def record(self, msg, *args, name='test'):
+        return logging.LogRecord(name, logging.INFO, __file__, 0, msg, args, None)
+
+    def test_rate_limit(self):
+        limit = logs.RateLimitFilter(rate=3, per=0.05)
+        passed = [
+            limit.filter(self.record("Ignoring message from %#04x", i))
+            for i in range(10)
+        ]
+        self.assertEqual(passed, [True] * 3 + [False] * 7)
+        # Other kinds of message have their own limit
+        self.assertTrue(limit.filter(self.record("Something else")))
+        self.assertTrue(limit.filter(self.record("Ignoring message from %#04x", 1, name='other')))
+        self.assertEqual(limit.suppressed, 7)
+        time.sleep(0.06)
+        record = self.record("Ignoring message from %#04x", 11)
+        self.assertTrue(limit.filter(record))
+        self.assertEqual(record.getMessage(), "Ignoring message from 0x0b [7 similar suppressed]")
+        record = self.record("Ignoring message from %#04x", 12)
+        self.assertTrue(limit.filter(record))
+        self.assertEqual(record.getMessage(), "Ignoring message from 0x0c")
+
+
+class QueuedLoggingTests(unittest.TestCase):
+
+    def test_queued(self):
+        handler = Recording()
+        handler.setFormatter(logging.Formatter('%(name)s %(message)s'))
+        listener = logs.start_logging(level=logging.DEBUG, handler=handler, rate=2)
+        try:
+            utils = ElconUtils(elcon_manager_id)
+            # A flood of frames that aren't for us
+            for source in range(100):
+                utils.decode_status(Message(
+                    arbitration_id=0x18060000 | (0x10 << 8) | source,
+                    data=b'\x00\x00\x00\x00\x00'
+                ))
+            # And a command to charge at no voltage, which is never sent
+            utils.pack_command(0xE5, 0, 0, True)
+        finally:
+            logs.stop_logging(listener)
+        self.assertEqual(utils.rejected, 100)
+        self.assertEqual(handler.messages, [
+            'utils Ignoring message from 0x00 to 0x10',
+            'utils Ignoring message from 0x01 to 0x10',
+            'utils Not sending a message - voltage must be positive',
+        ])
+        # Handled on the listener's thread, not ours
+        self.assertNotIn(threading.get_ident(), handler.threads)
+        self.assertNotIn(listener.queue_handler, logging.getLogger().handlers)
+        self.assertEqual(logging.getLogger().level, listener.previous_level)
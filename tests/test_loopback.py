@@ -0,0 +1,92 @@
+import asyncio
+import contextlib
+import io
+import unittest
+
+from battery import Battery
+from clock import VirtualClock
+from driver import ChargerDriver
+from loopback import LoopbackBus, open_reader
+from simulator import ElconCharger
+from utils import ElconUtils, elcon_charger_id, elcon_manager_id
+
+
+class LoopbackEndTests(unittest.TestCase):
+
+    def test_made_before_loop(self):
+        # Ends made before the event loop runs still work in it
+        bus = LoopbackBus()
+        sender, receiver = bus.end(), bus.end()
+        self.assertIsNone(receiver._queue)
+        msg = ElconUtils(elcon_manager_id).pack_command(elcon_charger_id, 120, 5, True)
+
+        async def exchange():
+            sender.send(msg)
+            return await asyncio.wait_for(receiver.__anext__(), 1)
+
+        self.assertIs(asyncio.run(exchange()), msg)
+
+
+class LoopbackBusTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_zero_copy(self):
+        bus = LoopbackBus()
+        sender, first, second = bus.end(), bus.end(), bus.end()
+        msg = ElconUtils(elcon_manager_id).pack_command(elcon_charger_id, 120, 5, True)
+        sender.send(msg)
+        # Every other end gets the very same message, and the sender doesn't
+        self.assertIs(await first.__anext__(), msg)
+        self.assertIs(await second.__anext__(), msg)
+        self.assertTrue(sender.queue.empty())
+        self.assertEqual((bus.sent, bus.delivered), (1, 2))
+
+    async def test_filters(self):
+        bus = LoopbackBus()
+        manager, charger, other = bus.end(), bus.end(), bus.end()
+        utils = ElconUtils(elcon_charger_id)
+        charger.set_filters(utils.can_filters(sources=(elcon_manager_id,)))
+        other.shutdown()
+        manager.send(ElconUtils(elcon_manager_id).pack_command(elcon_charger_id, 120, 5, True))
+        manager.send(ElconUtils(0x10).pack_command(0x11, 120, 5, True))
+        self.assertEqual(charger.queue.qsize(), 1)
+        self.assertEqual(bus.ends, [manager, charger])
+        reader, notifier = open_reader(charger)
+        self.assertIs(reader, charger)
+        self.assertIsNone(notifier)
+
+    async def test_session(self):
+        # The driver and simulator run as they would on a real bus
+        asyncio.get_running_loop().set_debug(False)
+        clock = VirtualClock()
+        bus = LoopbackBus()
+        battery = Battery(capacity=10, cells=4)
+        driver = ChargerDriver(bus.end(), clock=clock)
+        driver.verbose = False
+        driver.volts = 16.4
+        driver.amps = 5
+        driver.start()
+        charger = ElconCharger(bus.end(), battery, clock=clock)
+        charger.verbose = False
+        tasks = [
+            asyncio.create_task(driver.main()),
+            asyncio.create_task(charger.main()),
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            await clock.run(until=60)
+        for task in tasks:
+            task.cancel()
+        self.assertTrue(charger.active)
+        self.assertGreater(battery.charge_state, 5)
+        # The charger reports the battery's voltage as it charges
+        self.assertAlmostEqual(driver.statuses[-1].voltage, battery.voltage, delta=0.1)
+        # The charger took a status or two to reach the setpoint
+        latency = driver.metrics.snapshot()['pyelcon_setpoint_latency_seconds']
+        self.assertEqual(latency['count'], 1)
+        self.assertLessEqual(latency['max'], 2)
+        self.assertEqual(driver.keepalive_jitter.max, 0)
+        self.assertGreater(driver.utils.decode_time.count, 50)
+        self.assertEqual(charger.command_interval.percentile(50), 1)
+        # The driver keeps the statuses it receives, too
+        summary = driver.telemetry.downsample(60, 60)
+        self.assertLess(summary['voltage_max'][0], 16.4)
+        self.assertEqual(summary['current_max'][0], 5)
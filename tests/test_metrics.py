@@ -0,0 +1,100 @@
+import asyncio
+import random
+import time
+import unittest
+
+from metrics import Histogram, Metrics
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram('test')
+        self.assertIsNone(histogram.percentile(50))
+        values = [random.uniform(0.000_01, 10) for _ in range(10000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for percent in (1, 50, 90, 99, 99.9):
+            exact = values[int(len(values) * percent / 100) - 1]
+            self.assertAlmostEqual(histogram.percentile(percent) / exact, 1, delta=0.02)
+        self.assertEqual(histogram.percentile(100), max(values))
+        self.assertEqual(histogram.count, 10000)
+        self.assertAlmostEqual(histogram.sum, sum(values))
+        self.assertEqual((histogram.min, histogram.max), (values[0], values[-1]))
+
+    def test_small_values(self):
+        histogram = Histogram('test')
+        for value in (0, -1, 0.000_003, 0.000_003):
+            histogram.record(value)
+        self.assertEqual(histogram.min, 0)
+        self.assertEqual(histogram.percentile(50), 0)
+        self.assertAlmostEqual(histogram.percentile(100), 0.000_003)
+        histogram.reset()
+        self.assertEqual(histogram.snapshot()['count'], 0)
+
+    def test_record_speed(self):
+        # Cheap enough to leave on: well under a microsecond or two each
+        histogram = Histogram('test')
+        start = time.perf_counter()
+        for _ in range(100000):
+            histogram.record(0.001234)
+        self.assertLess((time.perf_counter() - start) / 100000, 5e-6)
+
+
+class MetricsTests(unittest.IsolatedAsyncioTestCase):
+
+    def make_metrics(self):
+        metrics = Metrics()
+        latency = metrics.histogram('pyelcon_test_seconds', 'A test histogram')
+        self.assertIs(metrics.histogram('pyelcon_test_seconds'), latency)
+        for value in (0.1, 0.2, 0.3):
+            latency.record(value)
+        metrics.histogram('pyelcon_empty_seconds')
+        return metrics
+
+    def test_snapshot(self):
+        snapshot = self.make_metrics().snapshot()
+        self.assertEqual(set(snapshot), {'pyelcon_test_seconds', 'pyelcon_empty_seconds'})
+        self.assertEqual(snapshot['pyelcon_test_seconds']['count'], 3)
+        self.assertAlmostEqual(snapshot['pyelcon_test_seconds']['mean'], 0.2)
+        self.assertAlmostEqual(snapshot['pyelcon_test_seconds']['p50'], 0.2, places=2)
+        self.assertIsNone(snapshot['pyelcon_empty_seconds']['p99'])
+
+    def test_prometheus(self):
+        lines = self.make_metrics().prometheus().splitlines()
+        self.assertIn('# HELP pyelcon_test_seconds A test histogram', lines)
+        self.assertIn('# TYPE pyelcon_test_seconds summary', lines)
+        self.assertIn('pyelcon_test_seconds_count 3', lines)
+        self.assertIn('pyelcon_empty_seconds{quantile="0.99"} NaN', lines)
+        median = [
+            float(line.split()[1]) for line in lines
+            if line.startswith('pyelcon_test_seconds{quantile="0.5"}')
+        ]
+        self.assertAlmostEqual(median[0], 0.2, places=2)
+
+    async def test_serve(self):
+        metrics = self.make_metrics()
+        server = await metrics.serve(0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(head.startswith(b'HTTP/1.0 200 OK'))
+        self.assertEqual(body.decode(), metrics.prometheus())
+
+    async def test_watch_loop(self):
+        metrics = Metrics()
+        watcher = asyncio.create_task(metrics.watch_loop(0.01))
+        await asyncio.sleep(0.05)
+        # Something hogs the event loop
+        time.sleep(0.1)
+        await asyncio.sleep(0.03)
+        watcher.cancel()
+        lag = metrics.histograms['pyelcon_loop_lag_seconds']
+        self.assertGreater(lag.count, 3)
+        self.assertGreaterEqual(lag.max, 0.05)
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import unittest
+
+from battery import Battery
+from clock import VirtualClock
+from fleet import FleetDriver
+from loopback import LoopbackBus
+from mqttbridge import LocalBroker, TelemetryBridge
+from simulator import ElconCharger
+from utils import ChargerStatus, elcon_charger_id, elcon_manager_id
+
+
+class TelemetryBridgeTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_deadband(self):
+        broker = LocalBroker()
+        bridge = TelemetryBridge(broker, clock=VirtualClock())
+        self.assertTrue(bridge.update('a', 100.0, 5.0, 0))
+        # Small changes are dropped, until they add up
+        self.assertFalse(bridge.update('a', 100.3, 5.1, 0))
+        self.assertFalse(bridge.update('a', 100.4, 4.9, 0))
+        self.assertTrue(bridge.update('a', 100.5, 5.0, 0))
+        self.assertTrue(bridge.update('a', 100.5, 5.2, 0))
+        # Any flag changing counts
+        self.assertTrue(bridge.update('a', 100.5, 5.2, 0x10))
+        # Each charger on its own
+        self.assertTrue(bridge.update_status('b', ChargerStatus(
+            elcon_charger_id, elcon_manager_id, 100.5, 5.2, 0x10
+        )))
+        self.assertEqual((bridge.updates, bridge.suppressed), (7, 2))
+        # Only the latest of each is published, in one message
+        await bridge.flush()
+        await bridge.flush()
+        self.assertEqual(len(broker.messages), 1)
+        topic, payload = broker.messages[0]
+        self.assertEqual(topic, 'pyelcon/status')
+        chargers = json.loads(payload)['chargers']
+        self.assertEqual(chargers['a'], {'time': 0, 'voltage': 100.5, 'current': 5.2, 'flags': 0x10})
+        self.assertEqual(set(chargers), {'a', 'b'})
+
+    async def session(self, count: int):
+        """
+        Run a fleet of `count` simulated chargers, and their fleet driver,
+        for a simulated minute, all publishing to one bridge.
+        """
+        asyncio.get_running_loop().set_debug(False)
+        clock = VirtualClock()
+        bus = LoopbackBus()
+        broker = LocalBroker()
+        bridge = TelemetryBridge(broker, clock=clock)
+        fleet = FleetDriver(bus.end(), clock=clock)
+        fleet.verbose = False
+        fleet.bridge = bridge
+        tasks = [asyncio.create_task(fleet.main())]
+        for address in range(1, count + 1):
+            fleet.add(address, volts=16.4, amps=5)
+            charger = ElconCharger(
+                bus.end(), Battery(capacity=10, cells=4), clock=clock, address=address
+            )
+            charger.verbose = False
+            charger.bridge = bridge
+            tasks.append(asyncio.create_task(charger.main()))
+        fleet.start()
+        await clock.run(until=60)
+        for task in tasks:
+            task.cancel()
+        return broker, bridge
+
+    async def test_fleet(self):
+        small_broker, small = await self.session(5)
+        large_broker, large = await self.session(50)
+        # Ten times the statuses, nearly all of them suppressed
+        self.assertGreater(large.updates, 9 * small.updates)
+        self.assertGreater(large.suppressed, 0.9 * large.updates)
+        # But no more messages to the broker
+        self.assertLessEqual(len(large_broker.messages), 60)
+        self.assertLessEqual(len(large_broker.messages), len(small_broker.messages) + 1)
+        seen = set()
+        for topic, payload in large_broker.messages:
+            seen.update(json.loads(payload)['chargers'])
+        self.assertEqual(len(seen), 100)
+        self.assertIn('charger/01', seen)
+        self.assertIn('simulator/32', seen)
@@ -0,0 +1,113 @@
+import asyncio
+import socket
+from struct import Struct
+import unittest
+
+import numpy as np
+
+from driver import ChargerDriver
+import rawcan
+from utils import ElconUtils, elcon_broadcast_id, elcon_charger_id, elcon_manager_id
+
+_frame_struct = Struct('=IB3x8s')
+
+
+def frame(msg, flags=rawcan.CAN_EFF_FLAG) -> bytes:
+    """
+    A `struct can_frame` as the kernel would give us for the message.
+    """
+    return _frame_struct.pack(msg.arbitration_id | flags, len(msg.data), bytes(msg.data))
+
+
+class RawCANReaderTests(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        # A datagram socket pair stands in for the CAN_RAW socket
+        self.sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.utils = ElconUtils(elcon_manager_id)
+        self.reader = rawcan.RawCANReader('test', self.utils, sock=receiver)
+        self.charger = ElconUtils(elcon_charger_id)
+
+    def tearDown(self):
+        self.reader.shutdown()
+        self.sender.close()
+
+    def status(self, volts, amps, dest=elcon_manager_id):
+        return self.charger.pack_command(dest, volts, amps, True)
+
+    async def test_statuses(self):
+        msgs = [self.status(100 + i, 5) for i in range(10)]
+        for msg in msgs:
+            self.sender.send(frame(msg))
+        # Not for us, a standard ID and an error frame are all rejected
+        self.sender.send(frame(self.charger.pack_command(0x10, 100, 5, True)))
+        self.sender.send(frame(msgs[0], flags=0))
+        self.sender.send(frame(msgs[0], flags=rawcan.CAN_EFF_FLAG | rawcan.CAN_ERR_FLAG))
+        self.sender.send(frame(self.status(120, 2.5, dest=elcon_broadcast_id)))
+        statuses = []
+        async for status in self.reader:
+            statuses.append(status)
+            if len(statuses) == 11:
+                break
+        self.assertEqual(statuses[:10], [self.utils.decode_status(msg) for msg in msgs])
+        self.assertEqual((statuses[10].dest, statuses[10].voltage, statuses[10].current),
+                         (elcon_broadcast_id, 120, 2.5))
+        self.assertEqual(self.utils.rejected, 3)
+        # All read in one go
+        self.assertEqual((self.reader.received, self.reader.reads), (14, 1))
+
+    async def test_waits(self):
+        statuses = self.reader.__aiter__()
+        waiting = asyncio.ensure_future(statuses.__anext__())
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+        self.sender.send(frame(self.status(110, 3)))
+        status = await asyncio.wait_for(waiting, 1)
+        self.assertEqual((status.voltage, status.current), (110, 3))
+        await statuses.aclose()
+
+    async def test_batches(self):
+        class SmallReader(rawcan.RawCANReader):
+            batch = 4
+        reader = SmallReader('test', self.utils, sock=self.reader.sock)
+        for i in range(6):
+            self.sender.send(frame(self.status(100 + i, 5)))
+        batches = reader.batches()
+        first = await batches.__anext__()
+        second = await batches.__anext__()
+        await batches.aclose()
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 2)
+        np.testing.assert_array_equal(
+            np.concatenate([first, second])['voltage'], np.arange(100, 106)
+        )
+        self.assertTrue(np.all(first['source'] == elcon_charger_id))
+        reader.loop.remove_reader(reader.sock.fileno())
+
+    async def test_driver(self):
+        driver = ChargerDriver(bus=None)
+        driver.reader = self.reader
+        receiving = asyncio.create_task(driver.receive_raw_status())
+        for i in range(3):
+            self.sender.send(frame(self.status(100 + i, 5)))
+        while len(driver.statuses) < 3:
+            await asyncio.sleep(0.001)
+        receiving.cancel()
+        self.assertEqual([s.voltage for s in driver.statuses], [100, 101, 102])
+        self.assertEqual(len(driver.telemetry), 3)
+
+
+class FilterTests(unittest.TestCase):
+
+    def test_pack_filters(self):
+        filters = ElconUtils(elcon_manager_id).can_filters(sources=(elcon_charger_id,))
+        packed = rawcan.pack_filters(filters)
+        self.assertEqual(len(packed), 8 * len(filters))
+        can_id, can_mask = Struct('=II').unpack_from(packed)
+        self.assertEqual(can_id, rawcan.CAN_EFF_FLAG | (elcon_manager_id << 8) | elcon_charger_id)
+        self.assertEqual(can_mask, rawcan.CAN_EFF_FLAG | 0xFFFF)
+        # Standard frames only match standard IDs
+        can_id, can_mask = Struct('=II').unpack(rawcan.pack_filters(
+            [{'can_id': 0x123, 'can_mask': 0x7FF}]
+        ))
+        self.assertEqual((can_id, can_mask), (0x123, rawcan.CAN_EFF_FLAG | 0x7FF))
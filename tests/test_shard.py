@@ -0,0 +1,101 @@
+import os
+import signal
+import time
+import unittest
+
+import numpy as np
+
+import shard
+from utils import ChargerStatus, elcon_manager_id
+
+
+def wait_for(condition, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.05)
+
+
+class ShardTableTests(unittest.TestCase):
+
+    def test_table(self):
+        table = shard.ShardTable(2)
+        try:
+            other = shard.ShardTable(2, table.name, create=False)
+            other.write_status(1, ChargerStatus(0x10, elcon_manager_id, 16.4, 5.0, 0x08), 100.0)
+            other.write_setpoint(1, 0x10, 16.4, 5.0, True)
+            other.close()
+            rows = table.read(1)
+            self.assertEqual(rows[0x10]['seq'], 4)
+            self.assertEqual(
+                (rows[0x10]['voltage'], rows[0x10]['current'], rows[0x10]['flags']),
+                (16.4, 5.0, 0x08)
+            )
+            self.assertTrue(rows[0x10]['running'])
+            self.assertEqual(list(table.chargers(1)), [0x10])
+            self.assertEqual(len(table.chargers(0)), 0)
+            self.assertEqual(table.read().shape, (2, shard.addresses))
+            # A row left half written by a worker that died is still read
+            table.rows[0, 0x20]['seq'] = 1
+            table.rows[0, 0x20]['voltage'] = 1.0
+            self.assertEqual(table.read(0)[0x20]['voltage'], 1.0)
+        finally:
+            table.close()
+            table.unlink()
+
+
+class SupervisorTests(unittest.TestCase):
+
+    def test_virtual_buses(self):
+        configs = [
+            {
+                'channel': f'shard-test-{index}', 'interface': 'virtual',
+                'chargers': {address: {'volts': 16.4, 'amps': 5} for address in addresses},
+                'simulate': True,
+            }
+            for index, addresses in enumerate(([0x10, 0x11, 0x12], [0x10, 0x20]))
+        ]
+        supervisor = shard.Supervisor(configs)
+        supervisor.heartbeat_timeout = 2.0
+        try:
+            supervisor.start()
+            table = supervisor.table
+
+            def charging(index):
+                rows = table.read(index)
+                chargers = list(configs[index]['chargers'])
+                return np.all(rows[chargers]['current'] == 5) \
+                    and np.all(rows[chargers]['running'])
+
+            wait_for(lambda: charging(0) and charging(1))
+            # Each bus is on its own, so the same address is two chargers
+            self.assertEqual(list(table.chargers(0)), [0x10, 0x11, 0x12])
+            self.assertEqual(list(table.chargers(1)), [0x10, 0x20])
+            rows = table.read()
+            self.assertTrue(np.all(rows[0, [0x10, 0x11, 0x12]]['set_volts'] == 16.4))
+            self.assertEqual(supervisor.check(), [])
+
+            # A worker that dies is restarted, and carries on - even if it
+            # died part way through writing a row
+            pid = table.headers[1]['pid']
+            os.kill(int(pid), signal.SIGSTOP)
+            table.rows[1, 0x20]['seq'] += 1
+            os.kill(int(pid), signal.SIGKILL)
+            supervisor.processes[1].join()
+            self.assertEqual(supervisor.check(), [1])
+            self.assertEqual(supervisor.restarts, 1)
+            self.assertEqual(table.headers[1]['starts'], 2)
+            wait_for(lambda: table.headers[1]['heartbeat'] > 0)
+            self.assertNotEqual(table.headers[1]['pid'], pid)
+            heard = table.read(1)[0x20]['timestamp']
+            wait_for(lambda: table.read(1)[0x20]['timestamp'] > heard)
+            # The row can be read whole again
+            self.assertFalse(np.any(table.read(1)['seq'] & 1))
+            # So is one that stops beating
+            os.kill(int(table.headers[0]['pid']), signal.SIGSTOP)
+            time.sleep(2.5)
+            self.assertEqual(supervisor.check(), [0])
+            wait_for(lambda: table.headers[0]['heartbeat'] > 0)
+        finally:
+            supervisor.stop()
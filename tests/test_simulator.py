@@ -0,0 +1,161 @@
+import asyncio
+import socket
+import time
+import unittest
+from unittest import mock
+
+from battery import Battery
+from clock import VirtualClock
+from driver import ChargerDriver
+from loopback import LoopbackBus
+from simulator import ElconCharger
+
+
+class ElconChargerSessionTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Run the driver against the simulated charger and battery on a virtual
+    clock.
+    """
+
+    async def asyncSetUp(self):
+        # Debug mode makes every trip through the event loop much slower
+        asyncio.get_running_loop().set_debug(False)
+        self.tasks = []
+
+    def make_session(self, update_time=1):
+        self.clock = VirtualClock()
+        bus = LoopbackBus()
+        driver_end, charger_end = bus.end(), bus.end()
+        self.battery = Battery(capacity=10, cells=4)
+        self.driver = ChargerDriver(driver_end, clock=self.clock)
+        self.driver.verbose = False
+        self.driver.update_time = update_time
+        self.driver.volts = 16.4
+        self.driver.amps = 5
+        self.charger = ElconCharger(charger_end, self.battery, clock=self.clock)
+        self.charger.verbose = False
+        self.charger.reader = charger_end
+        self.charger.reset_timeout()
+        self.tasks = [
+            asyncio.create_task(self.driver.send_message()),
+            asyncio.create_task(self.charger.emit_status()),
+            asyncio.create_task(self.charger.read_messages()),
+            asyncio.create_task(self.driver.transmit.run()),
+            asyncio.create_task(self.charger.transmit.run()),
+        ]
+
+    def tearDown(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def test_charge_session(self):
+        self.make_session()
+        self.driver.start()
+        start = time.monotonic()
+        # Five amp-hours to full at five amps: an hour and a bit
+        await self.clock.run(until=2 * 3600)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(self.charger.active)
+        # Charged up to the set voltage, and stopped there
+        self.assertAlmostEqual(self.battery.voltage, 16.4)
+        self.assertEqual(self.charger.output_amps, 0)
+        # Only the last hour of the status history is kept, and the charger
+        # has been idle for the last ten minutes of it
+        self.assertEqual(len(self.charger.telemetry), self.charger.telemetry_size)
+        last = self.charger.telemetry.downsample(600, 600)
+        self.assertEqual(last['current_max'][0], 0)
+        self.assertAlmostEqual(last['voltage_mean'][0], 16.4)
+
+    async def test_history_sizes(self):
+        # Histories sized on the instance, as other settings are
+        self.make_session()
+        self.charger.telemetry_size = 10
+        self.charger.command_history = 5
+        self.driver.telemetry_size = 20
+        self.driver.status_history = 3
+        self.driver.start()
+        await self.clock.run(until=60)
+        self.assertEqual(len(self.charger.telemetry), 10)
+        self.assertEqual(len(self.charger.commands), 5)
+        self.assertEqual(self.driver.telemetry.capacity, 20)
+        self.assertEqual(self.driver.statuses.maxlen, 3)
+
+    async def test_sub_second_charge(self):
+        # Commands every half second still charge the battery
+        self.make_session(update_time=0.5)
+        self.driver.start()
+        await self.clock.run(until=60)
+        # The first command only turns the charger on, the next 120 charge
+        self.assertAlmostEqual(
+            self.battery.charge_state, 5 + 5 * 60 / 3600, places=9
+        )
+
+    async def test_timeout(self):
+        self.make_session()
+        self.driver.start()
+        await self.clock.run(until=10)
+        self.assertTrue(self.charger.active)
+        self.driver.stop()
+        # The last command was at ten seconds, so we time out at twelve
+        await self.clock.run(until=11.999)
+        self.assertTrue(self.charger.active)
+        await self.clock.run(until=12)
+        self.assertFalse(self.charger.active)
+        self.assertTrue(self.charger.utils.timeout)
+        self.assertIsNone(self.charger.timeout_handle)
+
+    async def test_idle_status(self):
+        # Until the driver starts, the charger has nothing to report, and
+        # doesn't warn about it every interval
+        self.make_session()
+        with mock.patch('utils.log') as utils_log:
+            await self.clock.run(until=1.5)
+        utils_log.warning.assert_not_called()
+        self.assertEqual(len(self.charger.telemetry), 2)
+
+    async def test_idle_chargers(self):
+        # Hundreds of idle chargers just wait for their one deadline
+        clock = VirtualClock()
+        chargers = []
+        for _ in range(500):
+            charger = ElconCharger(None, Battery(10, cells=4), clock=clock)
+            charger.reset_timeout()
+            charger.reset_timeout()
+            chargers.append(charger)
+        await clock.run(until=1.999)
+        self.assertFalse(any(charger.utils.timeout for charger in chargers))
+        await clock.run(until=2)
+        self.assertTrue(all(charger.utils.timeout for charger in chargers))
+        self.assertEqual(clock._waiters, [])
+
+    async def test_metrics_server(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        # The server is closed when the charger stops, so the port can be
+        # served again
+        for attempt in range(2):
+            charger = ElconCharger(
+                LoopbackBus().end(), Battery(10, cells=4), clock=VirtualClock()
+            )
+            charger.verbose = False
+            charger.metrics_port = port
+            main = asyncio.create_task(charger.main())
+            await asyncio.sleep(0.05)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            self.assertIn(b'pyelcon_loop_lag_seconds', response)
+            main.cancel()
+            await asyncio.gather(main, return_exceptions=True)
+        # Without the server, the event loop isn't watched
+        charger = ElconCharger(
+            LoopbackBus().end(), Battery(10, cells=4), clock=VirtualClock()
+        )
+        charger.verbose = False
+        main = asyncio.create_task(charger.main())
+        await asyncio.sleep(0.05)
+        main.cancel()
+        await asyncio.gather(main, return_exceptions=True)
+        self.assertNotIn('pyelcon_loop_lag_seconds', charger.metrics.histograms)
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+from battery import Battery
+from clock import VirtualClock
+from driver import ChargerDriver
+from loopback import LoopbackBus
+from simulator import ElconCharger
+import snapshot
+from utils import elcon_charger_id
+
+
+class SnapshotTests(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'chargers.snap')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def charger(self, clock, address=0x10, bus=None):
+        bus = bus if bus is not None else LoopbackBus()
+        charger = ElconCharger(
+            bus.end(), Battery(capacity=10, cells=4), clock=clock, address=address
+        )
+        charger.verbose = False
+        return charger
+
+    async def test_round_trip(self):
+        clock = VirtualClock(start=1000.0)
+        chargers = [self.charger(clock, address) for address in (0x10, 0x11, 0x12)]
+        for index, charger in enumerate(chargers):
+            charger.battery.charge_state = 2.0 + index
+            charger.battery.resistance = 0.1
+            charger.volts, charger.amps, charger.output_amps = 16.4, 5.0, 4.5
+        # One is waiting to time out, one has, and one never started
+        chargers[0].active = True
+        chargers[0].last_time = 999.5
+        chargers[0].reset_timeout()
+        chargers[1].utils.timeout = True
+        records = snapshot.take(chargers, clock.now())
+        snapshot.save(self.path, records, clock.now())
+        self.assertEqual(
+            os.path.getsize(self.path),
+            len(snapshot.snapshot_magic) + 8 + 3 * snapshot.snapshot_dtype.itemsize
+        )
+        loaded, taken_at = snapshot.load(self.path)
+        self.assertEqual(taken_at, 1000.0)
+
+        # Restored somewhen else, everything is as it was relative to then
+        later = VirtualClock(start=5000.0)
+        restored = [self.charger(later, address) for address in (0x10, 0x11, 0x12)]
+        snapshot.restore(restored, loaded, later.now())
+        for before, after in zip(chargers, restored):
+            self.assertEqual(after.battery.charge_state, before.battery.charge_state)
+            self.assertEqual(after.battery.voltage, before.battery.voltage)
+            self.assertEqual(after.battery.resistance, 0.1)
+            self.assertEqual(
+                (after.active, after.utils.timeout, after.volts, after.amps, after.output_amps),
+                (before.active, before.utils.timeout, before.volts, before.amps, before.output_amps)
+            )
+        self.assertEqual(restored[0].last_time, 4999.5)
+        self.assertEqual(restored[0].timeout_at, 5002.0)
+        self.assertIsNone(restored[1].timeout_at)
+        # The pending timeout fires when it would have
+        waiting = asyncio.ensure_future(later.sleep(10))
+        await later.run(until=5001.9)
+        self.assertTrue(restored[0].active)
+        await later.run(until=5002.1)
+        self.assertFalse(restored[0].active)
+        self.assertTrue(restored[0].utils.timeout)
+        waiting.cancel()
+
+        # Records only go back to the chargers they came from
+        with self.assertRaises(ValueError):
+            snapshot.restore(restored[:2], loaded, later.now())
+        with self.assertRaises(ValueError):
+            snapshot.restore(list(reversed(restored)), loaded, later.now())
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot')
+        with self.assertRaises(ValueError):
+            snapshot.load(self.path)
+
+    async def session(self, until: float, path: str, start: float = 0.0):
+        """
+        Charge a simulated battery, snapshotting the charger every ten
+        seconds, until the given time.
+        """
+        asyncio.get_running_loop().set_debug(False)
+        clock = VirtualClock(start=start)
+        bus = LoopbackBus()
+        driver = ChargerDriver(bus.end(), clock=clock)
+        driver.verbose = False
+        driver.volts, driver.amps = 16.4, 5
+        charger = self.charger(clock, elcon_charger_id, bus=bus)
+        charger.snapshot_path = path
+        charger.snapshot_interval = 10
+        tasks = [
+            asyncio.create_task(driver.main()),
+            asyncio.create_task(charger.main()),
+        ]
+        driver.start()
+        await clock.run(until=until)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return charger
+
+    async def test_resume(self):
+        first = await self.session(100, self.path)
+        self.assertGreater(first.battery.charge_state, 5.0)
+        records, taken_at = snapshot.load(self.path)
+        self.assertEqual(taken_at, 100)
+        charge = records[0]['charge_state']
+        self.assertGreater(charge, 5.0)
+        # A new simulation carries on from the snapshot, not from scratch
+        second = await self.session(1105, self.path, start=1000)
+        self.assertGreater(second.battery.charge_state, charge)
+        records, taken_at = snapshot.load(self.path)
+        self.assertEqual(records[0]['address'], elcon_charger_id)
+        # It was saved once more as it stopped, part way through an interval
+        self.assertEqual(taken_at, 1105)
+        self.assertEqual(records[0]['charge_state'], second.battery.charge_state)
+        self.assertEqual(self.writer_threads(), [])
+
+    def writer_threads(self):
+        return [
+            thread for thread in threading.enumerate()
+            if thread.name.startswith('snapshot')
+        ]
+
+    async def test_shared(self):
+        asyncio.get_running_loop().set_debug(False)
+        clock = VirtualClock()
+        bus = LoopbackBus()
+        addresses = range(0x10, 0x30)
+        chargers = [self.charger(clock, address, bus=bus) for address in addresses]
+        snapshotter = snapshot.Snapshotter(chargers, self.path, clock=clock)
+        snapshotter.interval = 10
+        self.assertFalse(snapshotter.restore())
+        for index, charger in enumerate(chargers):
+            charger.snapshotter = snapshotter
+            charger.battery.charge_state = 1.0 + index / 10
+        tasks = [asyncio.create_task(charger.main()) for charger in chargers]
+        tasks.append(asyncio.create_task(snapshotter.run()))
+        await clock.run(until=25)
+        # One thread writes for all of them
+        self.assertEqual(len(self.writer_threads()), 1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Closing saves them as they are when they stop, and stops the thread
+        snapshotter.close()
+        self.assertEqual(self.writer_threads(), [])
+        # All into the one file
+        self.assertEqual(os.listdir(self.directory.name), ['chargers.snap'])
+        records, taken_at = snapshot.load(self.path)
+        self.assertEqual(taken_at, 25)
+        self.assertEqual(list(records['address']), list(addresses))
+
+        restored = [self.charger(clock, address, bus=bus) for address in addresses]
+        again = snapshot.Snapshotter(restored, self.path, clock=clock)
+        self.assertTrue(again.restore())
+        for before, after in zip(chargers, restored):
+            self.assertEqual(after.battery.charge_state, before.battery.charge_state)
+            after.resume_timeout(None)
+        again.close()
@@ -0,0 +1,127 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from benchmarks import suite
+
+
+def metric(value, higher=True, threshold=None):
+    result = {'value': value, 'unit': 'ops/s', 'higher': higher}
+    if threshold is not None:
+        result['threshold'] = threshold
+    return result
+
+
+class CompareTests(unittest.TestCase):
+
+    def test_direction(self):
+        baseline = {'rate': metric(100.0), 'jitter': metric(0.5, higher=False)}
+        # A lower rate and a higher jitter are both worse
+        compared = dict(
+            (name, change) for name, base, value, change in suite.compare(
+                baseline, {'rate': metric(80.0), 'jitter': metric(0.6, higher=False)}
+            )
+        )
+        self.assertAlmostEqual(compared['rate'], 0.2)
+        self.assertAlmostEqual(compared['jitter'], 0.2)
+        # And the other way round, better
+        compared = dict(
+            (name, change) for name, base, value, change in suite.compare(
+                baseline, {'rate': metric(120.0), 'jitter': metric(0.4, higher=False)}
+            )
+        )
+        self.assertAlmostEqual(compared['rate'], -0.2)
+        self.assertAlmostEqual(compared['jitter'], -0.2)
+
+    def test_zero_baseline(self):
+        baseline = {'jitter': metric(0.0, higher=False)}
+        self.assertEqual(
+            suite.compare(baseline, {'jitter': metric(0.0, higher=False)}),
+            [('jitter', 0.0, 0.0, 0.0)]
+        )
+        self.assertEqual(
+            suite.compare(baseline, {'jitter': metric(0.1, higher=False)}),
+            [('jitter', 0.0, 0.1, float('inf'))]
+        )
+
+    def test_missing(self):
+        baseline = {'rate': metric(100.0), 'other': metric(100.0)}
+        # Metrics only in the new results aren't compared
+        compared = suite.compare(baseline, {'rate': metric(100.0), 'new': metric(1.0)})
+        self.assertEqual(
+            compared, [('other', 100.0, None, None), ('rate', 100.0, 100.0, 0.0)]
+        )
+        self.assertEqual(suite.regressions(baseline, compared), ['other'])
+
+    def test_thresholds(self):
+        baseline = {
+            'plain': metric(100.0),
+            'noisy': metric(100.0, threshold=0.5),
+            'strict': metric(100.0, threshold=0.01),
+        }
+        compared = suite.compare(baseline, {
+            'plain': metric(85.0), 'noisy': metric(60.0), 'strict': metric(95.0),
+        })
+        # By default, each metric is held to its own threshold, or 10%
+        self.assertEqual(suite.regressions(baseline, compared), ['plain', 'strict'])
+        # A limit given holds them all to it, looser or stricter
+        self.assertEqual(suite.regressions(baseline, compared, 0.2), ['noisy'])
+        self.assertEqual(suite.regressions(baseline, compared, 0.5), [])
+        self.assertEqual(
+            suite.regressions(baseline, compared, 0.01), ['noisy', 'plain', 'strict']
+        )
+
+
+class CompareMainTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save(self, name, metrics):
+        path = os.path.join(self.directory.name, name)
+        suite.save_results(path, metrics)
+        return path
+
+    def compare_main(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = suite.compare_main(*args)
+        return status, output.getvalue()
+
+    def test_status(self):
+        baseline = self.save('baseline.json', {
+            'rate': metric(100.0), 'jitter': metric(0.5, higher=False),
+        })
+        same = self.save('same.json', {
+            'rate': metric(95.0), 'jitter': metric(0.4, higher=False),
+        })
+        status, output = self.compare_main(baseline, same)
+        self.assertEqual(status, 0)
+        self.assertNotIn('REGRESSED', output)
+        slower = self.save('slower.json', {
+            'rate': metric(50.0), 'jitter': metric(0.4, higher=False),
+        })
+        status, output = self.compare_main(baseline, slower)
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            [line.split()[0] for line in output.splitlines() if 'REGRESSED' in line],
+            ['rate']
+        )
+        # Unless the limit given allows for it
+        self.assertEqual(self.compare_main(baseline, slower, '0.6')[0], 0)
+        missing = self.save('missing.json', {'rate': metric(100.0)})
+        status, output = self.compare_main(baseline, missing)
+        self.assertEqual(status, 1)
+        self.assertIn('missing', output)
+
+    def test_limit(self):
+        # A limit given overrides the metrics' own thresholds
+        baseline = self.save('baseline.json', {'rate': metric(100.0, threshold=0.5)})
+        slower = self.save('slower.json', {'rate': metric(70.0)})
+        self.assertEqual(self.compare_main(baseline, slower)[0], 0)
+        self.assertEqual(self.compare_main(baseline, slower, '0.1')[0], 1)
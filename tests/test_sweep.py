@@ -0,0 +1,74 @@
+import math
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import sweep
+from driver import ChargerDriver
+
+
+class GridTests(unittest.TestCase):
+
+    def test_grid(self):
+        cases = sweep.grid(capacity=[1, 2], cells=4, volts=16.4, amps=[2, 5, 10])
+        self.assertEqual(len(cases), 6)
+        self.assertEqual(list(cases['capacity']), [1, 1, 1, 2, 2, 2])
+        self.assertEqual(list(cases['amps']), [2, 5, 10, 2, 5, 10])
+        self.assertEqual(list(cases['termination_amps']), [0.2, 0.5, 1.0] * 2)
+        self.assertTrue(np.all(cases['max_watts'] == ChargerDriver.max_watts))
+        self.assertTrue(np.all(cases['efficiency_pct'] == 0.95))
+        with self.assertRaises(ValueError):
+            sweep.grid(capacity=1, colour='red')
+
+
+class SweepTests(unittest.TestCase):
+
+    def test_session(self):
+        case = sweep.grid(capacity=1, cells=4, volts=16.4, amps=5, max_watts=50)[0]
+        result = sweep.run_session(case)[0]
+        # Half a 1Ah battery at no more than 50W takes over six minutes
+        self.assertGreater(result['time_to_full'], 360)
+        self.assertLess(result['time_to_full'], 800)
+        self.assertLessEqual(result['peak_watts'], 50)
+        self.assertGreater(result['peak_watts'], 45)
+        self.assertGreater(result['energy_wh'], 0.4 * 15)
+        self.assertLess(result['energy_wh'], 0.5 * 16.4)
+        self.assertEqual(result['timeouts'], 0)
+        self.assertGreater(result['charge'], 0.9)
+        # Not enough time to finish
+        result = sweep.run_session(case, max_seconds=60)[0]
+        self.assertTrue(math.isnan(result['time_to_full']))
+
+    def test_sweep(self):
+        cases = sweep.grid(capacity=[0.5, 1], cells=4, volts=16.4, amps=[5, 10])
+        seen = []
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sweep.npz')
+            results = sweep.run_sweep(
+                cases, path, workers=2,
+                progress=lambda done, total: seen.append((done, total))
+            )
+            self.assertEqual(results.dtype, sweep.result_dtype)
+            np.testing.assert_array_equal(sweep.load_results(path), results)
+        self.assertEqual(seen[-1], (4, 4))
+        np.testing.assert_array_equal(results['amps'], cases['amps'])
+        # Same as running them one by one
+        for case, result in zip(cases, results):
+            self.assertEqual(sweep.run_session(case)[0], result)
+        # Bigger batteries take longer, higher currents less time
+        self.assertLess(results['time_to_full'][0], results['time_to_full'][2])
+        self.assertGreater(results['time_to_full'][0], results['time_to_full'][1])
+
+    def test_worker_logging(self):
+        # A driver told to charge at no voltage warns every keep-alive: what
+        # the workers log comes back here, without a flood of it
+        cases = sweep.grid(capacity=[0.5, 1], cells=4, volts=0, amps=5)
+        with self.assertLogs(level='WARNING') as logged:
+            results = sweep.run_sweep(
+                cases, workers=2, max_seconds=60, progress=lambda done, total: None
+            )
+        self.assertIn('voltage must be positive', logged.output[0])
+        self.assertLessEqual(len(logged.output), 2 * 5)
+        self.assertTrue(np.all(np.isnan(results['time_to_full'])))
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from telemetry import Telemetry
+from utils import ChargerStatus
+
+
+class TelemetryTests(unittest.TestCase):
+
+    def fill(self, telemetry, seconds):
+        # A sample a second, the voltage climbing by a tenth a second
+        for t in range(seconds):
+            telemetry.append(t, 100 + t / 10, 5 - (t % 2), 0x10 if t == 7 else 0)
+
+    def test_ring(self):
+        telemetry = Telemetry(capacity=10)
+        self.assertEqual(len(telemetry), 0)
+        self.assertEqual(len(telemetry.window(5)), 0)
+        self.fill(telemetry, 25)
+        # Only the newest ten are kept, in the same memory
+        samples = telemetry.samples
+        self.assertEqual((len(telemetry), telemetry.count), (10, 25))
+        self.assertIs(telemetry.samples, samples)
+        history = telemetry.history()
+        self.assertEqual(list(history['timestamp']), list(range(15, 25)))
+        telemetry.append_status(25, ChargerStatus(0xE5, 0x50, 110.5, 2.5, 0x08))
+        self.assertEqual(telemetry.history()[-1]['flags'], 0x08)
+        self.assertEqual(telemetry.history()[-1]['voltage'], 110.5)
+
+    def test_window(self):
+        telemetry = Telemetry(capacity=10)
+        self.fill(telemetry, 25)
+        # The last three seconds, across the wrap in the buffer
+        window = telemetry.window(3, now=21.5)
+        self.assertEqual(list(window['timestamp']), [19, 20, 21])
+        window = telemetry.window(3)
+        self.assertEqual(list(window['timestamp']), [21, 22, 23, 24])
+
+    def test_downsample(self):
+        telemetry = Telemetry(capacity=100)
+        self.fill(telemetry, 20)
+        summary = telemetry.downsample(10, 5, now=19)
+        self.assertEqual(list(summary['timestamp']), [9, 14])
+        self.assertEqual(list(summary['count']), [5, 6])
+        np.testing.assert_allclose(summary['voltage_min'], [100.9, 101.4])
+        np.testing.assert_allclose(summary['voltage_mean'], [101.1, 101.65])
+        np.testing.assert_allclose(summary['voltage_max'], [101.3, 101.9])
+        self.assertEqual(list(summary['current_min']), [4, 4])
+        self.assertEqual(list(summary['current_max']), [5, 5])
+        # The whole window at once
+        overall = telemetry.downsample(20, 20)
+        self.assertEqual(len(overall), 1)
+        self.assertEqual(overall['count'][0], 20)
+        self.assertEqual(overall['flags'][0], 0x10)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'history')
+            telemetry = Telemetry(capacity=10, path=path)
+            self.fill(telemetry, 15)
+            telemetry.flush()
+            del telemetry
+            # Carry on where we left off
+            telemetry = Telemetry(capacity=10, path=path)
+            self.assertEqual(telemetry.count, 15)
+            telemetry.append(15, 99, 1, 0)
+            self.assertEqual(list(telemetry.history()['timestamp']), list(range(6, 16)))
+            del telemetry
+            with self.assertRaises(ValueError):
+                Telemetry(capacity=20, path=path)
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import unittest
+
+import can
+
+from transmit import TransmitQueue
+
+
+class BusyBus(object):
+    """
+    A bus that refuses frames, as a full socketcan transmit queue does,
+    while it is `busy`.
+    """
+    def __init__(self):
+        self.busy = False
+        self.sent = []
+        self.threads = set()
+
+    def send(self, msg):
+        self.threads.add(threading.get_ident())
+        if self.busy:
+            raise can.CanOperationError("No buffer space available")
+        self.sent.append((msg.arbitration_id, bytes(msg.data)))
+
+
+def frame(arbitration_id, value):
+    return can.Message(arbitration_id=arbitration_id, data=bytes([value]))
+
+
+class TransmitQueueTests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.bus = BusyBus()
+        self.queue = TransmitQueue(self.bus)
+        self.queue.backoff = 0.001
+        self.queue.max_backoff = 0.004
+        self.task = asyncio.create_task(self.queue.run())
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+
+    async def settle(self, frames):
+        # Wait until the given number of frames have been sent or dropped
+        while self.queue.sent + self.queue.dropped < frames:
+            await asyncio.sleep(0.001)
+
+    async def test_latest_wins(self):
+        for value in range(5):
+            self.queue.send(frame(1, value))
+        self.queue.send(frame(2, 0))
+        self.queue.send(frame(1, 9))
+        self.assertEqual(self.queue.depth, 2)
+        await self.settle(2)
+        # Frame 1 kept its place in the queue, with the latest data
+        self.assertEqual(self.bus.sent, [(1, b'\x09'), (2, b'\x00')])
+        self.assertEqual(self.queue.coalesced, 5)
+        self.assertEqual(self.queue.sent, 2)
+        # Sending when the bus is free doesn't need a thread
+        self.assertEqual(self.bus.threads, {threading.get_ident()})
+
+    async def test_saturated(self):
+        self.bus.busy = True
+        self.queue.send(frame(1, 0))
+        await asyncio.sleep(0.003)
+        for value in range(1, 20):
+            self.queue.send(frame(1, value))
+        self.bus.busy = False
+        await self.settle(1)
+        # Only the freshest setpoint went out, from a thread
+        self.assertEqual(self.bus.sent, [(1, bytes([19]))])
+        self.assertGreater(self.queue.retried, 0)
+        self.assertEqual(self.queue.dropped, 0)
+        self.assertGreater(len(self.bus.threads), 1)
+
+    async def test_dropped(self):
+        self.bus.busy = True
+        self.queue.retries = 3
+        self.queue.send(frame(1, 0))
+        await self.settle(1)
+        self.assertEqual(self.bus.sent, [])
+        self.assertEqual(self.queue.retried, 3)
+        self.assertEqual(self.queue.dropped, 1)
+        # And the queue carries on afterwards
+        self.bus.busy = False
+        self.queue.send(frame(1, 1))
+        await self.settle(2)
+        self.assertEqual(self.bus.sent, [(1, b'\x01')])
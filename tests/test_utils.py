@@ -1,8 +1,10 @@
+import can
 from can import Message
 
+import struct
 import unittest
 
-from elcon_frames import ElconUtils, elcon_charger_id, elcon_manager_id
+from utils import ChargerStatus, ElconUtils, elcon_charger_id, elcon_manager_id
 
 magic_id = 0x1806E5F4
 
@@ -38,6 +40,59 @@ class ElconUtilsTests(unittest.TestCase):
 
         # Add tests of failure modes here
 
+    def test_decode_status(self):
+        eu = ElconUtils(elcon_charger_id)
+        msg = Message(arbitration_id=magic_id, data=b'\x01\x00\x00\x10\x08')
+        status = eu.decode_status(msg)
+        self.assertEqual(
+            status, ChargerStatus(elcon_manager_id, elcon_charger_id, 25.6, 1.6, 0x08)
+        )
+        self.assertTrue(status.no_battery)
+        self.assertFalse(status.hardware_failure)
+        self.assertFalse(status.timeout)
+        # The utils object itself is untouched
+        self.assertEqual(eu.voltage, 0)
+        self.assertFalse(eu.no_battery)
+        # Statuses can't be changed after the fact
+        with self.assertRaises(AttributeError):
+            status.voltage = 12.0
+        # Messages not addressed to us are not decoded, just counted
+        eu = ElconUtils(elcon_manager_id)
+        self.assertIsNone(eu.decode_status(msg))
+        self.assertEqual(eu.rejected, 1)
+
+    def test_can_filters(self):
+        eu = ElconUtils(elcon_manager_id)
+        sender = can.Bus('pyelcon-filters', interface='virtual')
+        receiver = can.Bus('pyelcon-filters', interface='virtual')
+        receiver.set_filters(eu.can_filters(sources=(elcon_charger_id,)))
+        try:
+            for arb_id in (
+                0x1806F4E5,  # charger to manager
+                0x1806E5F4,  # manager to charger
+                0x180650E5,  # charger to broadcast
+                0x1806F4EF,  # inverter to manager
+                0x12345678,  # someone else entirely
+            ):
+                sender.send(Message(
+                    arbitration_id=arb_id, data=b'\x01\x00\x00\x10\x00'
+                ))
+            received = []
+            msg = receiver.recv(timeout=0.1)
+            while msg is not None:
+                received.append(msg.arbitration_id)
+                msg = receiver.recv(timeout=0.1)
+        finally:
+            sender.shutdown()
+            receiver.shutdown()
+        self.assertEqual(received, [0x1806F4E5, 0x180650E5])
+
+    def test_unpack_unknown_id(self):
+        # IDs outside the table of well-known addresses still unpack
+        eu = ElconUtils(elcon_charger_id)
+        self.assertEqual(eu.unpack_elcon_id(0x18061234), (0x34, 0x12))
+        self.assertEqual(eu.pack_elcon_id(0x34, 0x12), 0x18061234)
+
     def test_pack_status_to_charger(self):
         eu = ElconUtils(elcon_manager_id)
         msg = eu.pack_command(elcon_charger_id, 51.2, 3.2, True)
@@ -60,3 +115,62 @@ class ElconUtilsTests(unittest.TestCase):
         self.assertIsInstance(msg, Message)
         self.assertEqual(msg.arbitration_id, 0x1806F4E5)
         self.assertEqual(msg.data, b'\x02\x00\x00\x20\x0D')
+
+    def test_unpack_status_array(self):
+        eu = ElconUtils(elcon_manager_id)
+        # Two statuses from the charger, one to someone else in between
+        msgs = [
+            Message(arbitration_id=0x1806F4E5, data=b'\x01\x00\x00\x10\x08'),
+            Message(arbitration_id=0x1806E5F4, data=b'\x02\x00\x00\x20\x01'),
+            Message(arbitration_id=0x180650E5, data=b'\x04\xB0\x00\x64\x13'),
+        ]
+        status = eu.unpack_status_array(
+            [m.arbitration_id for m in msgs],
+            b''.join(bytes(m.data) for m in msgs)
+        )
+        self.assertEqual(len(status), 2)
+        # Each row matches what the scalar path gives us
+        scalar = ElconUtils(elcon_manager_id)
+        for row, msg in zip(status, (msgs[0], msgs[2])):
+            self.assertTrue(scalar.unpack_status(msg))
+            self.assertEqual(row['source'], scalar.msg_source)
+            self.assertEqual(row['voltage'], scalar.voltage)
+            self.assertEqual(row['current'], scalar.current)
+            for flag in (
+                'hardware_failure', 'over_temperature', 'input_voltage',
+                'no_battery', 'timeout'
+            ):
+                self.assertEqual(row[flag], getattr(scalar, flag))
+        self.assertEqual(list(status['dest']), [elcon_manager_id, 0x50])
+
+    def test_pack_command_array(self):
+        eu = ElconUtils(elcon_manager_id)
+        volts = [51.2, 0, 120.05, 3.3]
+        amps = [3.2, 1, 10.0, 0.15]
+        ids, data = eu.pack_command_array(elcon_charger_id, volts, amps, True)
+        # The zero voltage command is dropped, as pack_command does
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(data.shape, (3, 5))
+        for arb_id, row, v, i in zip(ids, data, volts[:1] + volts[2:], amps[:1] + amps[2:]):
+            msg = eu.pack_command(elcon_charger_id, v, i, True)
+            self.assertEqual(arb_id, msg.arbitration_id)
+            self.assertEqual(row.tobytes(), bytes(msg.data))
+        # Status flags go out to the rest of the world
+        eu = ElconUtils(elcon_charger_id)
+        eu.hardware_failure = True
+        eu.no_battery = True
+        ids, data = eu.pack_command_array(elcon_manager_id, [51.2], [3.2])
+        self.assertEqual(ids[0], 0x1806F4E5)
+        self.assertEqual(data[0].tobytes(), b'\x02\x00\x00\x20\x09')
+
+    def test_pack_command_array_range(self):
+        eu = ElconUtils(elcon_manager_id)
+        # Setpoints that don't fit are refused, as pack_command refuses them
+        for volts, amps in (([51.2, -1.0], [3.2, 1]), ([6553.6], [1]), ([51.2], [-0.5])):
+            with self.assertRaises(struct.error):
+                eu.pack_command(elcon_charger_id, volts[-1], amps[-1], True)
+            with self.assertRaises(struct.error):
+                eu.pack_command_array(elcon_charger_id, volts, amps, True)
+        # The largest that does fit still packs
+        ids, data = eu.pack_command_array(elcon_charger_id, [6553.5], [0])
+        self.assertEqual(data[0].tobytes()[:2], b'\xff\xff')
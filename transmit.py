@@ -0,0 +1,106 @@
+# transmit - send CANBUS frames from the event loop without blocking it.
+# Licensed under the GPL V3
+
+import asyncio
+import can
+
+from clock import RealClock
+
+
+class TransmitQueue(object):
+    """
+    Queue frames to send on the bus, where the latest frame wins.
+
+    At most one frame is kept waiting for each arbitration ID: a newer frame
+    for the same ID replaces the one waiting (counted in `coalesced`), but
+    keeps its place in the queue.  So when the bus is saturated the queue
+    can't fill up with stale setpoints, and only the freshest one goes out.
+
+    The `run` coroutine sends the frames in turn.  If the bus won't take a
+    frame (such as when the socketcan transmit queue is full), it is retried
+    in a thread off the event loop, backing off from `backoff` seconds up
+    to `max_backoff` seconds, up to `retries` times before it is given up
+    and counted in `dropped`.  A fresher frame for the same ID that turns
+    up while backing off is sent instead.
+
+    Backoff is timed by the given `clock`, which is the real time by
+    default.
+    """
+    retries: int = 5
+    backoff: float = 0.001
+    max_backoff: float = 0.1
+
+    def __init__(self, bus, clock=None):
+        self.bus = bus
+        self.clock = clock if clock is not None else RealClock()
+        # The frames waiting to be sent, by arbitration ID, oldest first
+        self.pending = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.dropped = 0
+        # Set by `run` while it waits for frames
+        self._ready = None
+
+    @property
+    def depth(self) -> int:
+        """
+        The number of frames waiting to be sent.
+        """
+        return len(self.pending)
+
+    def send(self, msg: can.Message):
+        """
+        Queue the frame to be sent, replacing any frame still waiting with
+        the same arbitration ID.  This never blocks.
+        """
+        if msg.arbitration_id in self.pending:
+            self.coalesced += 1
+        self.pending[msg.arbitration_id] = msg
+        if self._ready is not None:
+            self._ready.set()
+
+    async def _transmit(self, arbitration_id: int, msg: can.Message) -> bool:
+        loop = asyncio.get_running_loop()
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt == 0:
+                    self.bus.send(msg)
+                else:
+                    await loop.run_in_executor(None, self.bus.send, msg)
+                self.sent += 1
+                return True
+            except (can.CanError, OSError):
+                if attempt == self.retries:
+                    break
+            self.retried += 1
+            await self.clock.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+            # Send the freshest frame for this ID, if there is one
+            newer = self.pending.pop(arbitration_id, None)
+            if newer is not None:
+                self.coalesced += 1
+                msg = newer
+        self.dropped += 1
+        return False
+
+    async def run(self):
+        """
+        Send the queued frames, oldest first, for as long as we're running.
+        """
+        self._ready = asyncio.Event()
+        while True:
+            if not self.pending:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            arbitration_id = next(iter(self.pending))
+            msg = self.pending.pop(arbitration_id)
+            await self._transmit(arbitration_id, msg)
+
+    def __repr__(self):
+        return (
+            f"TransmitQueue: {self.depth} waiting, {self.sent} sent, "
+            f"{self.coalesced} coalesced, {self.dropped} dropped"
+        )
@@ -3,13 +3,72 @@
 # Licensed under the GPL V3
 
 from can import Message
-from struct import pack, unpack
+import logging
+import numpy as np
+from struct import Struct, error as struct_error
+from time import perf_counter
+from typing import NamedTuple, Optional
+
+log = logging.getLogger(__name__)
 
 elcon_charger_id = 0xE5  # 229
 elcon_manager_id = 0xF4  # 244
 elcon_broadcast_id = 0x50  # 80
 elcon_inverter_id = 0xEF  # 239
 
+# Precompiled layouts of the arbitration ID, as an integer and as its four
+# header bytes, and of the five data bytes.
+_id_struct = Struct('>I')
+_header_struct = Struct('4B')
+_data_struct = Struct('>HHB')
+
+# The layout of the five data bytes in every Elcon message, and of a decoded
+# batch of status messages as returned by `ElconUtils.unpack_status_array`.
+elcon_data_dtype = np.dtype([
+    ('voltage', '>u2'), ('current', '>u2'), ('flags', 'u1'),
+])
+elcon_status_dtype = np.dtype([
+    ('source', 'u1'), ('dest', 'u1'),
+    ('voltage', 'f8'), ('current', 'f8'),
+    ('hardware_failure', '?'), ('over_temperature', '?'),
+    ('input_voltage', '?'), ('no_battery', '?'), ('timeout', '?'),
+])
+
+
+class ChargerStatus(NamedTuple):
+    """
+    One decoded charger status (or command) message.
+
+    This is immutable, so a history of statuses can be kept without copying.
+    Voltage and current are accurate to tenths of a unit, and the individual
+    status flags are available as properties of the `flags` byte.
+    """
+    source: int
+    dest: int
+    voltage: float
+    current: float
+    flags: int
+
+    @property
+    def hardware_failure(self) -> bool:
+        return (self.flags & 0x01) != 0
+
+    @property
+    def over_temperature(self) -> bool:
+        return (self.flags & 0x02) != 0
+
+    @property
+    def input_voltage(self) -> bool:
+        return (self.flags & 0x04) != 0
+
+    @property
+    def no_battery(self) -> bool:
+        return (self.flags & 0x08) != 0
+
+    @property
+    def timeout(self) -> bool:
+        return (self.flags & 0x10) != 0
+
 
 class ElconUtils(object):
     # Settings sent to and received from the charger
@@ -24,6 +83,9 @@ class ElconUtils(object):
     # The CANBUS ID we receive messages to, and send them from
     our_id: int
 
+    # Where to record the time taken to decode each message, if anywhere
+    decode_time = None
+
     # No idea what these are, but keep them as they are for now
     pf = 6
     r = 0
@@ -32,6 +94,21 @@ class ElconUtils(object):
 
     def __init__(self, our_id: int):
         self.our_id = our_id
+        # The number of messages not addressed to us that we've ignored
+        self.rejected = 0
+
+    @property
+    def status_flags(self) -> int:
+        """
+        The object's status flags, packed into the byte a status carries.
+        """
+        return (
+            (0x01 if self.hardware_failure else 0) |
+            (0x02 if self.over_temperature else 0) |
+            (0x04 if self.input_voltage else 0) |
+            (0x08 if self.no_battery else 0) |
+            (0x10 if self.timeout else 0)
+        )
 
     def pack_elcon_id(self, source:int, destination:int) -> int:
         """
@@ -45,20 +122,84 @@ class ElconUtils(object):
                    (self.dp       & 0x01)
         # Ironically the arbitration ID needs to be an integer; we need to
         # unpack it from the bytes.
-        return unpack('>I', pack('4B', top_byte, self.pf, destination, source))[0]
+        return _id_struct.unpack(
+            _header_struct.pack(top_byte, self.pf, destination, source)
+        )[0]
 
     def unpack_elcon_id(self, elcon_id: int):
         """
         Unpack the Elcon header for the destination and source addresses.
 
         This throws the given `pf`, `r`, `dp` and `priority` values away and
-        just returns the destination and source as a tuple.
+        just returns the destination and source as a tuple.  The IDs
+        between the well-known Elcon addresses are looked up in a table.
         """
+        known = _known_ids.get(elcon_id)
+        if known is not None:
+            return known
         # Ironically the arbitration ID is an integer; we need to turn it into
         # bytes to unpack it.
-        top_byte, pf, destination, source = unpack('4B', pack('>I', elcon_id))
+        top_byte, pf, destination, source = _header_struct.unpack(
+            _id_struct.pack(elcon_id)
+        )
         return (source, destination)
 
+    def can_filters(self, sources=None) -> list:
+        """
+        Return the CANBUS filters that accept messages to us or to the
+        broadcast address, for the bus's `set_filters` method.  These let
+        the kernel (where the interface supports it) drop all the traffic
+        that `decode_status` would ignore.
+
+        If `sources` is given, only messages from those addresses are
+        accepted.
+        """
+        destinations = (self.our_id, elcon_broadcast_id)
+        if sources is None:
+            return [
+                {'can_id': dest << 8, 'can_mask': 0xFF00, 'extended': True}
+                for dest in destinations
+            ]
+        return [
+            {'can_id': (dest << 8) | source, 'can_mask': 0xFFFF, 'extended': True}
+            for dest in destinations
+            for source in sources
+        ]
+
+    def decode_status(self, msg: Message) -> Optional[ChargerStatus]:
+        """
+        Given a CANBUS message, attempts to decode the Elcon charger status.
+
+        If this message is to us (or to the broadcast address), then a new
+        `ChargerStatus` is returned.  Otherwise the message is ignored,
+        counted in `rejected`, and `None` is returned.  No other attributes
+        of the object are changed.
+
+        If `decode_time` is set to a `metrics.Histogram`, the time taken to
+        decode each message is recorded in it.
+        """
+        if self.decode_time is None:
+            return self._decode_status(msg)
+        start = perf_counter()
+        status = self._decode_status(msg)
+        self.decode_time.record(perf_counter() - start)
+        return status
+
+    def _decode_status(self, msg: Message) -> Optional[ChargerStatus]:
+        (pkt_source, pkt_dest) = self.unpack_elcon_id(msg.arbitration_id)
+        # Receive a message from a source to us (the destination)
+        if not (pkt_dest == self.our_id or pkt_dest == elcon_broadcast_id):
+            self.rejected += 1
+            log.debug(
+                "Ignoring message from %#04x to %#04x", pkt_source, pkt_dest
+            )
+            return None
+
+        (voltage, current, flags) = _data_struct.unpack(msg.data)
+        return ChargerStatus(
+            pkt_source, pkt_dest, voltage / 10, current / 10, flags
+        )
+
     def unpack_status(self, msg: Message):
         """
         Given a CANBUS message, attempts to unpack the Elcon charger status.
@@ -70,25 +211,25 @@ class ElconUtils(object):
         indicate that the status is up to date.  Voltage and current are
         accurate to tenths of a unit.
 
-        If this message is not from the Elcon charger, then it is ignored, and
-        `False` is returned to indicate that the charger status values have
-        not changed since the last message was received.
+        If this message is not from the Elcon charger, then it is ignored and
+        counted in `rejected`, and `False` is returned to indicate that the
+        charger status values have not changed since the last message was
+        received.
+
+        `decode_status` does the same without changing the object.
         """
-        (pkt_source, pkt_dest) = self.unpack_elcon_id(msg.arbitration_id)
-        # Receive a message from a source to us (the destination)
-        if not (pkt_dest == self.our_id or pkt_dest == elcon_broadcast_id):
-            print(f"Ignoring message from {pkt_source} to {pkt_dest}")
+        status = self.decode_status(msg)
+        if status is None:
             return False  # Status is not up to date
 
-        (voltage, current, flags) = unpack('>HHB', msg.data)
-        self.msg_source = pkt_source
-        self.voltage = float(voltage) / 10
-        self.current = float(current) / 10
-        self.hardware_failure = (flags & 0x01) != 0
-        self.over_temperature = (flags & 0x02) != 0
-        self.input_voltage = (flags & 0x04) != 0
-        self.no_battery = (flags & 0x08) != 0
-        self.timeout = (flags & 0x10) != 0
+        self.msg_source = status.source
+        self.voltage = status.voltage
+        self.current = status.current
+        self.hardware_failure = status.hardware_failure
+        self.over_temperature = status.over_temperature
+        self.input_voltage = status.input_voltage
+        self.no_battery = status.no_battery
+        self.timeout = status.timeout
         return True  # Status is up to date, can use properties
 
     def pack_command(
@@ -100,10 +241,11 @@ class ElconUtils(object):
         state to the rest of the world.
 
         The message is sent from the class's ID, and uses the class's current
-        flags (as packed by `pack_elcon_id` above).
+        flags (as packed by `pack_elcon_id` above).  Everything the manager
+        sends, to whichever charger address, is a command.
         """
         if voltage == 0:
-            print("Not sending a message - voltage must be positive")
+            log.warning("Not sending a message - voltage must be positive")
             return None
         msg = Message()
         v = int(voltage * 10)
@@ -112,22 +254,111 @@ class ElconUtils(object):
         # Send a message from us (source) to the destination
         msg.arbitration_id = self.pack_elcon_id(self.our_id, pkt_dest)
         flags = 0
-        if pkt_dest == elcon_charger_id:
+        if pkt_dest == elcon_charger_id or self.our_id == elcon_manager_id:
             # Message to charger
             flags = 1 if enable else 0
         else:
             # Message from charger to rest of world
-            if self.hardware_failure:
-                flags |= 0x01
-            if self.over_temperature:
-                flags |= 0x02
-            if self.input_voltage:
-                flags |= 0x04
-            if self.no_battery:
-                flags |= 0x08
-            if self.timeout:
-                flags |= 0x10
-
-        msg.data = pack(">HHB", v, i, flags)
+            flags = self.status_flags
+
+        msg.data = _data_struct.pack(v, i, flags)
         msg.is_extended_id = True
         return msg
+
+    def unpack_status_array(self, arbitration_ids, data) -> np.ndarray:
+        """
+        Unpack a batch of CANBUS messages into an array of charger statuses.
+
+        `arbitration_ids` is a sequence of N arbitration IDs and `data` is
+        either an (N, 5) array of bytes or a single `bytes` object of N
+        five-byte payloads.  The result is a structured array of
+        `elcon_status_dtype`, holding one row per message that
+        `unpack_status` would have accepted (i.e. sent to us or to the
+        broadcast address), in the order they were given.
+
+        The object's own status attributes are not changed, but the ignored
+        messages are counted in `rejected`.
+        """
+        ids = np.asarray(arbitration_ids, dtype=np.uint32)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(data, dtype=np.uint8)
+        raw = np.ascontiguousarray(data, dtype=np.uint8).reshape(-1, 5)
+        if len(ids) != len(raw):
+            raise ValueError(
+                f"Got {len(ids)} arbitration IDs but {len(raw)} payloads"
+            )
+        source = (ids & 0xFF).astype(np.uint8)
+        dest = ((ids >> 8) & 0xFF).astype(np.uint8)
+        keep = (dest == self.our_id) | (dest == elcon_broadcast_id)
+        fields = raw[keep].view(elcon_data_dtype).reshape(-1)
+        self.rejected += len(ids) - len(fields)
+        flags = fields['flags']
+
+        status = np.empty(len(fields), dtype=elcon_status_dtype)
+        status['source'] = source[keep]
+        status['dest'] = dest[keep]
+        status['voltage'] = fields['voltage'] / 10
+        status['current'] = fields['current'] / 10
+        status['hardware_failure'] = (flags & 0x01) != 0
+        status['over_temperature'] = (flags & 0x02) != 0
+        status['input_voltage'] = (flags & 0x04) != 0
+        status['no_battery'] = (flags & 0x08) != 0
+        status['timeout'] = (flags & 0x10) != 0
+        return status
+
+    def pack_command_array(
+        self, pkt_dest: int, voltage, current, enable=True
+    ):
+        """
+        Pack a batch of commands (or statuses), as `pack_command` does for
+        a single message.
+
+        `voltage` and `current` are sequences of N setpoints, and `enable`
+        may be a single flag or a sequence of N flags; it is only used for
+        messages to the charger.  Messages to anyone else carry the
+        object's current status flags, as in `pack_command`.
+
+        Returns a tuple of an array of arbitration IDs and an (N, 5) array
+        of data bytes.  Rows with zero voltage, for which `pack_command`
+        would not produce a message, are left out of both.  A setpoint that
+        doesn't fit in the frame raises `struct.error`, as it does in
+        `pack_command`.
+        """
+        voltage = np.asarray(voltage, dtype=np.float64)
+        current = np.asarray(current, dtype=np.float64)
+        keep = voltage != 0
+
+        fields = np.empty(np.count_nonzero(keep), dtype=elcon_data_dtype)
+        # Truncate towards zero, as int() does in `pack_command`
+        tenths = (np.trunc(voltage[keep] * 10), np.trunc(current[keep] * 10))
+        for values in tenths:
+            if not np.all((values >= 0) & (values <= 0xFFFF)):
+                raise struct_error(
+                    f"Setpoints must be from 0 to {0xFFFF / 10}"
+                )
+        fields['voltage'], fields['current'] = tenths
+        if pkt_dest == elcon_charger_id or self.our_id == elcon_manager_id:
+            enable = np.broadcast_to(np.asarray(enable, dtype=bool), voltage.shape)
+            fields['flags'] = enable[keep]
+        else:
+            fields['flags'] = self.status_flags
+
+        ids = np.full(
+            len(fields), self.pack_elcon_id(self.our_id, pkt_dest),
+            dtype=np.uint32
+        )
+        return (ids, fields.view(np.uint8).reshape(-1, 5))
+
+
+# The arbitration IDs between the well-known Elcon addresses, with the
+# default header, mapped to their (source, destination) tuples.
+_known_addresses = (
+    elcon_charger_id, elcon_manager_id, elcon_broadcast_id, elcon_inverter_id
+)
+_default_header = ElconUtils(our_id=elcon_manager_id)
+_known_ids = {
+    _default_header.pack_elcon_id(source, dest): (source, dest)
+    for source in _known_addresses
+    for dest in _known_addresses
+    if source != dest
+}